@@ -3,34 +3,58 @@
 Initializes app, defines routes, and integrates all services.
 """
 
-from flask import Flask, jsonify, request, render_template
+from flask import Flask, Response, jsonify, request, render_template
 import os
 import subprocess
 import yaml
 import json
 import shlex
-import re
+import threading
 from pathlib import Path
-from datetime import datetime
 from dotenv import load_dotenv
 
 # Import our modular services
-from beets_utils import get_beets_bin, clean_field, parse_stats
+from beets_utils import get_beets_bin
 from config_manager import (
-    AVAILABLE_PLUGINS, read_config, write_config, 
-    get_installed_plugins, create_default_config
+    AVAILABLE_PLUGINS, read_config, write_config, update_config, config_lock,
+    get_discovered_plugins, create_default_config,
+    config_signature, plugins_signature
 )
-from lyrics_service import get_track_lyrics, set_track_lyrics, fetch_lyrics_for_track
-from lrclib_service import parse_duration
+from lyrics_service import get_track_lyrics, set_track_lyrics, fetch_lyrics_for_track, fetch_lyrics_batch, get_active_line
+import beets_library
+import library_cache
+from library_query import query_page, parse_page_args
+from search_index import search_library
+from facets import get_facets, FACETS, FACET_SORTS
+import jobs
+import file_browser
+import dir_scanner
+import watcher
+import metrics
+import response_encoding
+from conditional import etag
 
 load_dotenv()
 
 # Create Flask app
 app = Flask(__name__)
+metrics.init_app(app)
+response_encoding.init_app(app)
 
 # Get beets binary path
 BEETS_BIN = get_beets_bin()
 
+# Query parameters that switch /api/library into paged mode
+PAGE_ARGS = ('offset', 'limit', 'sort', 'order', 'q', 'genre')
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+# Most tracks a single batch request may touch
+MAX_BATCH_SIZE = 10000
+
+ALLOWED_COMMANDS = ['import', 'list', 'update', 'modify', 'config', 'version', 'stats']
+
+
 # --- Utility Functions ---
 
 def is_path_safe(path):
@@ -51,13 +75,32 @@ def is_path_safe(path):
     except:
         return False
 
-def format_timestamp(timestamp):
-    """Format timestamp for display."""
+def parse_command_args(args_string):
+    """Split a command argument string, keeping quoted paths together."""
+    if not args_string:
+        return []
     try:
-        dt = datetime.fromtimestamp(timestamp)
-        return dt.strftime('%Y-%m-%d %H:%M')
-    except:
-        return ''
+        return shlex.split(args_string)
+    except ValueError as e:
+        app.logger.warning(f"Failed to parse args with shlex: {e}, falling back to simple split")
+    args = []
+    current_arg = ""
+    in_quotes = False
+    i = 0
+    while i < len(args_string):
+        char = args_string[i]
+        if char == '"' and (i == 0 or args_string[i-1] != '\\'):
+            in_quotes = not in_quotes
+        elif char == ' ' and not in_quotes:
+            if current_arg:
+                args.append(current_arg)
+                current_arg = ""
+        else:
+            current_arg += char
+        i += 1
+    if current_arg:
+        args.append(current_arg)
+    return args
 
 def run_beets_command(args):
     # Ensure --yes is present for non-interactive mode
@@ -68,7 +111,8 @@ def run_beets_command(args):
         if '--yes' not in args and '-y' not in args:
             args += ' --yes'
     # Run the beets command
-    result = subprocess.run(args, capture_output=True, text=True)
+    with metrics.time_command(args):
+        result = subprocess.run(args, capture_output=True, text=True)
     return result
 
 # --- Routes ---
@@ -77,59 +121,55 @@ def run_beets_command(args):
 def index():
     return render_template('index.html')
 
+def library_signature():
+    """ETag token for views derived only from the library snapshot.
+
+    The ndjson stream only uses a snapshot that is already up to date, so
+    its token must not build one either; without one it goes unvalidated.
+    """
+    try:
+        snapshot = library_cache.peek_snapshot() if wants_ndjson() else library_cache.get_snapshot()
+    except Exception:
+        # Let the view itself report the error
+        return None
+    return (library_cache.EPOCH, snapshot.revision) if snapshot is not None else None
+
+def stats_signature():
+    """ETag token for /api/stats, which also covers fields the snapshot items leave out."""
+    try:
+        snapshot = library_cache.get_snapshot()
+        return library_cache.EPOCH, snapshot.revision, snapshot.signature
+    except Exception:
+        return None
+
+def plugins_etag_token():
+    # Discover first, so the token covers the list the view is about to return
+    get_discovered_plugins()
+    return plugins_signature()
+
 @app.route('/api/library')
+@etag(library_signature)
 def get_library():
-    """Fetches the entire music library from beets."""
+    """Fetches the music library from beets.
+
+    Without paging parameters the entire library is returned. When any of
+    offset/limit/sort/order/q/genre is given, only the requested page is
+    returned together with the total number of matches. With format=ndjson
+    or an Accept header of application/x-ndjson the full library is streamed
+    as newline-delimited JSON instead. Items can also be sent columnar or as
+    MessagePack; see response_encoding.
+    """
+    if wants_ndjson():
+        return stream_library()
     try:
-        cmd = [BEETS_BIN, 'list', '--format', '$id\t$title\t$artist\t$album\t$genre\t$year\t$length\t$bitrate\t$path']
-        process = subprocess.run(cmd, capture_output=True, text=True, check=True, env=os.environ.copy())
-        output_lines = process.stdout.strip().split('\n')
-        
-        items = []
-        for line in output_lines:
-            if not line or line.strip() == '':
-                continue
-            parts = line.split('\t')
-            if len(parts) >= 9:
-                # Parse year
-                year = None
-                year_str = clean_field(parts[5], 'year')
-                if year_str and year_str.isdigit():
-                    try:
-                        year = int(year_str)
-                    except ValueError:
-                        pass
-
-                # Parse length for library tracks only, not for lyrics
-                length = None
-                length_str = clean_field(parts[6], 'length')
-                if length_str:
-                    length = parse_duration(length_str)
-
-                # Parse bitrate
-                bitrate = None
-                bitrate_str = clean_field(parts[7], 'bitrate')
-                if bitrate_str:
-                    bitrate_clean = re.sub(r'kbps$', '', bitrate_str).strip()
-                    try:
-                        bitrate = int(float(bitrate_clean))
-                    except ValueError:
-                        pass
-
-                item = {
-                    'id': clean_field(parts[0], 'id') or 'unknown',
-                    'title': clean_field(parts[1], 'title') or 'Unknown Title',
-                    'artist': clean_field(parts[2], 'artist') or 'Unknown Artist',
-                    'album': clean_field(parts[3], 'album') or 'Unknown Album',
-                    'genre': clean_field(parts[4], 'genre'),
-                    'year': year,
-                    'length': length,
-                    'bitrate': bitrate,
-                    'path': clean_field(parts[8], 'path') or ''
-                }
-                items.append(item)
-
-        return jsonify({'items': items})
+        snapshot = library_cache.get_snapshot()
+        sync = {'revision': snapshot.revision, 'epoch': library_cache.EPOCH}
+        if not any(arg in request.args for arg in PAGE_ARGS):
+            return response_encoding.respond(
+                {'items': snapshot.items, **sync},
+                cache_key=('library', library_cache.EPOCH, snapshot.revision)
+            )
+        return response_encoding.respond({**query_page(snapshot.items, **parse_page_args(request.args)), **sync})
     except subprocess.CalledProcessError as e:
         app.logger.error(f"Error listing library: {e.stderr}")
         return jsonify({'error': f"Failed to list library: {e.stderr}"}), 500
@@ -137,6 +177,97 @@ def get_library():
         app.logger.error(f"Error getting library: {e}")
         return jsonify({'error': f"An unexpected error occurred: {e}"}), 500
 
+def wants_ndjson():
+    """Whether the client asked for the newline-delimited JSON library stream."""
+    if request.args.get('format') == 'ndjson':
+        return True
+    accept = request.accept_mimetypes
+    return accept[NDJSON_MIMETYPE] > accept['application/json']
+
+def stream_library():
+    """Streams every library item as one JSON object per line.
+
+    Served from the snapshot when it is already up to date; otherwise items
+    are read straight from beets so the full library is never held in memory.
+    """
+    snapshot = library_cache.peek_snapshot()
+    headers = {'X-Library-Epoch': library_cache.EPOCH}
+    if snapshot is not None:
+        source = iter(snapshot.items)
+        headers['X-Library-Revision'] = str(snapshot.revision)
+    else:
+        source = beets_library.iter_items()
+
+    def generate():
+        try:
+            for item in source:
+                yield json.dumps(item) + '\n'
+        except subprocess.CalledProcessError as e:
+            app.logger.error(f"Error streaming library: {e.stderr}")
+        except Exception as e:
+            app.logger.error(f"Error streaming library: {e}")
+
+    return Response(generate(), mimetype=NDJSON_MIMETYPE, headers=headers)
+
+@app.route('/api/library/changes')
+def get_library_changes():
+    """Returns the items added, modified and removed since a library revision."""
+    try:
+        since = int(request.args.get('since', ''))
+    except ValueError:
+        return jsonify({'error': 'A numeric since revision is required'}), 400
+    try:
+        return jsonify(library_cache.get_changes(since, request.args.get('epoch')))
+    except subprocess.CalledProcessError as e:
+        app.logger.error(f"Error listing library changes: {e.stderr}")
+        return jsonify({'error': f"Failed to list library changes: {e.stderr}"}), 500
+    except Exception as e:
+        app.logger.error(f"Error getting library changes: {e}")
+        return jsonify({'error': f"An unexpected error occurred: {e}"}), 500
+
+@app.route('/api/library/search')
+def search_library_items():
+    """Ranked full-text search over title, artist, album, genre and path."""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'items': [], 'total': 0})
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), 500)
+    except ValueError:
+        limit = 20
+    fuzzy = request.args.get('fuzzy', '1').lower() not in ('0', 'false', 'no')
+    try:
+        return jsonify(search_library(query, limit=limit, fuzzy=fuzzy))
+    except subprocess.CalledProcessError as e:
+        app.logger.error(f"Error searching library: {e.stderr}")
+        return jsonify({'error': f"Failed to search library: {e.stderr}"}), 500
+    except Exception as e:
+        app.logger.error(f"Error searching library: {e}")
+        return jsonify({'error': f"An unexpected error occurred: {e}"}), 500
+
+@app.route('/api/facets')
+def get_library_facets():
+    """Per-artist, album, genre and year aggregates for browse views and filters."""
+    names = [name.strip() for name in request.args.get('facet', '').split(',') if name.strip()]
+    unknown = [name for name in names if name not in FACETS]
+    if unknown:
+        return jsonify({'error': f"Unknown facet(s): {', '.join(unknown)}"}), 400
+    sort = request.args.get('sort', 'count')
+    if sort not in FACET_SORTS:
+        return jsonify({'error': f"Sort must be one of: {', '.join(FACET_SORTS)}"}), 400
+    try:
+        limit = max(int(request.args.get('limit', 0)), 0) or None
+    except ValueError:
+        limit = None
+    try:
+        return jsonify(get_facets(names, sort=sort, limit=limit, prefix=request.args.get('prefix')))
+    except subprocess.CalledProcessError as e:
+        app.logger.error(f"Error computing facets: {e.stderr}")
+        return jsonify({'error': f"Failed to compute facets: {e.stderr}"}), 500
+    except Exception as e:
+        app.logger.error(f"Error computing facets: {e}")
+        return jsonify({'error': f"An unexpected error occurred: {e}"}), 500
+
 @app.route('/api/library/edit', methods=['POST'])
 def edit_library_item():
     """Edits a specific item in the music library."""
@@ -148,18 +279,18 @@ def edit_library_item():
         if not item_id:
             return jsonify({'error': 'Item ID is required'}), 400
         
-        cmd = [BEETS_BIN, 'modify', f'id:{item_id}']
-        
-        for field, value in updates.items():
-            if value:
-                cmd.append(f'{field}={value}')
+        updates = {field: value for field, value in updates.items() if value}
         
-        if len(cmd) <= 3:
+        if not updates:
             return jsonify({'error': 'No updates provided'}), 400
         
-        process = subprocess.run(cmd, capture_output=True, text=True, check=True, env=os.environ.copy())
+        if not beets_library.modify_item(item_id, updates):
+            return jsonify({'error': 'Track not found'}), 404
+        library_cache.invalidate()
         return jsonify({'message': 'Track updated successfully'})
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except subprocess.CalledProcessError as e:
         app.logger.error(f"Error editing track: {e.stderr}")
         return jsonify({'error': f"Failed to edit track: {e.stderr}"}), 500
@@ -167,6 +298,72 @@ def edit_library_item():
         app.logger.error(f"Error editing track: {e}")
         return jsonify({'error': f"An unexpected error occurred: {e}"}), 500
 
+@app.route('/api/library/batch-edit', methods=['POST'])
+def batch_edit_library_items():
+    """Applies many metadata edits in one transaction.
+
+    Accepts either {"edits": [{"id": ..., "updates": {...}}, ...]} or
+    {"query": "<beets query>", "updates": {...}} to apply shared updates to
+    every matching track. Returns a result per track.
+    """
+    try:
+        data = request.json or {}
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Request body must be a JSON object'}), 400
+        if 'edits' in data:
+            if not isinstance(data['edits'], list):
+                return jsonify({'error': 'edits must be a list'}), 400
+            invalid = [
+                {'index': index, 'edit': edit}
+                for index, edit in enumerate(data['edits'])
+                if not isinstance(edit, dict)
+                or not isinstance(edit.get('id'), int) or isinstance(edit.get('id'), bool)
+                or not isinstance(edit.get('updates'), dict)
+            ]
+            if invalid:
+                return jsonify({
+                    'error': 'Each edit must be an object with an integer id and an updates object',
+                    'invalid': invalid
+                }), 400
+            edits = []
+            for edit in data['edits']:
+                updates = {field: value for field, value in edit['updates'].items() if value}
+                if updates:
+                    edits.append((edit['id'], updates))
+        elif data.get('query'):
+            if not isinstance(data.get('updates'), dict):
+                return jsonify({'error': 'updates must be an object'}), 400
+            updates = {field: value for field, value in data['updates'].items() if value}
+            if not updates:
+                return jsonify({'error': 'No updates provided'}), 400
+            edits = [(item_id, updates) for item_id in beets_library.query_item_ids(data['query'])]
+            if not edits:
+                return jsonify({'message': 'No tracks matched the query', 'updated': 0, 'failed': 0, 'results': []})
+        else:
+            return jsonify({'error': 'Either edits or query is required'}), 400
+
+        if not edits:
+            return jsonify({'error': 'No updates provided'}), 400
+        if len(edits) > MAX_BATCH_SIZE:
+            return jsonify({'error': f'At most {MAX_BATCH_SIZE} tracks can be edited at once'}), 400
+
+        results = beets_library.modify_items(edits)
+        library_cache.invalidate()
+        updated = sum(1 for result in results if result['status'] == 'updated')
+        return jsonify({
+            'message': f'{updated} of {len(results)} tracks updated',
+            'updated': updated,
+            'failed': len(results) - updated,
+            'results': results
+        })
+
+    except subprocess.CalledProcessError as e:
+        app.logger.error(f"Error batch editing tracks: {e.stderr}")
+        return jsonify({'error': f"Failed to edit tracks: {e.stderr}"}), 500
+    except Exception as e:
+        app.logger.error(f"Error batch editing tracks: {e}")
+        return jsonify({'error': f"An unexpected error occurred: {e}"}), 500
+
 @app.route('/api/library/remove', methods=['POST'])
 def remove_library_item():
     """Removes an item from the music library."""
@@ -188,21 +385,59 @@ def remove_library_item():
             return jsonify({'error': 'Title, artist, or album must be provided'}), 400
         
         query = ' '.join(query_parts)
-        cmd = [BEETS_BIN, 'remove', '-d', query]
-        
-        process = subprocess.run(cmd, capture_output=True, text=True, input='y\n', env=os.environ.copy())
+        beets_library.remove_items(query, delete=True)
+        library_cache.invalidate()
         return jsonify({'message': 'Track removed successfully'})
         
     except Exception as e:
         app.logger.error(f"Error removing track: {e}")
         return jsonify({'error': f"Failed to remove track: {e}"}), 500
 
+@app.route('/api/library/bulk-remove', methods=['POST'])
+def bulk_remove_library_items():
+    """Removes a set of tracks by id in one transaction.
+
+    Body: {"ids": [...], "delete_files": false, "dry_run": false}. A dry run
+    returns the tracks that would be removed without touching the library.
+    """
+    try:
+        data = request.json or {}
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Request body must be a JSON object'}), 400
+        ids = data.get('ids')
+        if not isinstance(ids, list) or not ids:
+            return jsonify({'error': 'ids must be a non-empty list of track IDs'}), 400
+        if not all(isinstance(item_id, int) and not isinstance(item_id, bool) for item_id in ids):
+            return jsonify({'error': 'Track IDs must be integers'}), 400
+        item_ids = list(dict.fromkeys(ids))
+        if len(item_ids) > MAX_BATCH_SIZE:
+            return jsonify({'error': f'At most {MAX_BATCH_SIZE} tracks can be removed at once'}), 400
+
+        dry_run = bool(data.get('dry_run'))
+        result = beets_library.remove_items_by_id(
+            item_ids, delete_files=bool(data.get('delete_files')), dry_run=dry_run
+        )
+        if dry_run:
+            result['message'] = f"{len(result['items'])} tracks would be removed"
+        else:
+            library_cache.invalidate()
+            result['message'] = f"{len(result['removed'])} tracks removed"
+        return jsonify(result)
+
+    except subprocess.CalledProcessError as e:
+        app.logger.error(f"Error removing tracks: {e.stderr}")
+        return jsonify({'error': f"Failed to remove tracks: {e.stderr}"}), 500
+    except Exception as e:
+        app.logger.error(f"Error removing tracks: {e}")
+        return jsonify({'error': f"An unexpected error occurred: {e}"}), 500
+
 @app.route('/api/library/delete', methods=['POST'])
 def delete_library_item():
     """Deletes an item from the music library (alias for remove)."""
     return remove_library_item()
 
 @app.route('/api/config', methods=['GET', 'POST'])
+@etag(config_signature)
 def handle_config():
     """Handles retrieval and updating of the main configuration."""
     if request.method == 'GET':
@@ -224,7 +459,9 @@ def handle_config():
             
             config_data = yaml.safe_load(config_string)
             
-            if write_config(config_data):
+            with config_lock():
+                saved = write_config(config_data)
+            if saved:
                 return jsonify({'message': 'Configuration saved successfully. Restart the application for changes to take effect.'})
             return jsonify({'error': 'Failed to save configuration.'}), 500
             
@@ -234,16 +471,15 @@ def handle_config():
             app.logger.error(f"Error saving config: {e}")
             return jsonify({'error': 'Failed to save configuration'}), 500
 
-@app.route('/api/plugins', methods=['GET'])
-def get_plugins():
-    """Retrieves the status of all available and installed plugins."""
+def plugins_status():
+    """Builds the plugin list: the curated plugins first, then discovered third-party ones."""
     config = read_config()
     enabled_plugins = config.get('plugins', [])
-    installed_plugins = get_installed_plugins()
+    discovered = get_discovered_plugins()
 
     all_plugins_status = []
     for name, details in AVAILABLE_PLUGINS.items():
-        is_installed = name in installed_plugins
+        is_installed = name in discovered
         is_enabled = name in enabled_plugins
         is_built_in = details.get('built_in', False)
         
@@ -256,8 +492,32 @@ def get_plugins():
             'config_template': details.get('config_template', {})
         }
         all_plugins_status.append(plugin_info)
+
+    for name, details in discovered.items():
+        if details['built_in'] or name in AVAILABLE_PLUGINS:
+            continue
+        all_plugins_status.append({
+            'name': name,
+            'description': f"Third-party plugin from {details['distribution'] or 'an unknown package'}",
+            'installed': True,
+            'enabled': name in enabled_plugins,
+            'built_in': False,
+            'config_template': {}
+        })
     
-    return jsonify({'available': all_plugins_status, 'enabled_in_config': enabled_plugins})
+    return {'available': all_plugins_status, 'enabled_in_config': enabled_plugins}
+
+@app.route('/api/plugins', methods=['GET'])
+@etag(plugins_etag_token)
+def get_plugins():
+    """Retrieves the status of all available and installed plugins."""
+    return jsonify(plugins_status())
+
+@app.route('/api/plugins/refresh', methods=['POST'])
+def refresh_plugins():
+    """Rediscovers installed plugins, e.g. after installing a package, and returns their status."""
+    get_discovered_plugins(refresh=True)
+    return jsonify(plugins_status())
 
 @app.route('/api/plugins/enable', methods=['POST'])
 def enable_plugin():
@@ -268,12 +528,12 @@ def enable_plugin():
     if not plugin_name:
         return jsonify({'error': 'Plugin name is required.'}), 400
 
-    config = read_config()
-    current_plugins = set(config.get('plugins', []))
-    current_plugins.add(plugin_name)
-    config['plugins'] = sorted(list(current_plugins))
+    def enable(config):
+        current_plugins = set(config.get('plugins', []))
+        current_plugins.add(plugin_name)
+        config['plugins'] = sorted(list(current_plugins))
 
-    if write_config(config):
+    if update_config(enable):
         return jsonify({'message': f"Plugin '{plugin_name}' enabled."})
     return jsonify({'error': 'Failed to enable plugin.'}), 500
 
@@ -286,12 +546,12 @@ def disable_plugin():
     if not plugin_name:
         return jsonify({'error': 'Plugin name is required.'}), 400
 
-    config = read_config()
-    current_plugins = set(config.get('plugins', []))
-    current_plugins.discard(plugin_name)
-    config['plugins'] = sorted(list(current_plugins))
+    def disable(config):
+        current_plugins = set(config.get('plugins', []))
+        current_plugins.discard(plugin_name)
+        config['plugins'] = sorted(list(current_plugins))
 
-    if write_config(config):
+    if update_config(disable):
         return jsonify({'message': f"Plugin '{plugin_name}' disabled."})
     return jsonify({'error': 'Failed to disable plugin.'}), 500
 
@@ -305,17 +565,17 @@ def toggle_plugin():
     if not plugin_name:
         return jsonify({'error': 'Plugin name is required.'}), 400
 
-    config = read_config()
-    current_plugins = set(config.get('plugins', []))
+    def toggle(config):
+        current_plugins = set(config.get('plugins', []))
 
-    if enable:
-        current_plugins.add(plugin_name)
-    else:
-        current_plugins.discard(plugin_name)
-    
-    config['plugins'] = sorted(list(current_plugins))
+        if enable:
+            current_plugins.add(plugin_name)
+        else:
+            current_plugins.discard(plugin_name)
+        
+        config['plugins'] = sorted(list(current_plugins))
 
-    if write_config(config):
+    if update_config(toggle):
         return jsonify({'message': f"Plugin '{plugin_name}' {'enabled' if enable else 'disabled'}."})
     return jsonify({'error': 'Failed to update plugin status.'}), 500
 
@@ -359,72 +619,54 @@ def handle_plugin_config(plugin_name):
         if not isinstance(config_data, dict):
             return jsonify({'error': 'Invalid configuration data. Must be a dictionary.'}), 400
 
-        full_config = read_config()
-        
-        if plugin_name not in full_config:
-            full_config[plugin_name] = {}
-        
-        full_config[plugin_name].update(config_data)
+        def update_plugin_config(full_config):
+            if plugin_name not in full_config:
+                full_config[plugin_name] = {}
+            
+            full_config[plugin_name].update(config_data)
 
-        if write_config(full_config):
+        if update_config(update_plugin_config):
             return jsonify({'message': f"Configuration for plugin '{plugin_name}' saved successfully."})
         return jsonify({'error': 'Failed to save plugin configuration.'}), 500
 
 @app.route('/api/execute', methods=['POST'])
 def execute_command():
-    """Executes a beets command with the given arguments."""
+    """Executes a beets command with the given arguments.
+
+    With "background": true the command is queued as a job instead, and the
+    response carries the job id to follow via /api/jobs/<id>/stream.
+    """
     data = request.json
+    return start_command(data, background=bool(data.get('background')))
+
+def start_command(data, background=False):
+    """Validates a command request and runs it, or queues it as a job."""
     command = data.get('command')
     args_string = data.get('args', '')
     
     if not command:
         return jsonify({'error': 'Command is required.'}), 400
 
-    allowed_commands = ['import', 'list', 'update', 'modify', 'config', 'version', 'stats']
-    if command not in allowed_commands:
+    if command not in ALLOWED_COMMANDS:
         return jsonify({'error': f"Command '{command}' is not allowed."}), 403
 
-    # Parse args string into list with proper handling of quoted paths
-    args = []
-    if args_string:
-        try:
-            args = shlex.split(args_string)
-        except ValueError as e:
-            app.logger.warning(f"Failed to parse args with shlex: {e}, falling back to simple split")
-            args = []
-            current_arg = ""
-            in_quotes = False
-            i = 0
-            while i < len(args_string):
-                char = args_string[i]
-                if char == '"' and (i == 0 or args_string[i-1] != '\\'):
-                    in_quotes = not in_quotes
-                elif char == ' ' and not in_quotes:
-                    if current_arg:
-                        args.append(current_arg)
-                        current_arg = ""
-                else:
-                    current_arg += char
-                i += 1
-            if current_arg:
-                args.append(current_arg)
-
     # Build the full command
-    full_cmd = [BEETS_BIN, command] + args
+    full_cmd = [BEETS_BIN, command] + parse_command_args(args_string)
 
-    # Ensure all beets commands are non-interactive by adding '--yes' if not present
-    if command.startswith('beet') and '--yes' not in command and '-y' not in command:
-        command += ' --yes'
+    if background:
+        job = jobs.submit_command(full_cmd, description=f"beet {command} {args_string}".strip())
+        return jsonify({'message': 'Command queued', 'job_id': job.id, 'job': job.to_dict()}), 202
     
     try:
-        process = subprocess.run(
-            full_cmd, 
-            capture_output=True, 
-            text=True, 
-            check=True, 
-            env=os.environ.copy(),
-            timeout=300
-        )
+        with metrics.time_command(full_cmd):
+            process = subprocess.run(
+                full_cmd, 
+                capture_output=True, 
+                text=True, 
+                check=True, 
+                env=os.environ.copy(),
+                timeout=300
+            )
         return jsonify({
             'message': 'Command executed successfully', 
             'output': process.stdout, 
@@ -447,40 +689,72 @@ def run_command():
     """Runs a beets command (alias for execute)."""
     return execute_command()
 
+# Background job endpoints
+@app.route('/api/jobs', methods=['GET', 'POST'])
+def handle_jobs():
+    """Lists recent jobs or queues a beets command as a background job."""
+    if request.method == 'GET':
+        try:
+            limit = min(max(int(request.args.get('limit', 50)), 1), jobs.MAX_HISTORY)
+        except ValueError:
+            limit = 50
+        return jsonify({'jobs': jobs.list_jobs(limit)})
+
+    return start_command(request.json or {}, background=True)
+
+@app.route('/api/jobs/<job_id>')
+def get_job(job_id):
+    """Returns a job's status and captured output."""
+    info = jobs.get_job_info(job_id, include_output=True)
+    if info is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(info)
+
+@app.route('/api/jobs/<job_id>/stream')
+def stream_job(job_id):
+    """Streams a job's output, progress and final status as Server-Sent Events."""
+    if jobs.get_job_info(job_id) is None:
+        return jsonify({'error': 'Job not found'}), 404
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID', -1))
+    except ValueError:
+        last_event_id = -1
+    return Response(
+        jobs.stream_events(job_id, last_event_id),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Cancels a queued or running job."""
+    if not jobs.cancel(job_id):
+        return jsonify({'error': 'Job not found or already finished'}), 404
+    return jsonify({'message': 'Job cancelled'})
+
 @app.route('/api/browse', methods=['GET'])
 def browse_files():
-    """Browses files and directories at the given path."""
+    """Browses files and directories at the given path.
+
+    Supports offset/limit paging and a case-insensitive name filter `q`;
+    without a limit the whole directory is returned.
+    """
     path = request.args.get('path', '/')
     
     if not is_path_safe(path):
         return jsonify({'error': 'Access denied to this path.'}), 403
 
     try:
-        items = []
-        with os.scandir(path) as entries:
-            for entry in entries:
-                if entry.is_dir():
-                    items.append({
-                        'name': entry.name,
-                        'path': entry.path,
-                        'type': 'directory',
-                        'size': None,
-                        'modified': format_timestamp(entry.stat().st_mtime)
-                    })
-                elif entry.is_file():
-                    items.append({
-                        'name': entry.name,
-                        'path': entry.path,
-                        'type': 'file',
-                        'size': entry.stat().st_size,
-                        'modified': format_timestamp(entry.stat().st_mtime)
-                    })
-        
-        items.sort(key=lambda x: (x['type'] != 'directory', x['name'].lower()))
-        parent_path = str(Path(path).parent) if path != '/' else None
+        offset = max(int(request.args.get('offset', 0)), 0)
+        limit = request.args.get('limit')
+        limit = min(max(int(limit), 1), file_browser.MAX_LIMIT) if limit else None
+    except ValueError:
+        return jsonify({'error': 'offset and limit must be integers'}), 400
+    q = (request.args.get('q') or '').strip() or None
 
-        return jsonify({'current_path': path, 'parent_path': parent_path, 'items': items})
-    except FileNotFoundError:
+    try:
+        return jsonify(file_browser.browse(path, offset=offset, limit=limit, q=q))
+    except (FileNotFoundError, NotADirectoryError):
         return jsonify({'error': 'Path not found.'}), 404
     except PermissionError:
         return jsonify({'error': 'Permission denied.'}), 403
@@ -488,22 +762,39 @@ def browse_files():
         app.logger.error(f"Error browsing path '{path}': {e}")
         return jsonify({'error': f"An unexpected error occurred: {e}"}), 500
 
+@app.route('/api/browse/scan', methods=['GET', 'POST'])
+def scan_directories():
+    """Reports the directory scanner's status, or queues a rescan of the music directory."""
+    if request.method == 'GET':
+        return jsonify(dir_scanner.scan_status())
+
+    def target(job):
+        count = dir_scanner.scan(progress=lambda seen: job.set_progress(seen, None))
+        if count is None:
+            job.emit('A directory scan is already running')
+        else:
+            job.emit(f"Scanned {count} directories under {dir_scanner.SCAN_ROOT}")
+        return 0
+
+    job = jobs.submit('scan', f"Scan {dir_scanner.SCAN_ROOT}", target)
+    return jsonify({'message': 'Directory scan queued', 'job_id': job.id, 'job': job.to_dict()}), 202
+
+@app.route('/api/watch', methods=['GET'])
+def get_watch_status():
+    """Reports whether watch mode is active and what it last did."""
+    return jsonify(watcher.watch_status())
+
 # Lyrics endpoints using the modular service
 @app.route('/api/library/lyrics/<track_id>', methods=['GET', 'POST'])
 def handle_lyrics(track_id):
     """Retrieves or updates lyrics for a specific track."""
     if request.method == 'GET':
         try:
-            result = get_track_lyrics(track_id, BEETS_BIN)
-            # Always return a JSON object with a 'lyrics' field containing the lyrics as a string
-            lyrics = ''
-            if isinstance(result, dict):
-                lyrics = result.get('lyrics', '')
-            elif isinstance(result, str):
-                lyrics = result
-            if not isinstance(lyrics, str):
-                lyrics = str(lyrics) if lyrics is not None else ''
-            return jsonify({'lyrics': lyrics})
+            result, status = get_track_lyrics(track_id)
+            if status != 200:
+                return jsonify(result), status
+            # Always return a 'lyrics' field containing the lyrics as a string
+            return jsonify({**result, 'lyrics': result.get('lyrics') or ''})
         except Exception as e:
             return jsonify({'error': f"An unexpected error occurred: {e}"}), 500
     
@@ -511,31 +802,55 @@ def handle_lyrics(track_id):
         try:
             data = request.json
             lyrics = data.get('lyrics', '')
-            result = set_track_lyrics(track_id, lyrics, BEETS_BIN)
+            result = set_track_lyrics(track_id, lyrics)
             if 'error' in result:
                 return jsonify(result), result.get('status', 500)
             return jsonify(result)
         except Exception as e:
             return jsonify({'error': f"An unexpected error occurred: {e}"}), 500
 
+@app.route('/api/library/lyrics/<track_id>/line')
+def lyrics_line(track_id):
+    """Returns the synced lyric line for a playback position given in milliseconds."""
+    try:
+        position = int(float(request.args.get('position', 0)))
+        context = min(max(int(request.args.get('context', 0)), 0), 50)
+    except ValueError:
+        return jsonify({'error': 'position and context must be numbers'}), 400
+    try:
+        result, status_code = get_active_line(track_id, position, context)
+        return jsonify(result), status_code
+    except subprocess.CalledProcessError as e:
+        app.logger.error(f"Error reading lyrics: {e.stderr}")
+        return jsonify({'error': f"Failed to read lyrics: {e.stderr}"}), 500
+    except Exception as e:
+        return jsonify({'error': f"An unexpected error occurred: {e}"}), 500
+
 @app.route('/api/library/fetch-lyrics/<track_id>', methods=['POST'])
 def fetch_lyrics(track_id):
     """Fetch lyrics using LRCLib API directly, with beets plugin as fallback."""
     try:
-        result, status_code = fetch_lyrics_for_track(track_id, BEETS_BIN)
+        result, status_code = fetch_lyrics_for_track(track_id)
         return jsonify(result), status_code
     except Exception as e:
         return jsonify({'error': f"An unexpected error occurred: {e}"}), 500
 
+@app.route('/api/lyrics/fetch-batch', methods=['POST'])
+def fetch_lyrics_batch_route():
+    """Queues a job fetching LRCLib lyrics for all tracks matching a beets query that have none."""
+    data = request.get_json(silent=True) or {}
+    query = data.get('query', '')
+    if not isinstance(query, str):
+        return jsonify({'error': 'query must be a string'}), 400
+    job = fetch_lyrics_batch(query, use_cache=data.get('use_cache', True) is not False)
+    return jsonify({'message': 'Lyrics fetch queued', 'job_id': job.id, 'job': job.to_dict()}), 202
+
 @app.route('/api/stats')
+@etag(stats_signature)
 def get_stats():
-    """Retrieves statistics about the music library from beets."""
+    """Retrieves library totals and per-format and per-bitrate breakdowns."""
     try:
-        cmd = [BEETS_BIN, 'stats']
-        process = subprocess.run(cmd, capture_output=True, text=True, check=True, env=os.environ.copy())
-        stats_output = process.stdout
-        
-        stats = parse_stats(stats_output)
+        stats = library_cache.get_snapshot().stats
         return jsonify(stats)
     except subprocess.CalledProcessError as e:
         app.logger.error(f"Error getting beets stats: {e.stderr}")
@@ -544,21 +859,28 @@ def get_stats():
         app.logger.error(f"Error getting stats: {e}")
         return jsonify({'error': f"An unexpected error occurred: {e}"}), 500
 
-# Custom get_track_lyrics function to fetch only the lyrics field for a track using beets CLI
-def get_track_lyrics(track_id, beets_bin):
-    """Fetch lyrics for a track by ID using beets CLI."""
-    import subprocess
-    try:
-        # Use beets to get only the lyrics field for the given track
-        cmd = [beets_bin, 'ls', '-f', '$lyrics', f'id:{track_id}']
-        process = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        lyrics = process.stdout.strip()
-        return lyrics
-    except Exception as e:
-        return ''
+@app.route('/metrics')
+def get_metrics():
+    """Request, subprocess, LRCLib, config and cache metrics in Prometheus text format."""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+def start_background_services():
+    """Starts the threads that run alongside request handling.
+
+    Threads do not survive a fork, so this runs once per serving process:
+    below for the development server, and from the gunicorn post_fork hook
+    in production.
+    """
+    # Discover plugins off the request path, so the plugins tab loads instantly
+    threading.Thread(target=get_discovered_plugins, name='beetiful-plugins', daemon=True).start()
+    # Keep directory sizes for the file browser up to date
+    dir_scanner.start_background_scanner()
+    # Optional: sync the library with changes in the music folder as they happen
+    watcher.start()
 
 # Run the app
 port = int(os.getenv('FLASK_PORT', 5000))
 
 if __name__ == '__main__':
+    start_background_services()
     app.run(host='0.0.0.0', port=port, debug=os.getenv('FLASK_ENV') == 'development')
\ No newline at end of file
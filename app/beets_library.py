@@ -0,0 +1,639 @@
+"""In-process access to the beets library database
+
+Opens `beets.library.Library` once per worker process and serves queries,
+lookups and modifications directly, instead of paying interpreter startup and
+plugin loading for a `beet` subprocess on every request. The CLI path is kept
+as a fallback for when beets cannot be imported or the database cannot be
+opened, and can be forced with BEETIFUL_BACKEND=subprocess.
+"""
+
+import os
+import sys
+import shlex
+import inspect
+import time
+import sqlite3
+import threading
+import subprocess
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from config_manager import read_config, beets_config_dir
+from beets_utils import (
+    get_beets_bin, clean_field, parse_library_line, LIBRARY_LIST_FORMAT, PLACEHOLDERS, MAX_QUERY_TERMS
+)
+
+logger = logging.getLogger(__name__)
+
+BEETS_BIN = get_beets_bin()
+
+# Seconds to wait before retrying to open the library after a failure
+RETRY_INTERVAL = 60
+# Threads used to write tags to files after batch edits
+WRITE_WORKERS = int(os.getenv('BEETIFUL_WRITE_WORKERS', 4))
+
+_lock = threading.Lock()
+_library = None
+_library_pid = None
+_last_failure = 0.0
+_plugins_loaded = False
+
+
+def in_process_enabled():
+    """Whether the in-process backend may be used at all."""
+    return os.getenv('BEETIFUL_BACKEND', 'auto').lower() != 'subprocess'
+
+
+def _load_plugins(config):
+    """Load the configured beets plugins as `beet` does, so plugin fields, types and queries match the CLI."""
+    global _plugins_loaded
+    if _plugins_loaded:
+        return
+    from beets import library, plugins, util
+
+    if not inspect.signature(plugins.load_plugins).parameters:
+        # Newer beets read `plugins` and `pluginpath` from the config and register plugin types themselves
+        plugins.load_plugins()
+        _plugins_loaded = True
+        return
+
+    # Older beets (such as the 2.3 the Docker image ships) take the plugin
+    # names and leave the search path and plugin types to the caller
+    paths = [os.fsdecode(util.normpath(path)) for path in config['pluginpath'].as_str_seq(split=False)]
+    import beetsplug
+    beetsplug.__path__ = paths + list(beetsplug.__path__)
+    sys.path += paths
+    plugins.load_plugins(config['plugins'].as_str_seq())
+
+    album_types = plugins.types(library.Album)
+    library.Album._types.update(album_types)
+    item_types = dict(album_types)
+    item_types.update(library.Item._types)
+    item_types.update(plugins.types(library.Item))
+    library.Item._types = item_types
+    library.Item._queries.update(plugins.named_queries(library.Item))
+    library.Album._queries.update(plugins.named_queries(library.Album))
+    plugins.send('pluginload')
+    _plugins_loaded = True
+
+
+def _open_library(config):
+    """Open the configured beets Library the way `beet` does."""
+    from beets import library
+
+    path = config['library'].as_filename()
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    directory = config['directory'].as_filename()
+    if 'path_formats' in inspect.signature(library.Library).parameters:
+        # Older beets take path formats and replacements from the caller
+        from beets.ui import get_path_formats, get_replacements
+        lib = library.Library(path, directory, get_path_formats(), get_replacements())
+    else:
+        lib = library.Library(path, directory)
+    # Fail here, and fall back to the CLI, if the database cannot be read
+    lib.get_item(0)
+    return lib
+
+
+def get_library():
+    """Return the shared beets Library for this process, or None if unavailable.
+
+    The library is opened lazily and reopened after a fork, since sqlite
+    connections must not be shared between processes. Configured plugins are
+    loaded first, so plugin-defined fields are available as on the CLI.
+    """
+    global _library, _library_pid, _last_failure
+
+    if not in_process_enabled():
+        return None
+
+    pid = os.getpid()
+    if _library is not None and _library_pid == pid:
+        return _library
+    if time.monotonic() - _last_failure < RETRY_INTERVAL and _library_pid == pid:
+        return None
+
+    with _lock:
+        if _library is not None and _library_pid == pid:
+            return _library
+        _library_pid = pid
+        try:
+            from beets import config, plugins
+            _load_plugins(config)
+            _library = _open_library(config)
+            plugins.send('library_opened', lib=_library)
+            logger.info(f"Opened beets library in-process: {_library.path}")
+        except Exception as e:
+            logger.warning(f"In-process beets library unavailable, using subprocess fallback: {e}")
+            _library = None
+            _last_failure = time.monotonic()
+        return _library
+
+
+def library_db_path():
+    """Return the filesystem path of the beets library database."""
+    lib = get_library()
+    if lib is not None:
+        return os.fsdecode(os.fspath(lib.path))
+
+    path = read_config().get('library') or 'library.db'
+    return os.path.join(beets_config_dir, os.path.expanduser(path))
+
+
+def _config_flag(section, key):
+    try:
+        from beets import config
+        return bool(config[section][key].get())
+    except Exception:
+        return False
+
+
+def _displayable_path(path):
+    from beets.util import displayable_path
+    return displayable_path(path)
+
+
+def item_to_dict(item):
+    """Convert a beets Item into the dict shape served by /api/library."""
+    return {
+        'id': item.id,
+        'title': item.title or PLACEHOLDERS['title'],
+        'artist': item.artist or PLACEHOLDERS['artist'],
+        'album': item.album or PLACEHOLDERS['album'],
+        'genre': item.get('genre') or None,
+        'year': item.year or None,
+        'length': float(item.length) if item.length else None,
+        'bitrate': int(item.bitrate) if item.bitrate else None,
+        'path': _displayable_path(item.path) if item.path else '',
+        'albumartist': item.albumartist or None
+    }
+
+
+def _run_beet(args, **kwargs):
+    with metrics.time_command([BEETS_BIN] + args):
+        return subprocess.run(
+            [BEETS_BIN] + args, capture_output=True, text=True,
+            env=os.environ.copy(), **kwargs
+        )
+
+
+def iter_items(query=''):
+    """Yield library items matching a beets query string as dicts, one at a time.
+
+    The subprocess fallback reads `beet list` output line by line, so memory
+    stays flat regardless of library size. Raises
+    subprocess.CalledProcessError once the output is exhausted if the
+    fallback command failed.
+    """
+    lib = get_library()
+    if lib is not None:
+        for item in lib.items(query):
+            yield item_to_dict(item)
+        return
+
+    args = [BEETS_BIN, 'list', '--format', LIBRARY_LIST_FORMAT] + shlex.split(query)
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        args, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        text=True, env=os.environ.copy()
+    )
+    # Drain stderr alongside stdout, so a chatty plugin cannot fill the pipe and stall the export
+    stderr_lines = []
+    stderr_reader = threading.Thread(target=lambda: stderr_lines.extend(process.stderr), daemon=True)
+    stderr_reader.start()
+    try:
+        for line in process.stdout:
+            item = parse_library_line(line.rstrip('\n'))
+            if item:
+                yield item
+        returncode = process.wait()
+        stderr_reader.join()
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, args, stderr=''.join(stderr_lines))
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        stderr_reader.join()
+        process.stdout.close()
+        process.stderr.close()
+        metrics.SUBPROCESS_DURATION.observe(time.perf_counter() - started, command=metrics.command_name(args))
+
+
+def list_items(query=''):
+    """List library items matching a beets query string as dicts.
+
+    Raises subprocess.CalledProcessError if the subprocess fallback fails.
+    """
+    return list(iter_items(query))
+
+
+def list_items_missing(query, field):
+    """List items matching a query whose `field` is empty, as dicts.
+
+    Raises subprocess.CalledProcessError if the subprocess fallback fails.
+    """
+    lib = get_library()
+    if lib is not None:
+        return [item_to_dict(item) for item in lib.items(query) if not item.get(field)]
+
+    items = list_items(query)
+    # Filtering separately keeps OR queries in `query` intact
+    process = _run_beet(['list', '--format', '$id', f'{field}::.'], check=True)
+    filled = {int(item_id) for item_id in process.stdout.split()}
+    return [item for item in items if item['id'] not in filled]
+
+
+# Upper bounds (exclusive, in kbps) of the bitrate tiers reported by library_stats()
+BITRATE_TIERS = (128, 192, 256, 320, 500)
+
+_STATS_TOTALS_SQL = (
+    "SELECT COUNT(*), COUNT(DISTINCT NULLIF(artist, '')), COUNT(DISTINCT NULLIF(album, '')), "
+    "COUNT(DISTINCT NULLIF(albumartist, '')), COALESCE(SUM(length), 0), "
+    "COALESCE(SUM(CAST(length * bitrate / 8 AS INTEGER)), 0) FROM items"
+)
+_STATS_FORMATS_SQL = (
+    "SELECT COALESCE(NULLIF(format, ''), 'Unknown'), COUNT(*), COALESCE(SUM(length), 0), "
+    "COALESCE(SUM(CAST(length * bitrate / 8 AS INTEGER)), 0) FROM items GROUP BY 1"
+)
+_STATS_BITRATES_SQL = (
+    "SELECT CAST(bitrate / 1000 AS INTEGER), COUNT(*), COALESCE(SUM(length), 0), "
+    "COALESCE(SUM(CAST(length * bitrate / 8 AS INTEGER)), 0) FROM items GROUP BY 1"
+)
+
+
+def _bitrate_tier(kbps):
+    """Return (min_kbps, max_kbps or None) of the tier containing a bitrate."""
+    lower = 0
+    for upper in BITRATE_TIERS:
+        if kbps < upper:
+            return lower, upper - 1
+        lower = upper
+    return lower, None
+
+
+def _query_stats(query):
+    tracks, artists, albums, album_artists, duration, size = query(_STATS_TOTALS_SQL)[0]
+    formats = [
+        {'format': name, 'tracks': count, 'duration': float(length), 'bytes': int(size_bytes)}
+        for name, count, length, size_bytes in query(_STATS_FORMATS_SQL)
+    ]
+    formats.sort(key=lambda entry: (-entry['tracks'], entry['format']))
+
+    tiers = {}
+    for kbps, count, length, size_bytes in query(_STATS_BITRATES_SQL):
+        key = _bitrate_tier(kbps) if kbps else None
+        tier = tiers.setdefault(key, {'tracks': 0, 'duration': 0.0, 'bytes': 0})
+        tier['tracks'] += count
+        tier['duration'] += float(length)
+        tier['bytes'] += int(size_bytes)
+    bitrates = []
+    for key in sorted(tiers, key=lambda key: (key is None, key if key is not None else (0, 0))):
+        min_kbps, max_kbps = key if key is not None else (None, None)
+        bitrates.append({'min_kbps': min_kbps, 'max_kbps': max_kbps, **tiers[key]})
+
+    return {
+        'total_tracks': tracks,
+        'total_albums': albums,
+        'total_artists': artists,
+        'total_album_artists': album_artists,
+        'total_duration': float(duration),
+        'total_bytes': int(size),
+        'formats': formats,
+        'bitrates': bitrates
+    }
+
+
+def library_stats():
+    """Aggregate library statistics, computed with SQL against the beets database.
+
+    Sizes are estimated from length and bitrate, as `beet stats` does without
+    --exact. Bitrate tiers have a max_kbps of None for the open-ended top
+    tier, and both bounds None for items without a bitrate. The subprocess
+    backend reads the database file directly, read-only.
+    """
+    lib = get_library()
+    if lib is not None:
+        with lib.transaction() as tx:
+            return _query_stats(tx.query)
+
+    conn = sqlite3.connect(f"file:{library_db_path()}?mode=ro", uri=True, timeout=10)
+    try:
+        return _query_stats(lambda sql: conn.execute(sql).fetchall())
+    finally:
+        conn.close()
+
+
+def get_item_fields(item_id, fields):
+    """Fetch raw field values for a single item.
+
+    Returns a dict mapping each field to its value (None when unset), or None
+    if the item does not exist.
+    """
+    lib = get_library()
+    if lib is not None:
+        try:
+            item = lib.get_item(int(item_id))
+        except (TypeError, ValueError):
+            return None
+        if item is None:
+            return None
+        values = {}
+        for field in fields:
+            value = item.get(field)
+            if field == 'path' and value:
+                value = _displayable_path(value)
+            values[field] = value if value not in ('', None) else None
+        return values
+
+    fmt = '\t'.join(f'${field}' for field in fields)
+    process = _run_beet(['list', '--format', fmt, f'id:{item_id}'], check=True)
+    output = process.stdout.rstrip('\n')
+    if not output:
+        return None
+    parts = output.split('\t')
+    return {
+        field: clean_field(parts[i], field) if i < len(parts) else None
+        for i, field in enumerate(fields)
+    }
+
+
+def _store_item_updates(lib, item, updates):
+    """Apply string-valued updates to an item and persist them, like `beet modify`.
+
+    Tag writing is left to the caller so it can happen outside the transaction.
+    """
+    from beets.util import ancestry
+
+    for field, value in updates.items():
+        item.set_parse(field, str(value))
+
+    move = _config_flag('import', 'move') or _config_flag('import', 'copy')
+    if move and lib.directory in ancestry(item.path):
+        item.move(store=False)
+    item.store()
+
+
+def _write_tags(lib, items):
+    """Write tags for items across a thread pool, then store their new mtimes.
+
+    Returns the ids of items whose files could not be written.
+    """
+    if not items:
+        return set()
+    with ThreadPoolExecutor(max_workers=WRITE_WORKERS) as pool:
+        written = list(pool.map(lambda item: item.try_write(), items))
+    with lib.transaction():
+        for item, ok in zip(items, written):
+            if ok:
+                item.store(['mtime'])
+    return {item.id for item, ok in zip(items, written) if not ok}
+
+
+def _invalid_updates(updates):
+    """Return {field: message} for values that do not parse as their field's numeric type.
+
+    beets stores such values as the type's null (0 or None) without
+    complaint, so they are caught before anything is written. Empty values,
+    which clear a field, are allowed.
+    """
+    try:
+        from beets.library import Item
+    except ImportError:
+        return {}
+
+    invalid = {}
+    for field, value in updates.items():
+        field_type = Item._type(field)
+        string = str(value).strip()
+        if field_type.model_type not in (int, float) or not string:
+            continue
+        if field_type.parse(string) != field_type.null:
+            continue
+        try:
+            field_type.model_type(string)
+        except ValueError:
+            expected = 'an integer' if field_type.model_type is int else 'a number'
+            invalid[field] = f"{string!r} is not {expected}"
+    return invalid
+
+
+def modify_items(edits):
+    """Apply many {field: value} updates in one database transaction.
+
+    `edits` is a list of (item_id, updates) pairs. Tags are then written to
+    the files in parallel. Returns one result dict per edit with a status of
+    'updated', 'not_found' or 'error'; edits with values that do not fit
+    their field's type are rejected as a whole, with the offending fields
+    listed under 'fields'. Raises subprocess.CalledProcessError if the
+    subprocess fallback fails.
+    """
+    invalid = [_invalid_updates(updates) for _, updates in edits]
+    valid = [edit for edit, fields in zip(edits, invalid) if not fields]
+    applied = iter(_modify_items(valid) if valid else [])
+    results = []
+    for (item_id, _), fields in zip(edits, invalid):
+        if fields:
+            error = '; '.join(f"Invalid value for {field}: {message}" for field, message in fields.items())
+            results.append({'id': item_id, 'status': 'error', 'error': error, 'fields': fields})
+        else:
+            results.append(next(applied))
+    return results
+
+
+def _modify_items(edits):
+    lib = get_library()
+    if lib is None:
+        return _modify_items_subprocess(edits)
+
+    results = []
+    modified = []
+    with lib.transaction():
+        for item_id, updates in edits:
+            result = {'id': item_id}
+            results.append(result)
+            try:
+                item = lib.get_item(int(item_id))
+            except (TypeError, ValueError):
+                item = None
+            if item is None:
+                result['status'] = 'not_found'
+                continue
+            try:
+                _store_item_updates(lib, item, updates)
+                result['status'] = 'updated'
+                modified.append(item)
+            except Exception as e:
+                result.update({'status': 'error', 'error': str(e)})
+
+    if _config_flag('import', 'write'):
+        unwritten = _write_tags(lib, modified)
+        for result in results:
+            if result['status'] == 'updated':
+                result['written'] = result['id'] not in unwritten
+    return results
+
+
+def _id_query(item_ids):
+    """Build `beet` query arguments matching any of the given ids."""
+    query = []
+    for item_id in item_ids:
+        query += [',', f'id:{item_id}'] if query else [f'id:{item_id}']
+    return query
+
+
+def _id_chunks(item_ids):
+    """Split ids into lists small enough for one `_id_query` each."""
+    item_ids = list(item_ids)
+    return [item_ids[start:start + MAX_QUERY_TERMS] for start in range(0, len(item_ids), MAX_QUERY_TERMS)]
+
+
+def _modify_items_subprocess(edits):
+    """Fallback for modify_items: one `beet modify` per distinct set of updates and chunk of ids."""
+    existing = set()
+    for chunk in _id_chunks(item_id for item_id, _ in edits):
+        process = _run_beet(['list', '--format', '$id'] + _id_query(chunk), check=True)
+        existing.update(process.stdout.split())
+
+    groups = {}
+    for item_id, updates in edits:
+        if str(item_id) in existing:
+            key = tuple(sorted((field, str(value)) for field, value in updates.items()))
+            groups.setdefault(key, []).append(item_id)
+
+    results = {}
+    for key, item_ids in groups.items():
+        for chunk in _id_chunks(item_ids):
+            process = _run_beet(['modify', '-y'] + _id_query(chunk) + [f'{field}={value}' for field, value in key])
+            for item_id in chunk:
+                if process.returncode == 0:
+                    results[item_id] = {'id': item_id, 'status': 'updated'}
+                else:
+                    results[item_id] = {'id': item_id, 'status': 'error', 'error': process.stderr.strip()}
+    return [results.get(item_id, {'id': item_id, 'status': 'not_found'}) for item_id, _ in edits]
+
+
+def modify_item(item_id, updates):
+    """Apply field updates to a single item.
+
+    Returns False if the item does not exist. Raises ValueError for values
+    that do not fit their field's type, and subprocess.CalledProcessError if
+    the subprocess fallback fails.
+    """
+    result = modify_items([(item_id, updates)])[0]
+    if result['status'] == 'error':
+        raise (ValueError if 'fields' in result else RuntimeError)(result['error'])
+    return result['status'] == 'updated'
+
+
+def query_item_ids(query):
+    """Return the ids of items matching a beets query string."""
+    lib = get_library()
+    if lib is not None:
+        return [item.id for item in lib.items(query)]
+    process = _run_beet(['list', '--format', '$id'] + shlex.split(query), check=True)
+    return [int(line) for line in process.stdout.split() if line.isdigit()]
+
+
+def remove_items(query, delete=False):
+    """Remove items matching a beets query, optionally deleting their files."""
+    lib = get_library()
+    if lib is not None:
+        with lib.transaction():
+            for item in lib.items(query):
+                item.remove(delete=delete)
+        return
+
+    args = ['remove', '-f']
+    if delete:
+        args.append('-d')
+    _run_beet(args + shlex.split(query), input='y\n')
+
+
+def _delete_files(lib, paths):
+    """Delete files across a thread pool, then prune emptied directories.
+
+    Returns (deleted_count, errors).
+    """
+    from beets import util
+
+    def delete(path):
+        try:
+            util.remove(path)
+            return None
+        except Exception as e:
+            return f"{_displayable_path(path)}: {e}"
+
+    with ThreadPoolExecutor(max_workers=WRITE_WORKERS) as pool:
+        outcomes = list(pool.map(delete, paths))
+    errors = [outcome for outcome in outcomes if outcome]
+
+    # Pruning is sequential: sibling deletions would race on shared parents
+    for directory in sorted({os.path.dirname(path) for path in paths}, reverse=True):
+        try:
+            util.prune_dirs(directory, lib.directory)
+        except Exception as e:
+            logger.warning(f"Could not prune {_displayable_path(directory)}: {e}")
+    return len(paths) - len(errors), errors
+
+
+def remove_items_by_id(item_ids, delete_files=False, dry_run=False):
+    """Remove a set of items by id in a single database transaction.
+
+    With dry_run the library is left untouched and the items that would be
+    removed are returned instead. Otherwise files are optionally deleted
+    across a thread pool after the transaction commits. Returns a dict with
+    'items' (dry run) or 'removed', plus 'missing' ids and file deletion
+    results.
+    """
+    lib = get_library()
+    if lib is None:
+        return _remove_items_by_id_subprocess(item_ids, delete_files, dry_run)
+
+    found = []
+    missing = []
+    with lib.transaction():
+        for item_id in item_ids:
+            try:
+                item = lib.get_item(int(item_id))
+            except (TypeError, ValueError):
+                item = None
+            if item is None:
+                missing.append(item_id)
+            else:
+                found.append(item)
+
+        if dry_run:
+            return {'items': [item_to_dict(item) for item in found], 'missing': missing}
+
+        for item in found:
+            item.remove(delete=False)
+
+    result = {'removed': [item.id for item in found], 'missing': missing}
+    if delete_files:
+        deleted, errors = _delete_files(lib, [item.path for item in found])
+        result.update({'deleted_files': deleted, 'errors': errors})
+    return result
+
+
+def _remove_items_by_id_subprocess(item_ids, delete_files, dry_run):
+    """Fallback for remove_items_by_id using `beet list` and `beet remove` per chunk of ids."""
+    found = []
+    for chunk in _id_chunks(item_ids):
+        process = _run_beet(['list', '--format', LIBRARY_LIST_FORMAT] + _id_query(chunk), check=True)
+        found += [item for item in map(parse_library_line, process.stdout.split('\n')) if item]
+    found_ids = {str(item['id']) for item in found}
+    missing = [item_id for item_id in item_ids if str(item_id) not in found_ids]
+
+    if dry_run:
+        return {'items': found, 'missing': missing}
+    if not found:
+        return {'removed': [], 'missing': missing}
+
+    args = ['remove', '-f']
+    if delete_files:
+        args.append('-d')
+    for chunk in _id_chunks(item['id'] for item in found):
+        _run_beet(args + _id_query(chunk), input='y\n', check=True)
+    return {'removed': [item['id'] for item in found], 'missing': missing}
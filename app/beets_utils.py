@@ -1,9 +1,11 @@
 """Utility functions for Beets integration"""
 
 import os
+import re
 import subprocess
 import yaml
 import logging
+from lrclib_service import parse_duration
 
 logger = logging.getLogger(__name__)
 
@@ -38,25 +40,71 @@ def clean_field(value, field_name):
         return None
     return value.strip()
 
-def parse_stats(output):
-    """Parse the stats output from beets."""
-    lines = output.splitlines()
-    stats = {}
-    
-    for line in lines:
-        line = line.strip()
-        if ':' in line:
-            key, value = line.split(':', 1)
-            key = key.strip().lower()
-            value = value.strip()
-            
-            if 'tracks' in key:
-                stats['total_tracks'] = value
-            elif 'albums' in key:
-                stats['total_albums'] = value
-            elif 'artists' in key:
-                stats['total_artists'] = value
-            elif 'total size' in key:
-                stats['total_size'] = value.split()[0]
-    
-    return stats
\ No newline at end of file
+def parse_library_line(line):
+    """Parse one tab-separated `beet list` line into a library item dict.
+
+    The line must follow the field order of LIBRARY_LIST_FORMAT. Returns None
+    for blank or truncated lines.
+    """
+    if not line or line.strip() == '':
+        return None
+    parts = line.split('\t')
+    if len(parts) < 9:
+        return None
+
+    year = None
+    year_str = clean_field(parts[5], 'year')
+    if year_str and year_str.isdigit():
+        year = int(year_str) or None
+
+    length = None
+    length_str = clean_field(parts[6], 'length')
+    if length_str:
+        length = parse_duration(length_str)
+
+    # beets formats bitrate as e.g. "320kbps"; the API reports bits per second
+    bitrate = None
+    bitrate_str = clean_field(parts[7], 'bitrate')
+    if bitrate_str:
+        bitrate_clean = re.sub(r'kbps$', '', bitrate_str).strip()
+        try:
+            bitrate = int(float(bitrate_clean) * 1000)
+        except ValueError:
+            pass
+
+    item_id = clean_field(parts[0], 'id')
+    return {
+        'id': int(item_id) if item_id and item_id.isdigit() else item_id or 'unknown',
+        'title': clean_field(parts[1], 'title') or PLACEHOLDERS['title'],
+        'artist': clean_field(parts[2], 'artist') or PLACEHOLDERS['artist'],
+        'album': clean_field(parts[3], 'album') or PLACEHOLDERS['album'],
+        'genre': clean_field(parts[4], 'genre'),
+        'year': year,
+        'length': length,
+        'bitrate': bitrate,
+        'path': clean_field(parts[8], 'path') or '',
+        'albumartist': clean_field(parts[9], 'albumartist') if len(parts) > 9 else None
+    }
+
+# Values reported for items missing these fields
+PLACEHOLDERS = {
+    'title': 'Unknown Title',
+    'artist': 'Unknown Artist',
+    'album': 'Unknown Album'
+}
+
+# Field order expected by parse_library_line
+LIBRARY_LIST_FORMAT = '$id\t$title\t$artist\t$album\t$genre\t$year\t$length\t$bitrate\t$path\t$albumartist'
+
+# Most terms to join with ',' in one `beet` query: every alternative nests a
+# level deeper in SQLite's expression tree, which is limited to a depth of 1000
+MAX_QUERY_TERMS = 500
+
+def human_bytes(size):
+    """Format a byte count the way `beet stats` does (e.g. "1.2 GiB")."""
+    size = float(size)
+    for unit in ['B', 'KiB', 'MiB', 'GiB', 'TiB', 'PiB']:
+        if size < 1024 or unit == 'PiB':
+            break
+        size /= 1024
+    return f'{size:.1f} {unit}'
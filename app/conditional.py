@@ -0,0 +1,56 @@
+"""Conditional GET support (ETag / If-None-Match)
+
+Views decorated with @etag(token) get a weak ETag derived from a cheap token
+that changes whenever their output would, such as the library revision or
+config.yaml's signature. A client revalidating with a matching
+If-None-Match gets 304 Not Modified without the view running at all.
+Responses carry `Cache-Control: no-cache`, so browsers keep them but check
+back on every use, which is what makes fetch() revalidate transparently.
+"""
+
+import hashlib
+import logging
+from functools import wraps
+
+from flask import Response, make_response, request
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def make_etag(token):
+    """The ETag value for a token, specific to the request's URL and Accept header.
+
+    Responses vary on the query string and on content negotiation, so both
+    are part of the tag.
+    """
+    source = repr((token, request.full_path, request.headers.get('Accept', '')))
+    return hashlib.sha1(source.encode('utf-8')).hexdigest()[:20]
+
+
+def etag(token):
+    """Decorate a view with ETag validation; `token()` returns None to skip it."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(*args, **kwargs)
+            value = token()
+            if value is None:
+                return view(*args, **kwargs)
+            tag = make_etag(value)
+            if request.if_none_match.contains_weak(tag):
+                metrics.record_cache('etag', True)
+                response = Response(status=304)
+            else:
+                metrics.record_cache('etag', False)
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(tag, weak=True)
+            response.headers['Cache-Control'] = 'no-cache'
+            response.vary.update(('Accept', 'Accept-Encoding'))
+            return response
+        return wrapper
+    return decorator
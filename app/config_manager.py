@@ -1,16 +1,46 @@
 """Configuration management for Beets and plugin definitions"""
 
 import os
+import copy
+import time
 import yaml
+import pkgutil
 import logging
+import tempfile
+import threading
+import importlib.util
+import importlib.metadata
+from contextlib import contextmanager
 from pathlib import Path
 
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; the thread lock still applies
+    fcntl = None
+
 logger = logging.getLogger(__name__)
 
 # Configuration paths
 beets_config_dir = os.getenv('BEETSDIR', os.path.expanduser('~/.config/beets'))
 config_path = os.path.join(beets_config_dir, 'config.yaml')
 
+# Parsed config.yaml and the (inode, mtime, size) it was read at
+_cache_lock = threading.Lock()
+_cached_config = None
+_cached_signature = None
+# Serializes read-modify-write cycles; a lock file extends this across processes
+_update_lock = threading.Lock()
+# Whether the current thread holds config_lock(), which makes it reentrant
+_lock_state = threading.local()
+
+# Plugins found on the beetsplug path, discovered on first use
+_plugins_lock = threading.Lock()
+_discovered_plugins = None
+# Bumped on every discovery, so callers can tell the result changed
+_plugins_generation = 0
+
 # Plugin definitions for beets 2.3.1
 AVAILABLE_PLUGINS = {
     'fetchart': {
@@ -158,77 +188,183 @@ def create_default_config():
         }
     }
 
-def read_config():
-    """Reads the beets configuration from config.yaml."""
-    if not os.path.exists(config_path):
-        default_config = create_default_config()
-        write_config(default_config)
-        return default_config
-    
+def _signature(st):
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+def config_signature():
+    """Return a token that changes whenever config.yaml is replaced or modified."""
     try:
-        with open(config_path, 'r') as f:
-            config = yaml.safe_load(f) or {}
+        return _signature(os.stat(config_path))
+    except OSError:
+        return None
+
+def _remember(config, signature):
+    global _cached_config, _cached_signature
+    with _cache_lock:
+        _cached_config = copy.deepcopy(config)
+        _cached_signature = signature
+
+def read_config():
+    """Reads the beets configuration from config.yaml.
+
+    The parsed file is cached until its inode, mtime or size changes. Callers
+    get their own copy and may modify it freely.
+    """
+    with metrics.CONFIG_DURATION.time(operation='read'):
+        signature = config_signature()
+        if signature is None:
+            with config_lock():
+                # Another thread or worker may have written it in the meantime
+                signature = config_signature()
+                if signature is None:
+                    default_config = create_default_config()
+                    write_config(default_config)
+                    return default_config
+
+        with _cache_lock:
+            if _cached_signature == signature:
+                metrics.record_cache('config', True)
+                return copy.deepcopy(_cached_config)
+        metrics.record_cache('config', False)
+
+        try:
+            with open(config_path, 'r') as f:
+                config = yaml.safe_load(f) or {}
+            _remember(config, signature)
             return config
-    except Exception as e:
-        logger.error(f"Error reading config.yaml: {e}")
-        return create_default_config()
+        except Exception as e:
+            logger.error(f"Error reading config.yaml: {e}")
+            return create_default_config()
 
 def write_config(config_data):
-    """Writes the beets configuration to config.yaml."""
+    """Writes the beets configuration to config.yaml.
+
+    The new content goes to a temporary file that is fsynced and renamed over
+    config.yaml, so readers see either the old or the new file, never a
+    partial one.
+    """
+    tmp_path = None
+    started = time.perf_counter()
     try:
-        os.makedirs(os.path.dirname(config_path), exist_ok=True)
-        with open(config_path, 'w') as f:
+        config_dir = os.path.dirname(config_path)
+        os.makedirs(config_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=config_dir, prefix='.config.yaml.', suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
             yaml.safe_dump(config_data, f, default_flow_style=False, sort_keys=False)
+            f.flush()
+            os.fsync(f.fileno())
+            # Renaming keeps the inode and mtime, so this is the new file's signature
+            signature = _signature(os.fstat(f.fileno()))
+        try:
+            os.chmod(tmp_path, os.stat(config_path).st_mode & 0o7777)
+        except FileNotFoundError:
+            os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, config_path)
+        tmp_path = None
+        _remember(config_data, signature)
         return True
     except Exception as e:
         logger.error(f"Error writing config.yaml: {e}")
         return False
+    finally:
+        if tmp_path is not None:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+        metrics.CONFIG_DURATION.observe(time.perf_counter() - started, operation='write')
 
-def get_installed_plugins():
-    """Get list of built-in plugins available in beets 2.3.1."""
-    installed_plugins = []
-    
-    try:
-        # Check which plugins exist in the beetsplug directory
-        import beets
-        import pkg_resources
-        
-        # Get the path to beetsplug
-        beets_dist = pkg_resources.get_distribution('beets')
-        beetsplug_path = None
-        
-        # Try to find beetsplug directory
-        possible_paths = [
-            os.path.join(os.path.dirname(beets.__file__), '..', 'beetsplug'),
-            os.path.join(beets_dist.location, 'beetsplug'),
-            '/home/beetiful/.local/lib/python3.11/site-packages/beetsplug'
-        ]
-        
-        for path in possible_paths:
-            if os.path.exists(path):
-                beetsplug_path = path
-                break
-        
-        if beetsplug_path:
-            logger.info(f"Found beetsplug directory at: {beetsplug_path}")
-            
-            for plugin_name in AVAILABLE_PLUGINS.keys():
-                # Check if plugin file exists
-                plugin_file = os.path.join(beetsplug_path, f'{plugin_name}.py')
-                plugin_dir = os.path.join(beetsplug_path, plugin_name)
-                
-                if os.path.exists(plugin_file) or os.path.exists(plugin_dir):
-                    installed_plugins.append(plugin_name)
-                    logger.debug(f"Found plugin: {plugin_name}")
-        else:
-            logger.warning("Could not find beetsplug directory")
-            # Fallback: assume all built-in plugins are available
-            installed_plugins = [name for name, info in AVAILABLE_PLUGINS.items() if info.get('built_in', False)]
-        
-    except Exception as e:
-        logger.error(f"Error checking installed plugins: {e}")
-        # Fallback: assume all built-in plugins are available
-        installed_plugins = [name for name, info in AVAILABLE_PLUGINS.items() if info.get('built_in', False)]
-    
-    logger.info(f"Available built-in plugins: {installed_plugins}")
-    return installed_plugins
\ No newline at end of file
+@contextmanager
+def config_lock():
+    """Hold the config update lock, across threads and worker processes.
+
+    Reentrant within a thread, since update_config() reads the config while
+    holding it and reading may write the default config.
+    """
+    if getattr(_lock_state, 'held', False):
+        yield
+        return
+    with _update_lock:
+        _lock_state.held = True
+        try:
+            if fcntl is None:
+                yield
+                return
+            os.makedirs(beets_config_dir, exist_ok=True)
+            with open(config_path + '.lock', 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+        finally:
+            _lock_state.held = False
+
+def update_config(mutator):
+    """Apply `mutator(config)` to the current config and write it back atomically.
+
+    The read-modify-write cycle runs under config_lock(), so concurrent
+    updates cannot overwrite each other. Returns True if the write succeeded.
+    """
+    with config_lock():
+        config = read_config()
+        mutator(config)
+        return write_config(config)
+
+def _discover_plugins():
+    """Find beets plugins on the beetsplug namespace path without importing them.
+
+    Returns {name: {'built_in': bool, 'distribution': name or None}}, where
+    plugins shipped by a distribution other than beets are third-party.
+    """
+    spec = importlib.util.find_spec('beetsplug')
+    if spec is None or not spec.submodule_search_locations:
+        return {}
+    names = {
+        module.name for module in pkgutil.iter_modules(spec.submodule_search_locations)
+        if not module.name.startswith('_')
+    }
+
+    owners = {}
+    for dist_name in importlib.metadata.packages_distributions().get('beetsplug', []):
+        try:
+            files = importlib.metadata.distribution(dist_name).files or []
+        except importlib.metadata.PackageNotFoundError:
+            continue
+        for file in files:
+            if len(file.parts) < 2 or file.parts[0] != 'beetsplug' or file.parts[1] == '__pycache__':
+                continue
+            name = file.parts[1] if len(file.parts) > 2 else file.stem
+            owners.setdefault(name, dist_name)
+
+    return {
+        name: {'built_in': owners.get(name, 'beets') == 'beets', 'distribution': owners.get(name)}
+        for name in sorted(names)
+    }
+
+def get_discovered_plugins(refresh=False):
+    """Return every plugin found in the environment, discovering them once per process."""
+    global _discovered_plugins, _plugins_generation
+    with _plugins_lock:
+        metrics.record_cache('plugins', _discovered_plugins is not None and not refresh)
+        if _discovered_plugins is None or refresh:
+            _plugins_generation += 1
+            try:
+                _discovered_plugins = _discover_plugins()
+                logger.info(f"Discovered {len(_discovered_plugins)} beets plugins")
+            except Exception as e:
+                logger.error(f"Error discovering plugins: {e}")
+                # Fallback: assume all built-in plugins are available
+                _discovered_plugins = {
+                    name: {'built_in': True, 'distribution': None}
+                    for name, info in AVAILABLE_PLUGINS.items() if info.get('built_in', False)
+                }
+        return _discovered_plugins
+
+def plugins_signature():
+    """Return a token that changes whenever the config or the discovered plugins do."""
+    return config_signature(), _plugins_generation
+
+def get_installed_plugins(refresh=False):
+    """Get the names of installed plugins, built-in and third-party."""
+    return list(get_discovered_plugins(refresh))
@@ -0,0 +1,243 @@
+"""Recursive directory size and audio file counts for the file browser
+
+A background scan walks the music directory breadth-first, listing each
+level's directories on a thread pool, and stores per-directory totals
+(recursive size, audio file count, newest file mtime) in SQLite. Scans are
+incremental: a directory whose mtime is unchanged is not listed again, its
+own files' totals and its subdirectories come from the cache, so a rescan of
+an unchanged tree costs one stat per directory. A file rewritten in place
+does not change its directory's mtime, so its new size is only picked up
+when the directory changes.
+"""
+
+import os
+import time
+import stat
+import sqlite3
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from config_manager import beets_config_dir
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; scans are then only serialized per process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+SCAN_ROOT = os.getenv('LIBRARY_PATH', '/music')
+CACHE_PATH = os.getenv('BEETIFUL_DIR_CACHE', os.path.join(beets_config_dir, 'beetiful_dirs.db'))
+# Seconds between background rescans; 0 disables them
+SCAN_INTERVAL = int(os.getenv('BEETIFUL_DIR_SCAN_INTERVAL', 3600))
+SCAN_WORKERS = int(os.getenv('BEETIFUL_DIR_SCAN_WORKERS', 8))
+
+AUDIO_EXTENSIONS = {
+    '.mp3', '.flac', '.m4a', '.mp4', '.aac', '.alac', '.ogg', '.oga', '.opus',
+    '.wav', '.aif', '.aiff', '.wma', '.ape', '.wv', '.mpc', '.dsf', '.dff'
+}
+
+_local = threading.local()
+_scan_lock = threading.Lock()
+_status = {'running': False, 'started_at': None, 'finished_at': None, 'directories': 0, 'error': None}
+
+
+def _connect():
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        os.makedirs(os.path.dirname(CACHE_PATH) or '.', exist_ok=True)
+        conn = sqlite3.connect(CACHE_PATH, timeout=10)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS dirs ('
+            'path TEXT PRIMARY KEY, parent TEXT, mtime_ns INTEGER, '
+            'own_size INTEGER, own_audio INTEGER, own_newest REAL, '
+            'size INTEGER, audio_count INTEGER, newest REAL, scanned_at REAL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_dirs_parent ON dirs (parent)')
+        conn.commit()
+        _local.conn = conn
+    return conn
+
+
+def _normalize(path):
+    return os.path.normpath(path)
+
+
+def _list_directory(path):
+    """Scan one directory: (own size, own audio count, own newest mtime, subdirectories)."""
+    size = 0
+    audio = 0
+    newest = 0.0
+    subdirs = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                # Symlinked directories are not followed, to avoid cycles
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                    continue
+                st = entry.stat()
+            except OSError:
+                continue
+            if not stat.S_ISREG(st.st_mode):
+                continue
+            size += st.st_size
+            newest = max(newest, st.st_mtime)
+            if os.path.splitext(entry.name)[1].lower() in AUDIO_EXTENSIONS:
+                audio += 1
+    return size, audio, newest, subdirs
+
+
+def _visit(path, cached):
+    """Return (path, mtime_ns, own size, own audio, own newest, subdirs) for one directory."""
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    previous = cached.get(path)
+    if previous is not None and previous[0] == mtime_ns:
+        return (path, mtime_ns) + previous[1:]
+    try:
+        own_size, own_audio, own_newest, subdirs = _list_directory(path)
+    except OSError as e:
+        logger.warning(f"Cannot scan {path}: {e}")
+        return None
+    return path, mtime_ns, own_size, own_audio, own_newest, subdirs
+
+
+def _load_cache(conn, root):
+    """Map each cached directory under root to (mtime_ns, own size, own audio, own newest, subdirs)."""
+    rows = conn.execute(
+        'SELECT path, parent, mtime_ns, own_size, own_audio, own_newest FROM dirs '
+        'WHERE path = ? OR (path >= ? AND path < ?)',
+        (root, root + '/', root + '0')
+    ).fetchall()
+    children = {}
+    for path, parent, *_ in rows:
+        children.setdefault(parent, []).append(path)
+    return {
+        path: (mtime_ns, own_size, own_audio, own_newest, children.get(path, []))
+        for path, parent, mtime_ns, own_size, own_audio, own_newest in rows
+    }
+
+
+def _scan(root, progress=None):
+    conn = _connect()
+    cached = _load_cache(conn, root)
+    visited = {}
+    frontier = [root]
+    with ThreadPoolExecutor(max_workers=SCAN_WORKERS, thread_name_prefix='beetiful-scan') as pool:
+        while frontier:
+            next_frontier = []
+            for result in pool.map(lambda path: _visit(path, cached), frontier):
+                if result is None:
+                    continue
+                visited[result[0]] = result
+                next_frontier.extend(result[5])
+            frontier = next_frontier
+            if progress:
+                progress(len(visited))
+
+    # Deepest directories first, so children are totalled before their parents
+    totals = {}
+    now = time.time()
+    rows = []
+    for path in sorted(visited, key=lambda p: p.count(os.sep), reverse=True):
+        _, mtime_ns, own_size, own_audio, own_newest, subdirs = visited[path]
+        size, audio, newest = own_size, own_audio, own_newest
+        for subdir in subdirs:
+            if subdir in totals:
+                sub_size, sub_audio, sub_newest = totals[subdir]
+                size += sub_size
+                audio += sub_audio
+                newest = max(newest, sub_newest)
+        totals[path] = (size, audio, newest)
+        parent = os.path.dirname(path) if path != root else None
+        rows.append((path, parent, mtime_ns, own_size, own_audio, own_newest, size, audio, newest, now))
+
+    with conn:
+        conn.execute('DELETE FROM dirs WHERE path = ? OR (path >= ? AND path < ?)', (root, root + '/', root + '0'))
+        conn.executemany('INSERT INTO dirs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+    return len(rows)
+
+
+def scan(root=None, progress=None):
+    """Rescan a directory tree and update the cache.
+
+    Only one scan runs at a time, across threads and worker processes.
+    Returns the number of directories scanned, or None if another scan was
+    already running. `progress(directories_seen)` is called after each level.
+    """
+    root = _normalize(root or SCAN_ROOT)
+    if not _scan_lock.acquire(blocking=False):
+        return None
+    lock_file = None
+    try:
+        if fcntl is not None:
+            os.makedirs(os.path.dirname(CACHE_PATH) or '.', exist_ok=True)
+            lock_file = open(CACHE_PATH + '.lock', 'a')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+        _status.update({'running': True, 'started_at': time.time(), 'error': None})
+        started = time.monotonic()
+        try:
+            count = _scan(root, progress)
+        except Exception as e:
+            _status['error'] = str(e)
+            raise
+        finally:
+            _status.update({'running': False, 'finished_at': time.time()})
+        _status['directories'] = count
+        logger.info(f"Scanned {count} directories under {root} in {time.monotonic() - started:.1f}s")
+        return count
+    finally:
+        if lock_file is not None:
+            lock_file.close()
+        _scan_lock.release()
+
+
+def scan_status():
+    return dict(_status)
+
+
+def get_totals(paths):
+    """Return {path: {'size', 'audio_files', 'newest'}} for the cached paths among `paths`."""
+    normalized = {_normalize(path): path for path in paths}
+    result = {}
+    keys = list(normalized)
+    try:
+        conn = _connect()
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = conn.execute(
+                f"SELECT path, size, audio_count, newest FROM dirs WHERE path IN ({','.join('?' * len(chunk))})",
+                chunk
+            ).fetchall()
+            for path, size, audio_count, newest in rows:
+                result[normalized[path]] = {'size': size, 'audio_files': audio_count, 'newest': newest}
+    except sqlite3.Error as e:
+        logger.error(f"Error reading directory totals: {e}")
+    return result
+
+
+def _scan_periodically():
+    while True:
+        try:
+            if os.path.isdir(SCAN_ROOT):
+                scan()
+        except Exception as e:
+            logger.error(f"Background directory scan failed: {e}")
+        time.sleep(SCAN_INTERVAL)
+
+
+def start_background_scanner():
+    """Start the thread that rescans SCAN_ROOT every SCAN_INTERVAL seconds."""
+    if SCAN_INTERVAL <= 0:
+        return None
+    thread = threading.Thread(target=_scan_periodically, name='beetiful-dir-scan', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,126 @@
+"""Precomputed facet aggregates for browse views and filter dropdowns
+
+Keeps per-artist, per-album, per-genre and per-year track counts, total
+duration and estimated total size. Albums are keyed on album artist (or
+artist) and album name, so same-named albums by different artists stay
+apart. The aggregates follow the library snapshot incrementally, so a
+request only sorts the buckets it returns instead of scanning every track.
+"""
+
+import logging
+
+import library_cache
+from library_query import split_genres
+
+logger = logging.getLogger(__name__)
+
+FACETS = ['artists', 'albums', 'genres', 'years']
+
+FACET_SORTS = ['count', 'name', 'duration', 'size']
+
+
+def estimated_size(item):
+    """Estimate a track's file size in bytes from length and bitrate, as `beet stats` does."""
+    return int((item.get('length') or 0) * (item.get('bitrate') or 0) / 8)
+
+
+class FacetEngine(library_cache.SnapshotView):
+    """Per-facet bucket counters maintained from snapshot deltas."""
+
+    name = 'facets'
+
+    def __init__(self):
+        super().__init__()
+        self.clear()
+
+    def clear(self):
+        # facet -> bucket name -> [count, duration, size]
+        self._buckets = {facet: {} for facet in FACETS}
+        # item id -> (keys per facet, duration, size), to undo its contribution
+        self._contributions = {}
+        self._totals = [0, 0.0, 0]
+
+    @staticmethod
+    def _keys(item):
+        return {
+            'artists': [item.get('artist')],
+            'albums': [(item.get('albumartist') or item.get('artist'), item.get('album'))],
+            # An item listing a genre twice still counts once towards it
+            'genres': list(dict.fromkeys(split_genres(item.get('genre')))),
+            'years': [item.get('year')] if item.get('year') else []
+        }
+
+    def _apply(self, keys, duration, size, sign):
+        for facet, names in keys.items():
+            buckets = self._buckets[facet]
+            for name in names:
+                bucket = buckets.setdefault(name, [0, 0.0, 0])
+                bucket[0] += sign
+                bucket[1] += sign * duration
+                bucket[2] += sign * size
+                if bucket[0] <= 0:
+                    del buckets[name]
+        self._totals[0] += sign
+        self._totals[1] += sign * duration
+        self._totals[2] += sign * size
+
+    def add_item(self, item):
+        keys = self._keys(item)
+        duration = item.get('length') or 0.0
+        size = estimated_size(item)
+        self._contributions[item['id']] = (keys, duration, size)
+        self._apply(keys, duration, size, 1)
+
+    def remove_item(self, item_id):
+        contribution = self._contributions.pop(item_id, None)
+        if contribution is not None:
+            self._apply(*contribution, -1)
+
+    def totals(self):
+        with self._lock:
+            count, duration, size = self._totals
+            return {
+                'tracks': count,
+                'duration': round(duration, 3),
+                'size': size,
+                **{facet: len(self._buckets[facet]) for facet in FACETS}
+            }
+
+    def facet(self, facet, sort='count', limit=None, prefix=None):
+        """Return the buckets of one facet as dicts, sorted and optionally truncated."""
+        with self._lock:
+            buckets = [
+                {'name': key, 'count': count, 'duration': round(duration, 3), 'size': size}
+                for key, (count, duration, size) in self._buckets[facet].items()
+            ]
+        if facet == 'albums':
+            # Album keys are (album artist, album) pairs
+            for bucket in buckets:
+                bucket['artist'], bucket['name'] = bucket['name']
+        if prefix:
+            prefix = prefix.lower()
+            buckets = [b for b in buckets if str(b['name']).lower().startswith(prefix)]
+        if sort == 'name':
+            buckets.sort(key=lambda b: (str(b['name']).lower(), str(b.get('artist')).lower()))
+        else:
+            buckets.sort(key=lambda b: (-b[sort], str(b['name']).lower(), str(b.get('artist')).lower()))
+        return buckets[:limit] if limit else buckets
+
+
+_engine = FacetEngine()
+
+
+def get_facets(names=None, sort='count', limit=None, prefix=None):
+    """Return totals plus the requested facets for the current library revision."""
+    snapshot = _engine.sync()
+    names = [name for name in (names or FACETS) if name in FACETS]
+    return {
+        'revision': snapshot.revision,
+        'totals': _engine.totals(),
+        'facets': {name: _engine.facet(name, sort=sort, limit=limit, prefix=prefix) for name in names}
+    }
+
+
+def warm_up():
+    """Build the facet aggregates now instead of on the first request."""
+    _engine.sync()
@@ -0,0 +1,150 @@
+"""Directory listings for the file browser
+
+Each entry is stat'ed exactly once, and listings are cached per directory
+until the directory's mtime changes, so paging, filtering and revisiting a
+folder do not touch the filesystem again. Adding, removing or renaming an
+entry bumps the directory mtime; a file rewritten in place does not, so its
+cached size may lag until the directory itself changes. Large directories
+(common for `/music` on network storage) are stat'ed on a thread pool.
+
+Directory sizes and audio file counts come from the background scanner's
+cache and are None for directories it has not scanned yet.
+"""
+
+import os
+import stat
+import threading
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import metrics
+import dir_scanner
+
+logger = logging.getLogger(__name__)
+
+# Directories whose listings are kept in memory
+DIR_CACHE_SIZE = 256
+# Entries above which stat calls are spread over the thread pool
+PARALLEL_STAT_THRESHOLD = 200
+STAT_WORKERS = int(os.getenv('BEETIFUL_STAT_WORKERS', 16))
+MAX_LIMIT = 1000
+
+_lock = threading.Lock()
+# path -> ((st_ino, st_mtime_ns), [entry, ...] sorted directories first)
+_listings = OrderedDict()
+_executor = ThreadPoolExecutor(max_workers=STAT_WORKERS, thread_name_prefix='beetiful-stat')
+
+
+def format_timestamp(timestamp):
+    """Format timestamp for display."""
+    try:
+        dt = datetime.fromtimestamp(timestamp)
+        return dt.strftime('%Y-%m-%d %H:%M')
+    except:
+        return ''
+
+
+def _stat_entry(entry):
+    """Stat a DirEntry once; returns (name, path, is_dir, size, mtime) or None to skip it."""
+    try:
+        st = entry.stat()
+    except OSError:
+        # Broken symlinks and entries removed while listing
+        return None
+    if stat.S_ISDIR(st.st_mode):
+        return (entry.name, entry.path, True, None, st.st_mtime)
+    if stat.S_ISREG(st.st_mode):
+        return (entry.name, entry.path, False, st.st_size, st.st_mtime)
+    return None
+
+
+def _scan(path):
+    with os.scandir(path) as it:
+        entries = list(it)
+    if len(entries) > PARALLEL_STAT_THRESHOLD:
+        stats = list(_executor.map(_stat_entry, entries, chunksize=64))
+    else:
+        stats = [_stat_entry(entry) for entry in entries]
+    listing = [entry for entry in stats if entry is not None]
+    listing.sort(key=lambda e: (not e[2], e[0].lower()))
+    return listing
+
+
+def list_directory(path):
+    """Return the sorted entries of a directory, from the cache while it is unchanged.
+
+    Raises FileNotFoundError, NotADirectoryError or PermissionError like
+    os.scandir().
+    """
+    st = os.stat(path)
+    if not stat.S_ISDIR(st.st_mode):
+        raise NotADirectoryError(path)
+    signature = (st.st_ino, st.st_mtime_ns)
+    with _lock:
+        cached = _listings.get(path)
+        if cached is not None and cached[0] == signature:
+            _listings.move_to_end(path)
+            metrics.record_cache('directory_listing', True)
+            return cached[1]
+
+    metrics.record_cache('directory_listing', False)
+    listing = _scan(path)
+    with _lock:
+        _listings[path] = (signature, listing)
+        _listings.move_to_end(path)
+        while len(_listings) > DIR_CACHE_SIZE:
+            _listings.popitem(last=False)
+    return listing
+
+
+def invalidate(path=None):
+    """Drop the cached listing for one directory, or for all of them."""
+    with _lock:
+        if path is None:
+            _listings.clear()
+        else:
+            _listings.pop(path, None)
+
+
+def browse(path, offset=0, limit=None, q=None):
+    """Return one page of a directory listing as served by /api/browse.
+
+    `q` keeps only entries whose name contains it, case-insensitively.
+    Without a limit every remaining entry is returned.
+    """
+    listing = list_directory(path)
+    if q:
+        needle = q.lower()
+        listing = [entry for entry in listing if needle in entry[0].lower()]
+    total = len(listing)
+    page = listing[offset:offset + limit] if limit else listing[offset:]
+    items = [
+        {
+            'name': name,
+            'path': entry_path,
+            'type': 'directory' if is_dir else 'file',
+            'size': size,
+            'modified': format_timestamp(mtime)
+        }
+        for name, entry_path, is_dir, size, mtime in page
+    ]
+    directories = [item['path'] for item in items if item['type'] == 'directory']
+    totals = dir_scanner.get_totals(directories + [path])
+    for item in items:
+        if item['type'] == 'directory':
+            scanned = totals.get(item['path'])
+            item['size'] = scanned['size'] if scanned else None
+            item['audio_files'] = scanned['audio_files'] if scanned else None
+    current = totals.get(path)
+    return {
+        'current_path': path,
+        'totals': current,
+        'parent_path': str(Path(path).parent) if path != '/' else None,
+        'items': items,
+        'total': total,
+        'offset': offset,
+        'limit': limit
+    }
@@ -0,0 +1,32 @@
+"""gunicorn settings for Beetiful, configurable through environment variables
+
+Workers share job state through the jobs database, so any of them can
+follow or cancel a job another one runs. Start with one worker and raise
+BEETIFUL_THREADS for concurrency; add workers when CPU-bound requests
+dominate.
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.getenv('FLASK_PORT', 5000)}"
+workers = int(os.getenv('BEETIFUL_WORKERS', 1))
+threads = int(os.getenv('BEETIFUL_THREADS', 16))
+worker_class = 'gthread'
+# Seconds a worker may stay silent before it is restarted
+timeout = int(os.getenv('BEETIFUL_TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 5
+# Import the app, and warm its state, once in the master before forking
+preload_app = True
+accesslog = '-' if os.getenv('BEETIFUL_ACCESS_LOG', 'false').lower() in ('1', 'true', 'yes', 'on') else None
+loglevel = os.getenv('LOG_LEVEL', 'info').lower()
+
+
+def when_ready(server):
+    from wsgi import warm_up
+    warm_up()
+
+
+def post_fork(server, worker):
+    from wsgi import start_background_services
+    start_background_services()
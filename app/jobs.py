@@ -0,0 +1,522 @@
+"""Background job queue for long-running beets commands
+
+Commands such as `import` and `update` are submitted as jobs and run on a
+bounded worker pool instead of blocking a request. Output is captured line by
+line so clients can follow it live, running jobs can be cancelled, and job
+history (including the tail of the output) is persisted to SQLite so it
+survives restarts.
+
+The SQLite database is shared by every worker process. The process running a
+job writes its status, progress, new output lines and a heartbeat there every
+SYNC_INTERVAL seconds, so any worker can list, follow or cancel it:
+cancelling sets a flag in the jobs table that the running process polls.
+Unfinished jobs whose heartbeat stops (their process died) are marked
+interrupted.
+"""
+
+import os
+import json
+import time
+import uuid
+import signal
+import sqlite3
+import threading
+import subprocess
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from config_manager import beets_config_dir
+
+logger = logging.getLogger(__name__)
+
+JOBS_DB_PATH = os.getenv('BEETIFUL_JOBS_DB', os.path.join(beets_config_dir, 'beetiful_jobs.db'))
+MAX_WORKERS = int(os.getenv('BEETIFUL_JOB_WORKERS', 2))
+# Finished jobs kept in the history table
+MAX_HISTORY = 200
+# Output lines kept per job, in memory and on disk
+MAX_OUTPUT_LINES = 5000
+# Seconds a cancelled process gets to exit before it is killed
+CANCEL_GRACE = 5
+# Seconds between writes of live job state, and between cancellation checks
+SYNC_INTERVAL = 1.0
+# Seconds without a heartbeat after which an unfinished job is considered dead
+STALE_AFTER = 30
+# Seconds between reads when following a job run by another process
+STREAM_POLL_INTERVAL = 0.5
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+INTERRUPTED = 'interrupted'
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED, INTERRUPTED)
+
+
+class Job:
+    """A unit of background work with captured output and progress."""
+
+    def __init__(self, kind, description, target):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.description = description
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.returncode = None
+        self.error = None
+        self.progress = None
+        self.lines = []
+        # Absolute index of self.lines[0], so event ids stay stable when trimmed
+        self.first_line = 0
+        # Absolute index of the first line not yet written to the database
+        self.persisted_line = 0
+        self.process = None
+        self.cancel_requested = False
+        self.changed = threading.Condition()
+        self._target = target
+
+    def emit(self, text, stream='stdout'):
+        """Append one output line and wake up stream listeners."""
+        with self.changed:
+            self.lines.append((stream, text))
+            if len(self.lines) > MAX_OUTPUT_LINES:
+                drop = len(self.lines) - MAX_OUTPUT_LINES
+                del self.lines[:drop]
+                self.first_line += drop
+            self.changed.notify_all()
+
+    def set_progress(self, done, total, **extra):
+        with self.changed:
+            self.progress = {'done': done, 'total': total, **extra}
+            self.changed.notify_all()
+
+    def lines_since(self, index):
+        """Return (next_index, [(index, stream, text), ...]) for lines after `index`."""
+        with self.changed:
+            start = max(index, self.first_line)
+            offset = start - self.first_line
+            lines = [(start + i, stream, text) for i, (stream, text) in enumerate(self.lines[offset:])]
+            return self.first_line + len(self.lines), lines
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+    def to_dict(self, include_output=False):
+        data = {
+            'id': self.id,
+            'kind': self.kind,
+            'description': self.description,
+            'status': self.status,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'returncode': self.returncode,
+            'error': self.error,
+            'progress': self.progress
+        }
+        if include_output:
+            data['output'] = [{'stream': stream, 'text': text} for stream, text in self.lines]
+            data['first_line'] = self.first_line
+        return data
+
+
+_COLUMNS = ('id', 'kind', 'description', 'status', 'created_at', 'started_at',
+            'finished_at', 'returncode', 'error', 'progress', 'heartbeat')
+_SELECT = 'SELECT ' + ', '.join(_COLUMNS) + ' FROM jobs'
+
+_lock = threading.Lock()
+_jobs = {}
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='beetiful-job')
+_db_initialized = False
+_sync_pid = None
+
+
+def _connect():
+    global _db_initialized
+    os.makedirs(os.path.dirname(JOBS_DB_PATH) or '.', exist_ok=True)
+    conn = sqlite3.connect(JOBS_DB_PATH, timeout=10)
+    if not _db_initialized:
+        # Readers in other workers must not block the worker writing output
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'id TEXT PRIMARY KEY, kind TEXT, description TEXT, status TEXT, '
+            'created_at REAL, started_at REAL, finished_at REAL, '
+            'returncode INTEGER, error TEXT, progress TEXT, '
+            'heartbeat REAL, cancel_requested INTEGER NOT NULL DEFAULT 0)'
+        )
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(jobs)')]
+        if 'heartbeat' not in columns:
+            conn.execute('ALTER TABLE jobs ADD COLUMN heartbeat REAL')
+        if 'cancel_requested' not in columns:
+            conn.execute('ALTER TABLE jobs ADD COLUMN cancel_requested INTEGER NOT NULL DEFAULT 0')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS job_output ('
+            'job_id TEXT, line INTEGER, stream TEXT, text TEXT, '
+            'PRIMARY KEY (job_id, line)) WITHOUT ROWID'
+        )
+        _expire_stale(conn)
+        conn.commit()
+        _db_initialized = True
+    return conn
+
+
+def _expire_stale(conn):
+    """Mark unfinished jobs whose process stopped sending heartbeats as interrupted."""
+    now = time.time()
+    conn.execute(
+        'UPDATE jobs SET status = ?, finished_at = ? '
+        'WHERE status IN (?, ?) AND (heartbeat IS NULL OR heartbeat < ?)',
+        (INTERRUPTED, now, QUEUED, RUNNING, now - STALE_AFTER)
+    )
+
+
+def _persist(job):
+    """Write a job's state and its output lines not yet written to the database."""
+    try:
+        with _lock:
+            with job.changed:
+                start = max(job.persisted_line, job.first_line)
+                lines = [
+                    (job.id, start + i, stream, text)
+                    for i, (stream, text) in enumerate(job.lines[start - job.first_line:])
+                ]
+                first_line = job.first_line
+                row = (job.id, job.kind, job.description, job.status, job.created_at,
+                       job.started_at, job.finished_at, job.returncode, job.error,
+                       json.dumps(job.progress), time.time())
+            conn = _connect()
+            try:
+                conn.execute(
+                    'INSERT INTO jobs (' + ', '.join(_COLUMNS) + ') '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (id) DO UPDATE SET ' +
+                    ', '.join(f'{column} = excluded.{column}' for column in _COLUMNS[1:]),
+                    row
+                )
+                conn.executemany('INSERT OR REPLACE INTO job_output VALUES (?, ?, ?, ?)', lines)
+                conn.execute('DELETE FROM job_output WHERE job_id = ? AND line < ?', (job.id, first_line))
+                if job.finished:
+                    conn.execute(
+                        'DELETE FROM jobs WHERE id NOT IN '
+                        '(SELECT id FROM jobs ORDER BY created_at DESC LIMIT ?)',
+                        (MAX_HISTORY,)
+                    )
+                    conn.execute('DELETE FROM job_output WHERE job_id NOT IN (SELECT id FROM jobs)')
+                conn.commit()
+            finally:
+                conn.close()
+            job.persisted_line = start + len(lines)
+    except sqlite3.Error as e:
+        logger.error(f"Error persisting job {job.id}: {e}")
+
+
+def _row_to_dict(row):
+    data = dict(zip(_COLUMNS, row))
+    data['progress'] = json.loads(data['progress']) if data['progress'] else None
+    del data['heartbeat']
+    return data
+
+
+def _read_output(conn, job_id, start=0):
+    """Return [(index, stream, text), ...] of a job's stored output from `start` on."""
+    return conn.execute(
+        'SELECT line, stream, text FROM job_output WHERE job_id = ? AND line >= ? ORDER BY line',
+        (job_id, start)
+    ).fetchall()
+
+
+def _set_status(job, status, **fields):
+    with job.changed:
+        job.status = status
+        for key, value in fields.items():
+            setattr(job, key, value)
+        job.changed.notify_all()
+    _persist(job)
+
+
+def _run(job):
+    if job.cancel_requested:
+        _set_status(job, CANCELLED, finished_at=time.time())
+        return
+    _set_status(job, RUNNING, started_at=time.time())
+    try:
+        returncode = job._target(job)
+        if job.cancel_requested:
+            status = CANCELLED
+        else:
+            status = SUCCEEDED if not returncode else FAILED
+        _set_status(job, status, returncode=returncode, finished_at=time.time())
+    except Exception as e:
+        logger.error(f"Job {job.id} failed: {e}")
+        job.emit(str(e), 'stderr')
+        _set_status(job, FAILED, error=str(e), finished_at=time.time())
+    finally:
+        job.process = None
+        _forget_finished()
+
+
+def _start_sync():
+    """Start this process's sync thread, once per process since threads do not survive a fork."""
+    global _sync_pid
+    with _lock:
+        if _sync_pid == os.getpid():
+            return
+        _sync_pid = os.getpid()
+    threading.Thread(target=_sync_loop, name='beetiful-job-sync', daemon=True).start()
+
+
+def _sync_loop():
+    """Persist live jobs of this process and act on cancellations requested elsewhere."""
+    while True:
+        time.sleep(SYNC_INTERVAL)
+        try:
+            with _lock:
+                live = [job for job in _jobs.values() if not job.finished]
+            if not live:
+                continue
+            for job in live:
+                _persist(job)
+            with _lock:
+                conn = _connect()
+                try:
+                    placeholders = ', '.join('?' * len(live))
+                    flagged = [row[0] for row in conn.execute(
+                        f'SELECT id FROM jobs WHERE cancel_requested = 1 AND id IN ({placeholders})',
+                        [job.id for job in live]
+                    )]
+                finally:
+                    conn.close()
+            for job_id in flagged:
+                job = _jobs.get(job_id)
+                if job is not None and not job.cancel_requested:
+                    # Terminating waits for the process, so it must not hold up syncing
+                    threading.Thread(target=_cancel_local, args=(job,), daemon=True).start()
+        except Exception as e:
+            logger.error(f"Error syncing jobs: {e}")
+
+
+def _forget_finished():
+    """Drop the oldest finished jobs from memory; they remain in history."""
+    with _lock:
+        finished = [job for job in _jobs.values() if job.finished]
+        for job in sorted(finished, key=lambda j: j.created_at)[:max(len(_jobs) - MAX_HISTORY, 0)]:
+            del _jobs[job.id]
+
+
+def submit(kind, description, target):
+    """Queue a callable `target(job)` and return the Job.
+
+    The target reports output through job.emit()/job.set_progress() and
+    returns a process-style return code (0 or None for success).
+    """
+    job = Job(kind, description, target)
+    with _lock:
+        _jobs[job.id] = job
+    _persist(job)
+    _start_sync()
+    _executor.submit(_run, job)
+    return job
+
+
+def _pump(job, pipe, stream):
+    for line in pipe:
+        job.emit(line.rstrip('\n'), stream)
+    pipe.close()
+
+
+def run_command(job, args):
+    """Run a subprocess for a job, capturing stdout and stderr line by line.
+
+    Returns the exit code, or None without starting anything if the job has
+    been cancelled. Targets that run several commands call this once per
+    command; cancel() stops whichever one is running.
+    """
+    with job.changed:
+        if job.cancel_requested:
+            return None
+    with metrics.time_command(args):
+        process = subprocess.Popen(
+            args, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            stdin=subprocess.DEVNULL, text=True, env=os.environ.copy(),
+            # Own process group, so cancelling also stops helpers it spawned
+            start_new_session=True
+        )
+        with job.changed:
+            job.process = process
+            # cancel() may have run while the process was starting, before it could see it
+            cancelled = job.cancel_requested
+        readers = [
+            threading.Thread(target=_pump, args=(job, process.stdout, 'stdout'), daemon=True),
+            threading.Thread(target=_pump, args=(job, process.stderr, 'stderr'), daemon=True)
+        ]
+        for reader in readers:
+            reader.start()
+        if cancelled:
+            _terminate(process)
+        returncode = process.wait()
+        for reader in readers:
+            reader.join()
+    return returncode
+
+
+def submit_command(args, description=None):
+    """Queue a subprocess command; stdout and stderr are captured line by line."""
+    return submit('command', description or ' '.join(args), lambda job: run_command(job, args))
+
+
+def cancel(job_id):
+    """Request cancellation; returns False if the job is unknown or already finished.
+
+    The request is recorded in the jobs table, where the process running the
+    job picks it up within SYNC_INTERVAL. A job running in this process is
+    stopped right away.
+    """
+    with _lock:
+        conn = _connect()
+        try:
+            flagged = conn.execute(
+                'UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status IN (?, ?)',
+                (job_id, QUEUED, RUNNING)
+            ).rowcount
+            conn.commit()
+        finally:
+            conn.close()
+    job = _jobs.get(job_id)
+    if job is not None:
+        if job.finished:
+            return False
+        _cancel_local(job)
+        return True
+    return flagged > 0
+
+
+def _cancel_local(job):
+    with job.changed:
+        job.cancel_requested = True
+        process = job.process
+    if process is not None:
+        _terminate(process)
+
+
+def _terminate(process):
+    """Stop a job's process group, killing it if it outlives CANCEL_GRACE."""
+    if process.poll() is not None:
+        return
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=CANCEL_GRACE)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def get_job_info(job_id, include_output=False):
+    """Return a job as a dict, from memory if this process runs it, else from the database."""
+    job = _jobs.get(job_id)
+    if job is not None:
+        return job.to_dict(include_output=include_output)
+    with _lock:
+        conn = _connect()
+        try:
+            row = conn.execute(_SELECT + ' WHERE id = ?', (job_id,)).fetchone()
+            if row is None:
+                return None
+            data = _row_to_dict(row)
+            if include_output:
+                lines = _read_output(conn, job_id)
+                data['output'] = [{'stream': stream, 'text': text} for _, stream, text in lines]
+                data['first_line'] = lines[0][0] if lines else 0
+        finally:
+            conn.close()
+    return data
+
+
+def list_jobs(limit=50):
+    """Return recent jobs, newest first, from history merged with live state."""
+    with _lock:
+        conn = _connect()
+        try:
+            rows = conn.execute(_SELECT + ' ORDER BY created_at DESC LIMIT ?', (limit,)).fetchall()
+        finally:
+            conn.close()
+    result = []
+    for row in rows:
+        job = _jobs.get(row[0])
+        result.append(job.to_dict() if job is not None else _row_to_dict(row))
+    return result
+
+
+def stream_events(job_id, last_event_id=-1, keepalive=15):
+    """Yield Server-Sent Events for a job's output, progress and final status.
+
+    Event ids are absolute output line numbers, the same whichever process
+    serves the stream, so clients can resume with Last-Event-ID.
+    """
+    job = _jobs.get(job_id)
+    if job is None:
+        yield from _stream_stored(job_id, last_event_id, keepalive)
+        return
+
+    next_index = last_event_id + 1
+    progress = None
+    while True:
+        next_index, lines = job.lines_since(next_index)
+        for index, stream, text in lines:
+            yield f"id: {index}\nevent: output\ndata: {json.dumps({'stream': stream, 'text': text})}\n\n"
+        if job.progress != progress:
+            progress = job.progress
+            yield f"event: progress\ndata: {json.dumps(progress)}\n\n"
+        if job.finished and next_index >= job.first_line + len(job.lines):
+            yield f"event: status\ndata: {json.dumps(job.to_dict())}\n\n"
+            return
+        with job.changed:
+            idle = not job.finished and next_index >= job.first_line + len(job.lines) and job.progress == progress
+            woken = job.changed.wait(timeout=keepalive) if idle else True
+        if not woken:
+            yield ": keepalive\n\n"
+
+
+def _stream_stored(job_id, last_event_id, keepalive):
+    """Stream a job run by another process (or finished) by polling the database."""
+    next_index = last_event_id + 1
+    progress = None
+    idle_since = time.monotonic()
+    while True:
+        with _lock:
+            conn = _connect()
+            try:
+                row = conn.execute(_SELECT + ' WHERE id = ?', (job_id,)).fetchone()
+                stored = dict(zip(_COLUMNS, row)) if row is not None else {}
+                if stored.get('status') in (QUEUED, RUNNING) and (stored['heartbeat'] or 0) < time.time() - STALE_AFTER:
+                    _expire_stale(conn)
+                    conn.commit()
+                    row = conn.execute(_SELECT + ' WHERE id = ?', (job_id,)).fetchone()
+                lines = _read_output(conn, job_id, next_index) if row is not None else []
+            finally:
+                conn.close()
+        if row is None:
+            return
+        info = _row_to_dict(row)
+        for index, stream, text in lines:
+            yield f"id: {index}\nevent: output\ndata: {json.dumps({'stream': stream, 'text': text})}\n\n"
+            next_index = index + 1
+        changed = bool(lines)
+        if info['progress'] != progress:
+            progress = info['progress']
+            changed = True
+            yield f"event: progress\ndata: {json.dumps(progress)}\n\n"
+        # Output is written in the same transaction as the final status, so nothing is left to read
+        if info['status'] in FINISHED_STATES:
+            yield f"event: status\ndata: {json.dumps(info)}\n\n"
+            return
+        if changed:
+            idle_since = time.monotonic()
+        elif time.monotonic() - idle_since >= keepalive:
+            idle_since = time.monotonic()
+            yield ": keepalive\n\n"
+        time.sleep(STREAM_POLL_INTERVAL)
@@ -0,0 +1,292 @@
+"""In-memory library snapshot shared by the library, stats and lyrics endpoints
+
+The snapshot holds every library item as the dict served by /api/library. It
+is keyed on the beets database file's mtime and size and only rebuilt when
+those change, or after Beetiful itself modified the library and called
+invalidate().
+
+Each rebuild that changes anything bumps a revision counter and records which
+items were added, modified or removed, so clients can sync deltas through
+get_changes() instead of downloading the whole library again. Revisions are
+per process; the epoch token lets clients detect that they reached a
+different worker or a restarted server and must reload.
+"""
+
+import os
+import time
+import uuid
+import threading
+import logging
+import weakref
+from collections import deque
+
+import metrics
+import beets_library
+from beets_utils import human_bytes, PLACEHOLDERS
+
+logger = logging.getLogger(__name__)
+
+# Number of per-item change records kept for delta sync
+CHANGE_LOG_SIZE = 50000
+
+_lock = threading.Lock()
+_snapshot = None
+_invalidated = False
+
+EPOCH = uuid.uuid4().hex[:12]
+_revision = 0
+# (revision, kind, item_id) records, oldest first
+_changes = deque()
+# Oldest revision from which the change log is still complete
+_log_floor = 0
+# Live SnapshotViews, re-tagged when a forked worker takes a new epoch
+_views = weakref.WeakSet()
+
+
+class LibrarySnapshot:
+    """Immutable view of the library at one database signature."""
+
+    def __init__(self, items, signature, revision):
+        self.items = items
+        self.by_id = {item['id']: item for item in items}
+        self.signature = signature
+        self.revision = revision
+        self.built_at = time.time()
+        self._stats = None
+
+    def get(self, item_id):
+        """Look up an item by id, accepting ints or numeric strings."""
+        try:
+            return self.by_id.get(int(item_id))
+        except (TypeError, ValueError):
+            return self.by_id.get(item_id)
+
+    @property
+    def stats(self):
+        """Aggregate library statistics, computed once per snapshot."""
+        metrics.record_cache('stats', self._stats is not None)
+        if self._stats is None:
+            stats = beets_library.library_stats()
+            stats['total_size'] = human_bytes(stats['total_bytes'])
+            self._stats = stats
+        return self._stats
+
+
+def database_signature():
+    """Return (mtime_ns, size) for the database and its WAL file, if any."""
+    path = beets_library.library_db_path()
+    signature = []
+    for candidate in (path, path + '-wal'):
+        try:
+            st = os.stat(candidate)
+            signature.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+
+def peek_snapshot():
+    """Return the current snapshot if it is still valid, without rebuilding it."""
+    snapshot = _snapshot
+    if snapshot is not None and not _invalidated and snapshot.signature == database_signature():
+        return snapshot
+    return None
+
+
+def get_snapshot():
+    """Return the current library snapshot, rebuilding it if the database changed."""
+    global _snapshot, _invalidated
+
+    signature = database_signature()
+    snapshot = _snapshot
+    if snapshot is not None and not _invalidated and snapshot.signature == signature:
+        metrics.record_cache('library_snapshot', True)
+        return snapshot
+
+    with _lock:
+        # Another thread may have rebuilt the snapshot while we waited
+        signature = database_signature()
+        snapshot = _snapshot
+        if snapshot is not None and not _invalidated and snapshot.signature == signature:
+            metrics.record_cache('library_snapshot', True)
+            return snapshot
+
+        metrics.record_cache('library_snapshot', False)
+
+        _invalidated = False
+        started = time.monotonic()
+        items = beets_library.list_items()
+        revision = _record_changes(snapshot, items)
+        _snapshot = LibrarySnapshot(items, signature, revision)
+        logger.info(f"Built library snapshot with {len(items)} items in {time.monotonic() - started:.2f}s")
+        return _snapshot
+
+
+def _record_changes(previous, items):
+    """Diff a rebuilt item list against the previous snapshot and log the changes.
+
+    Returns the revision for the new snapshot. Must be called with _lock held.
+    """
+    global _revision, _log_floor
+
+    if previous is None:
+        _revision += 1
+        _log_floor = _revision + 1
+        return _revision
+
+    changes = []
+    current_ids = set()
+    for item in items:
+        current_ids.add(item['id'])
+        old = previous.by_id.get(item['id'])
+        if old is None:
+            changes.append(('added', item['id']))
+        elif old != item:
+            changes.append(('modified', item['id']))
+    for item_id in previous.by_id.keys() - current_ids:
+        changes.append(('removed', item_id))
+
+    if not changes:
+        return _revision
+
+    _revision += 1
+    for kind, item_id in changes:
+        _changes.append((_revision, kind, item_id))
+    while len(_changes) > CHANGE_LOG_SIZE:
+        dropped_revision = _changes.popleft()[0]
+        _log_floor = dropped_revision + 1
+    return _revision
+
+
+def get_changes(since, epoch=None):
+    """Return the items added, modified and removed after revision `since`.
+
+    If the change log no longer reaches back to `since`, or the epoch does not
+    match this process, the result has reset=True and the client must reload.
+    """
+    snapshot = get_snapshot()
+    result = {'epoch': EPOCH, 'revision': snapshot.revision}
+
+    with _lock:
+        if (epoch and epoch != EPOCH) or since < _log_floor - 1 or since > snapshot.revision:
+            result['reset'] = True
+            return result
+        entries = [(kind, item_id) for revision, kind, item_id in _changes
+                   if since < revision <= snapshot.revision]
+
+    # Collapse each item's history into its net change
+    first_kind = {}
+    last_kind = {}
+    for kind, item_id in entries:
+        first_kind.setdefault(item_id, kind)
+        last_kind[item_id] = kind
+
+    added, modified, removed = [], [], []
+    for item_id, last in last_kind.items():
+        first = first_kind[item_id]
+        if last == 'removed':
+            if first != 'added':
+                removed.append(item_id)
+        elif first == 'added':
+            added.append(snapshot.by_id[item_id])
+        else:
+            modified.append(snapshot.by_id[item_id])
+
+    result.update({'reset': False, 'added': added, 'modified': modified, 'removed': removed})
+    return result
+
+
+def _reseed_epoch():
+    """Give a forked worker its own epoch.
+
+    Workers forked from a preloaded parent inherit its snapshot and views,
+    but their revisions diverge from then on, so clients must be able to
+    tell them apart. State built before the fork stays valid.
+    """
+    global EPOCH
+    previous, EPOCH = EPOCH, uuid.uuid4().hex[:12]
+    for view in list(_views):
+        if view.epoch == previous:
+            view.epoch = EPOCH
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reseed_epoch)
+
+
+class SnapshotView:
+    """Base for structures derived from the snapshot and kept current via deltas.
+
+    Subclasses implement clear(), add_item(item) and remove_item(item_id).
+    sync() rebuilds from scratch the first time and whenever the change log
+    cannot bridge the gap, and otherwise applies only the changed items.
+    """
+
+    name = 'view'
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.revision = None
+        self.epoch = None
+        _views.add(self)
+
+    def clear(self):
+        raise NotImplementedError
+
+    def add_item(self, item):
+        raise NotImplementedError
+
+    def remove_item(self, item_id):
+        raise NotImplementedError
+
+    def sync(self):
+        """Bring the view up to date, returning the snapshot it now reflects."""
+        with self._lock:
+            snapshot = get_snapshot()
+            if self.revision == snapshot.revision and self.epoch == EPOCH:
+                metrics.record_cache(self.name, True)
+                return snapshot
+            metrics.record_cache(self.name, False)
+
+            changes = None
+            if self.revision is not None:
+                changes = get_changes(self.revision, self.epoch)
+
+            if changes is None or changes['reset']:
+                self.clear()
+                for item in snapshot.items:
+                    self.add_item(item)
+                self.revision = snapshot.revision
+                logger.info(f"Built {self.name} from {len(snapshot.items)} items")
+            else:
+                for item_id in changes['removed']:
+                    self.remove_item(item_id)
+                for item in changes['added'] + changes['modified']:
+                    self.remove_item(item['id'])
+                    self.add_item(item)
+                self.revision = changes['revision']
+                snapshot = get_snapshot()
+
+            self.epoch = EPOCH
+            return snapshot
+
+
+def invalidate():
+    """Force a rebuild on next access, e.g. after Beetiful modified the library."""
+    global _invalidated
+    _invalidated = True
+
+
+def get_track_metadata(track_id):
+    """Return artist/title/album/length for a track, with placeholders mapped to None.
+
+    Returns None if the track is not in the library.
+    """
+    item = get_snapshot().get(track_id)
+    if item is None:
+        return None
+    metadata = {field: item.get(field) for field in ('artist', 'title', 'album', 'length')}
+    for field, placeholder in PLACEHOLDERS.items():
+        if metadata.get(field) == placeholder:
+            metadata[field] = None
+    return metadata
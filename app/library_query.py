@@ -0,0 +1,92 @@
+"""Server-side filtering, sorting and pagination for library listings"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Fields the library table can be sorted by
+SORTABLE_FIELDS = ['id', 'title', 'artist', 'album', 'genre', 'year', 'length', 'bitrate', 'path']
+
+# Fields matched by the free-text filter
+SEARCH_FIELDS = ['title', 'artist', 'album', 'genre']
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 500
+
+def split_genres(genre):
+    """Split a combined genre string ("Rock; Pop") into trimmed genre names."""
+    if not genre:
+        return []
+    names = genre.replace('/', ',').replace(';', ',').split(',')
+    return [name.strip() for name in names if name.strip()]
+
+def filter_items(items, q=None, genre=None):
+    """Filter items by case-insensitive substring match on the search fields and genre."""
+    if q:
+        needle = q.lower()
+        items = [
+            item for item in items
+            if any(item.get(field) and needle in str(item[field]).lower() for field in SEARCH_FIELDS)
+        ]
+    if genre:
+        genre = genre.lower()
+        items = [item for item in items if item.get('genre') and genre in item['genre'].lower()]
+    return items
+
+def sort_items(items, sort=None, order='asc'):
+    """Return items sorted by one field; unset values always sort last."""
+    if not sort or sort not in SORTABLE_FIELDS:
+        return list(items)
+
+    def key(item):
+        value = item[sort]
+        return value.lower() if isinstance(value, str) else value
+
+    present = [item for item in items if item.get(sort) is not None]
+    missing = [item for item in items if item.get(sort) is None]
+    present.sort(key=key, reverse=(order == 'desc'))
+    return present + missing
+
+def parse_page_args(args):
+    """Read offset/limit/sort/order/q/genre from request args with clamping."""
+    try:
+        offset = max(int(args.get('offset', 0)), 0)
+    except ValueError:
+        offset = 0
+    try:
+        limit = min(max(int(args.get('limit', DEFAULT_LIMIT)), 1), MAX_LIMIT)
+    except ValueError:
+        limit = DEFAULT_LIMIT
+    order = args.get('order', 'asc').lower()
+    return {
+        'offset': offset,
+        'limit': limit,
+        'sort': args.get('sort') or None,
+        'order': 'desc' if order == 'desc' else 'asc',
+        'q': (args.get('q') or '').strip() or None,
+        'genre': (args.get('genre') or '').strip() or None
+    }
+
+def query_page(items, offset=0, limit=DEFAULT_LIMIT, sort=None, order='asc', q=None, genre=None):
+    """Filter, sort and slice items into one page of results.
+
+    The returned 'genres' lists every genre present after the text filter,
+    so the genre dropdown can be populated without the full library.
+    """
+    matched = filter_items(items, q=q)
+
+    genres = set()
+    for item in matched:
+        genres.update(split_genres(item.get('genre')))
+
+    if genre:
+        matched = filter_items(matched, genre=genre)
+    matched = sort_items(matched, sort, order)
+
+    return {
+        'items': matched[offset:offset + limit],
+        'total': len(matched),
+        'offset': offset,
+        'limit': limit,
+        'genres': sorted(genres, key=str.lower)
+    }
@@ -1,56 +1,236 @@
 """LRCLib API service for fetching and parsing timed lyrics"""
 
-import requests
+import os
 import re
+import time
 import logging
+import threading
+from array import array
+from bisect import bisect_right
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import metrics
+import lyrics_cache
 
 # Set up logger for this module
 logger = logging.getLogger(__name__)
 
-def fetch_lyrics_from_lrclib(artist, title, album=None, duration=None):
-    """Fetch lyrics from LRCLib API using artist, title, and optional album/duration."""
+LRCLIB_URL = os.getenv('BEETIFUL_LRCLIB_URL', 'https://lrclib.net').rstrip('/')
+POOL_SIZE = int(os.getenv('BEETIFUL_LRCLIB_POOL_SIZE', 10))
+MAX_RETRIES = int(os.getenv('BEETIFUL_LRCLIB_RETRIES', 3))
+RETRY_BACKOFF = float(os.getenv('BEETIFUL_LRCLIB_BACKOFF', 0.5))
+REQUEST_TIMEOUT = float(os.getenv('BEETIFUL_LRCLIB_TIMEOUT', 10))
+# Consecutive failed lookups before LRCLib is skipped, and for how many seconds
+BREAKER_THRESHOLD = int(os.getenv('BEETIFUL_LRCLIB_BREAKER_THRESHOLD', 5))
+BREAKER_COOLDOWN = float(os.getenv('BEETIFUL_LRCLIB_BREAKER_COOLDOWN', 60))
+# Requests per second across all threads, so bulk fetches stay polite
+RATE_LIMIT = float(os.getenv('BEETIFUL_LRCLIB_RATE', 10))
+
+USER_AGENT = 'Beetiful (https://github.com/Sc00tz/beetiful)'
+
+class CircuitOpenError(requests.RequestException):
+    """Raised instead of calling LRCLib while the circuit breaker is open."""
+
+class CircuitBreaker:
+    """Stop calling a failing service for a cooldown period.
+
+    After `threshold` consecutive failures the breaker opens and calls fail
+    fast. Once `cooldown` seconds have passed a single trial call is let
+    through; success closes the breaker, failure opens it again.
+    """
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial_running or time.monotonic() - self._opened_at < self.cooldown:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._opened_at is not None or self._failures >= self.threshold:
+                if self._opened_at is None:
+                    logger.warning(f"LRCLib failing, pausing lookups for {self.cooldown:.0f}s")
+                self._opened_at = time.monotonic()
+
+    @property
+    def is_open(self):
+        with self._lock:
+            return self._opened_at is not None
+
+class RateLimiter:
+    """Token bucket shared by every thread; acquire() blocks until a request may go out."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+breaker = CircuitBreaker(BREAKER_THRESHOLD, BREAKER_COOLDOWN)
+rate_limiter = RateLimiter(RATE_LIMIT)
+
+_session_lock = threading.Lock()
+_session = None
+_session_pid = None
+
+def _create_session():
+    retry = Retry(
+        total=MAX_RETRIES,
+        backoff_factor=RETRY_BACKOFF,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=['GET'],
+        respect_retry_after_header=True,
+        # Hand back the last response so the caller can raise on it
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers['User-Agent'] = USER_AGENT
+    return session
+
+def get_session():
+    """Return the shared keep-alive session, recreating it after a fork."""
+    global _session, _session_pid
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            _session = _create_session()
+            _session_pid = os.getpid()
+        return _session
+
+def _get(path, params):
+    started = time.perf_counter()
+    status = 'error'
     try:
-        params = {'artist_name': artist, 'track_name': title}
-        if album:
-            params['album_name'] = album
-        logger.info(f"Fetching lyrics from LRCLib for {artist} - {title}")
-        response = requests.get('https://lrclib.net/api/search', params=params, timeout=10)
-        if response.status_code == 200:
-            results = response.json()
-            if results:
-                best_match = None
-                for result in results:
-                    artist_match = (result.get('artistName', '').lower() == artist.lower())
-                    title_match = (result.get('trackName', '').lower() == title.lower())
-                    if artist_match and title_match:
-                        best_match = result
-                        break
-                chosen_result = best_match or results[0]
-                lyrics_data = {
-                    'plain_lyrics': chosen_result.get('plainLyrics'),
-                    'synced_lyrics': chosen_result.get('syncedLyrics'),
-                    'duration': str(chosen_result.get('duration')) if chosen_result.get('duration') is not None else None,
-                    'source': 'lrclib'
-                }
-                logger.info(f"Found lyrics from LRCLib: plain={bool(lyrics_data['plain_lyrics'])}, synced={bool(lyrics_data['synced_lyrics'])}")
-                return lyrics_data
-        # Fallback to general search
-        general_params = {'q': f'{artist} {title}'}
-        response = requests.get('https://lrclib.net/api/search', params=general_params, timeout=10)
-        if response.status_code == 200:
-            results = response.json()
-            if results:
-                chosen_result = results[0]
-                lyrics_data = {
-                    'plain_lyrics': chosen_result.get('plainLyrics'),
-                    'synced_lyrics': chosen_result.get('syncedLyrics'),
-                    'duration': str(chosen_result.get('duration')) if chosen_result.get('duration') is not None else None,
-                    'source': 'lrclib'
-                }
-                logger.info(f"Found lyrics from LRCLib (general search): plain={bool(lyrics_data['plain_lyrics'])}, synced={bool(lyrics_data['synced_lyrics'])}")
-                return lyrics_data
-        logger.info("No lyrics found on LRCLib")
+        rate_limiter.acquire()
+        response = get_session().get(f"{LRCLIB_URL}{path}", params=params, timeout=REQUEST_TIMEOUT)
+        status = response.status_code
+    finally:
+        metrics.LRCLIB_DURATION.observe(time.perf_counter() - started, status=status)
+    if response.status_code >= 500 or response.status_code == 429:
+        response.raise_for_status()
+    return response
+
+def _to_lyrics_data(result):
+    return {
+        'plain_lyrics': result.get('plainLyrics'),
+        'synced_lyrics': result.get('syncedLyrics'),
+        'duration': str(result.get('duration')) if result.get('duration') is not None else None,
+        'source': 'lrclib'
+    }
+
+def _search_lrclib(artist, title, album=None):
+    """Query LRCLib, returning lyrics data or None if nothing matched.
+
+    Raises requests.RequestException on network errors, so that failures are
+    not mistaken for (and cached as) missing lyrics. Transient errors are
+    retried with exponential backoff before giving up, and repeated failures
+    open the circuit breaker so lookups fail fast for a while.
+    """
+    if not breaker.allow():
+        raise CircuitOpenError("LRCLib circuit breaker is open")
+    try:
+        lyrics_data = _search(artist, title, album)
+    except Exception:
+        breaker.record_failure()
+        raise
+    breaker.record_success()
+    return lyrics_data
+
+def _search(artist, title, album=None):
+    params = {'artist_name': artist, 'track_name': title}
+    if album:
+        params['album_name'] = album
+    logger.info(f"Fetching lyrics from LRCLib for {artist} - {title}")
+    response = _get('/api/search', params)
+    if response.status_code == 200:
+        results = response.json()
+        if results:
+            best_match = None
+            for result in results:
+                artist_match = (result.get('artistName', '').lower() == artist.lower())
+                title_match = (result.get('trackName', '').lower() == title.lower())
+                if artist_match and title_match:
+                    best_match = result
+                    break
+            lyrics_data = _to_lyrics_data(best_match or results[0])
+            logger.info(f"Found lyrics from LRCLib: plain={bool(lyrics_data['plain_lyrics'])}, synced={bool(lyrics_data['synced_lyrics'])}")
+            return lyrics_data
+    # Fallback to general search
+    general_params = {'q': f'{artist} {title}'}
+    response = _get('/api/search', general_params)
+    if response.status_code == 200:
+        results = response.json()
+        if results:
+            lyrics_data = _to_lyrics_data(results[0])
+            logger.info(f"Found lyrics from LRCLib (general search): plain={bool(lyrics_data['plain_lyrics'])}, synced={bool(lyrics_data['synced_lyrics'])}")
+            return lyrics_data
+    logger.info("No lyrics found on LRCLib")
+    return None
+
+def lookup_lyrics(artist, title, album=None, duration=None, use_cache=True):
+    """Like fetch_lyrics_from_lrclib, but lets requests.RequestException propagate."""
+    if not artist or not title:
         return None
+    key = lyrics_cache.make_key(artist, title, album, duration)
+    if use_cache:
+        cached = lyrics_cache.get(key)
+        metrics.record_cache('lrclib', cached is not None)
+        if cached is lyrics_cache.NOT_FOUND:
+            logger.info(f"LRCLib miss for {artist} - {title} served from cache")
+            return None
+        if cached is not None:
+            return cached
+    lyrics_data = _search_lrclib(artist, title, album)
+    lyrics_cache.put(key, lyrics_data)
+    return lyrics_data
+
+def fetch_lyrics_from_lrclib(artist, title, album=None, duration=None, use_cache=True):
+    """Fetch lyrics from LRCLib API using artist, title, and optional album/duration.
+
+    Results, including "not found", are served from the persistent lyrics
+    cache when possible. Pass use_cache=False to force a fresh lookup.
+    """
+    try:
+        return lookup_lyrics(artist, title, album, duration, use_cache)
     except requests.RequestException as e:
         logger.error(f"Error fetching from LRCLib: {e}")
         return None
@@ -58,6 +238,9 @@ def fetch_lyrics_from_lrclib(artist, title, album=None, duration=None):
         logger.error(f"Unexpected error fetching from LRCLib: {e}")
         return None
 
+_DURATION_RE = re.compile(r'^(\d+):(\d{2})(?:\.(\d{1,2}))?$')
+_LRC_LINE_RE = re.compile(r'\[(\d{2}):(\d{2})\.?((?:\d{0,2}))\](.*)')
+
 def parse_duration(duration_str):
     """Convert duration string (float seconds or mm:ss) to float seconds."""
     if duration_str is None:
@@ -65,7 +248,7 @@ def parse_duration(duration_str):
     if isinstance(duration_str, (int, float)):
         return float(duration_str)
     if isinstance(duration_str, str):
-        match = re.match(r'^(\d+):(\d{2})\.?((?:\d{0,2}))\](.*)', duration_str)
+        match = _DURATION_RE.match(duration_str.strip())
         if match:
             minutes = int(match.group(1))
             seconds = int(match.group(2))
@@ -77,30 +260,90 @@ def parse_duration(duration_str):
             return None
     return None
 
-def parse_lrc_lyrics(lyrics_text):
-    """Parse LRC format lyrics into timed and plain segments."""
-    if not lyrics_text:
-        return None
-    lrc_pattern = r'\[(\d{2}):(\d{2})\.?((?:\d{0,2}))\](.*)'
-    timed_lyrics = []
-    plain_lyrics = []
+def _iter_lrc_lines(lyrics_text):
+    """Yield (timestamp_ms, text) for timed lines and (None, line) for untimed ones."""
     for line in lyrics_text.split('\n'):
         line = line.strip()
         if not line:
             continue
-        match = re.match(lrc_pattern, line)
+        match = _LRC_LINE_RE.match(line)
         if match:
             minutes = int(match.group(1))
             seconds = int(match.group(2))
             centiseconds = int(match.group(3).ljust(2, '0')[:2]) if match.group(3) else 0
             text = match.group(4).strip()
-            timestamp = (minutes * 60 + seconds) * 1000 + centiseconds * 10
             if text:
-                timed_lyrics.append({'time': timestamp, 'text': text})
-                plain_lyrics.append(text)
+                yield (minutes * 60 + seconds) * 1000 + centiseconds * 10, text
         else:
-            plain_lyrics.append(line)
+            yield None, line
+
+def parse_lrc_lyrics(lyrics_text):
+    """Parse LRC format lyrics into timed and plain segments."""
+    if not lyrics_text:
+        return None
+    timed_lyrics = []
+    plain_lyrics = []
+    for timestamp, text in _iter_lrc_lines(lyrics_text):
+        if timestamp is not None:
+            timed_lyrics.append({'time': timestamp, 'text': text})
+        plain_lyrics.append(text)
     if timed_lyrics:
         return {'type': 'timed', 'timed': timed_lyrics, 'plain': '\n'.join(plain_lyrics)}
     else:
-        return {'type': 'plain', 'plain': lyrics_text}
\ No newline at end of file
+        return {'type': 'plain', 'plain': lyrics_text}
+
+class TimedLyrics:
+    """Timed lyric lines as parallel sorted arrays of start times and text offsets.
+
+    `text` holds the lines joined by newlines; line i spans
+    text[offsets[i]:offsets[i + 1] - 1]. The arrays are compact enough to
+    persist per track and are searched with bisect, so finding the line for
+    a playback position never re-parses the LRC source.
+    """
+
+    def __init__(self, times, offsets, text):
+        self.times = times
+        self.offsets = offsets
+        self.text = text
+
+    @classmethod
+    def from_lrc(cls, lyrics_text):
+        """Build the index from LRC text, or return None if it has no timed lines."""
+        lines = sorted(
+            ((timestamp, text) for timestamp, text in _iter_lrc_lines(lyrics_text or '') if timestamp is not None),
+            key=lambda line: line[0]
+        )
+        if not lines:
+            return None
+        times = array('q')
+        offsets = array('q')
+        position = 0
+        for timestamp, text in lines:
+            times.append(timestamp)
+            offsets.append(position)
+            position += len(text) + 1
+        return cls(times, offsets, '\n'.join(text for _, text in lines))
+
+    @classmethod
+    def from_bytes(cls, times, offsets, text):
+        """Rebuild an index from the blobs written by to_bytes()."""
+        time_array = array('q')
+        time_array.frombytes(times)
+        offset_array = array('q')
+        offset_array.frombytes(offsets)
+        return cls(time_array, offset_array, text)
+
+    def to_bytes(self):
+        return self.times.tobytes(), self.offsets.tobytes(), self.text
+
+    def __len__(self):
+        return len(self.times)
+
+    def line(self, index):
+        start = self.offsets[index]
+        end = self.offsets[index + 1] - 1 if index + 1 < len(self.offsets) else len(self.text)
+        return self.text[start:end]
+
+    def active_index(self, position_ms):
+        """Index of the line playing at position_ms, or -1 before the first line."""
+        return bisect_right(self.times, position_ms) - 1
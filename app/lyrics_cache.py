@@ -0,0 +1,153 @@
+"""Persistent SQLite cache for LRCLib lookups
+
+Entries are keyed on normalized artist, title, album and rounded duration.
+Found lyrics are kept for BEETIFUL_LYRICS_CACHE_TTL seconds and "not found"
+results for the shorter BEETIFUL_LYRICS_NEGATIVE_TTL, so a missing track is
+retried eventually without hitting LRCLib on every lookup. The cache holds at
+most BEETIFUL_LYRICS_CACHE_SIZE entries and evicts the least recently used.
+
+The same database keeps pre-parsed timed lyrics per track, keyed on a digest
+of the stored LRC text so edits made anywhere invalidate them.
+"""
+
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+import logging
+
+from config_manager import beets_config_dir
+
+logger = logging.getLogger(__name__)
+
+CACHE_PATH = os.getenv('BEETIFUL_LYRICS_CACHE', os.path.join(beets_config_dir, 'beetiful_lyrics_cache.db'))
+POSITIVE_TTL = int(os.getenv('BEETIFUL_LYRICS_CACHE_TTL', 30 * 24 * 3600))
+NEGATIVE_TTL = int(os.getenv('BEETIFUL_LYRICS_NEGATIVE_TTL', 24 * 3600))
+MAX_ENTRIES = int(os.getenv('BEETIFUL_LYRICS_CACHE_SIZE', 20000))
+
+# Sentinel returned by get() when the cache knows LRCLib has no lyrics
+NOT_FOUND = object()
+
+_local = threading.local()
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def _connect():
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        os.makedirs(os.path.dirname(CACHE_PATH) or '.', exist_ok=True)
+        conn = sqlite3.connect(CACHE_PATH, timeout=10)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS lyrics_cache ('
+            'key TEXT PRIMARY KEY, payload TEXT, expires_at REAL, accessed_at REAL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_lyrics_cache_accessed ON lyrics_cache (accessed_at)')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS timed_lyrics ('
+            'track_id INTEGER PRIMARY KEY, digest TEXT, times BLOB, offsets BLOB, text TEXT)'
+        )
+        conn.commit()
+        _local.conn = conn
+    return conn
+
+
+def _normalize(value):
+    return _WHITESPACE_RE.sub(' ', str(value or '')).strip().lower()
+
+
+def make_key(artist, title, album=None, duration=None):
+    """Build the cache key for a lookup."""
+    try:
+        seconds = str(int(round(float(duration)))) if duration is not None else ''
+    except (TypeError, ValueError):
+        seconds = ''
+    return '\x1f'.join([_normalize(artist), _normalize(title), _normalize(album), seconds])
+
+
+def get(key):
+    """Return the cached lyrics dict, NOT_FOUND for a cached miss, or None if not cached."""
+    now = time.time()
+    try:
+        conn = _connect()
+        row = conn.execute(
+            'SELECT payload, expires_at FROM lyrics_cache WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        payload, expires_at = row
+        if expires_at < now:
+            conn.execute('DELETE FROM lyrics_cache WHERE key = ?', (key,))
+            conn.commit()
+            return None
+        conn.execute('UPDATE lyrics_cache SET accessed_at = ? WHERE key = ?', (now, key))
+        conn.commit()
+        return json.loads(payload) if payload is not None else NOT_FOUND
+    except sqlite3.Error as e:
+        logger.error(f"Error reading lyrics cache: {e}")
+        return None
+
+
+def put(key, lyrics_data):
+    """Cache a lookup result; pass None to record that no lyrics were found."""
+    now = time.time()
+    ttl = POSITIVE_TTL if lyrics_data is not None else NEGATIVE_TTL
+    payload = json.dumps(lyrics_data) if lyrics_data is not None else None
+    try:
+        conn = _connect()
+        conn.execute(
+            'INSERT OR REPLACE INTO lyrics_cache VALUES (?, ?, ?, ?)',
+            (key, payload, now + ttl, now)
+        )
+        count = conn.execute('SELECT COUNT(*) FROM lyrics_cache').fetchone()[0]
+        if count > MAX_ENTRIES:
+            # Evict a tenth at a time so trimming isn't needed on every insert
+            conn.execute(
+                'DELETE FROM lyrics_cache WHERE key IN '
+                '(SELECT key FROM lyrics_cache ORDER BY accessed_at LIMIT ?)',
+                (count - MAX_ENTRIES + MAX_ENTRIES // 10,)
+            )
+        conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Error writing lyrics cache: {e}")
+
+
+def clear():
+    """Remove every cached entry."""
+    try:
+        conn = _connect()
+        conn.execute('DELETE FROM lyrics_cache')
+        conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Error clearing lyrics cache: {e}")
+
+
+def get_timed(track_id, digest):
+    """Return (times, offsets, text) blobs for a track's parsed lyrics, or None.
+
+    Entries parsed from different lyrics than `digest` describes are ignored.
+    """
+    try:
+        row = _connect().execute(
+            'SELECT times, offsets, text FROM timed_lyrics WHERE track_id = ? AND digest = ?',
+            (int(track_id), digest)
+        ).fetchone()
+        return tuple(row) if row else None
+    except sqlite3.Error as e:
+        logger.error(f"Error reading timed lyrics: {e}")
+        return None
+
+
+def put_timed(track_id, digest, times, offsets, text):
+    """Store the parsed lyrics for a track, replacing any older entry."""
+    try:
+        conn = _connect()
+        conn.execute(
+            'INSERT OR REPLACE INTO timed_lyrics VALUES (?, ?, ?, ?, ?)',
+            (int(track_id), digest, times, offsets, text)
+        )
+        conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Error writing timed lyrics: {e}")
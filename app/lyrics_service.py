@@ -1,48 +1,122 @@
 """Lyrics service for Beets and LRCLib integration"""
 
 import os
+import hashlib
+import threading
 import subprocess
-import re
 import logging
-from pathlib import Path
-from lrclib_service import fetch_lyrics_from_lrclib, parse_lrc_lyrics
-from config_manager import read_config
-from beets_utils import clean_field
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from lrclib_service import fetch_lyrics_from_lrclib, lookup_lyrics, parse_lrc_lyrics, TimedLyrics
+from beets_utils import PLACEHOLDERS
+import beets_library
+import jobs
+import metrics
+import lyrics_cache
+from library_cache import get_track_metadata, database_signature
 
 logger = logging.getLogger(__name__)
 
-def get_track_lyrics(track_id, beets_bin):
+# Concurrent LRCLib lookups in a batch fetch; the request rate is capped separately
+BATCH_WORKERS = int(os.getenv('BEETIFUL_LYRICS_WORKERS', 8))
+# Fetched lyrics written to the library per transaction
+BATCH_WRITE_SIZE = 100
+# Parsed timed lyrics kept in memory, for tracks that are being played
+TIMED_CACHE_SIZE = 256
+
+_timed_lock = threading.Lock()
+# track id -> (database signature, lyrics digest, TimedLyrics or None)
+_timed_indexes = OrderedDict()
+
+def _digest(lyrics):
+    return hashlib.sha1(lyrics.encode('utf-8')).hexdigest()
+
+def _timed_index(track_id, lyrics):
+    """Return the TimedLyrics for lyrics text, from the persistent store when possible."""
+    digest = _digest(lyrics or '')
+    stored = lyrics_cache.get_timed(track_id, digest)
+    if stored is not None:
+        index = TimedLyrics.from_bytes(*stored)
+    else:
+        index = TimedLyrics.from_lrc(lyrics)
+        blobs = index.to_bytes() if index is not None else (b'', b'', '')
+        lyrics_cache.put_timed(track_id, digest, *blobs)
+    return digest, (index if index is not None and len(index) else None)
+
+def get_timed_lyrics(track_id):
+    """Return the TimedLyrics index for a track's stored lyrics.
+
+    Returns None if the track does not exist or its lyrics are not synced.
+    While the library database is unchanged the index is served from memory
+    without reading the lyrics again.
+    """
+    try:
+        track_id = int(track_id)
+    except (TypeError, ValueError):
+        return None
+    signature = database_signature()
+    with _timed_lock:
+        cached = _timed_indexes.get(track_id)
+        if cached is not None and cached[0] == signature:
+            _timed_indexes.move_to_end(track_id)
+            metrics.record_cache('timed_lyrics', True)
+            return cached[2]
+    metrics.record_cache('timed_lyrics', False)
+
+    fields = beets_library.get_item_fields(track_id, ['lyrics'])
+    if fields is None:
+        return None
+    lyrics = fields.get('lyrics') or ''
+    if cached is not None and cached[1] == _digest(lyrics):
+        digest, index = cached[1], cached[2]
+    else:
+        digest, index = _timed_index(track_id, lyrics)
+    with _timed_lock:
+        _timed_indexes[track_id] = (signature, digest, index)
+        _timed_indexes.move_to_end(track_id)
+        while len(_timed_indexes) > TIMED_CACHE_SIZE:
+            _timed_indexes.popitem(last=False)
+    return index
+
+def get_active_line(track_id, position_ms, context=0):
+    """Return the synced lyric line playing at a position, with `context` lines around it."""
+    index = get_timed_lyrics(track_id)
+    if index is None:
+        return {'error': 'No timed lyrics for this track'}, 404
+    active = index.active_index(position_ms)
+    result = {
+        'index': active,
+        'time': index.times[active] if active >= 0 else None,
+        'text': index.line(active) if active >= 0 else None,
+        'next_time': index.times[active + 1] if active + 1 < len(index) else None,
+        'total_lines': len(index)
+    }
+    if context:
+        start = max(active - context, 0)
+        end = min(active + context + 1, len(index))
+        result['lines'] = [
+            {'index': i, 'time': index.times[i], 'text': index.line(i)} for i in range(start, end)
+        ]
+    return result, 200
+
+def get_track_lyrics(track_id):
     """Get lyrics for a track, always returning plain text for API display."""
     try:
-        # Get track info from beets first
-        cmd = [beets_bin, 'list', '--format', '$lyrics\\t$path\\t$artist\\t$title\\t$album\\t$length', f'id:{track_id}']
-        process = subprocess.run(cmd, capture_output=True, text=True, check=True, env=os.environ.copy())
-        output = process.stdout.strip()
-
-        if not output or output == '$lyrics\\t$path\\t$artist\\t$title\\t$album\\t$length':
-            beets_lyrics = None
-            track_path = None
-            artist = None
-            title = None
-            album = None
-            duration = None
-        else:
-            parts = output.split('\\t')
-            beets_lyrics = parts[0] if parts[0] != '$lyrics' else None
-            track_path = parts[1] if len(parts) > 1 and parts[1] != '$path' else None
-            artist = parts[2] if len(parts) > 2 and parts[2] != '$artist' else None
-            title = parts[3] if len(parts) > 3 and parts[3] != '$title' else None
-            album = parts[4] if len(parts) > 4 and parts[4] != '$album' else None
-            duration = parts[5] if len(parts) > 5 and parts[5] != '$length' else None
-
-        # Clean fields
-        artist = clean_field(artist, 'artist')
-        title = clean_field(title, 'title')
-        album = clean_field(album, 'album')
-        # beets_lyrics is likely plain text, so no special handling for timed here
-        beets_lyrics = clean_field(beets_lyrics, 'lyrics')
-
-        # Try LRCLib for synced lyrics first
+        # Track metadata comes from the library snapshot; only lyrics need a lookup
+        metadata = get_track_metadata(track_id) or {}
+        fields = beets_library.get_item_fields(track_id, ['lyrics']) if metadata else None
+        beets_lyrics = (fields or {}).get('lyrics')
+        artist = metadata.get('artist')
+        title = metadata.get('title')
+        album = metadata.get('album')
+        duration = metadata.get('length')
+
+        # Stored lyrics that are already synced need no LRCLib lookup at all
+        stored = get_timed_lyrics(track_id) if beets_lyrics else None
+        if stored is not None:
+            return {'lyrics': stored.text, 'type': 'timed', 'source': 'beets'}, 200
+
+        # Try LRCLib (through the lyrics cache) for synced lyrics next
         lrclib_data = fetch_lyrics_from_lrclib(artist, title, album, duration)
         if lrclib_data and lrclib_data.get('synced_lyrics'):
             logger.info(f"Attempting to parse synced lyrics from LRCLib for {artist} - {title}.")
@@ -68,12 +142,13 @@ def get_track_lyrics(track_id, beets_bin):
         logger.error(f"An unexpected error occurred while fetching lyrics: {e}")
         return {'error': f"An unexpected error occurred: {e}"}, 500
 
-def set_track_lyrics(track_id, lyrics, beets_bin):
+def set_track_lyrics(track_id, lyrics):
     """Set lyrics for a track, using non-interactive mode."""
     try:
-        # Always add '-y' to suppress prompts
-        cmd = [beets_bin, 'modify', '-y', f'id:{track_id}', f'lyrics={lyrics}']
-        process = subprocess.run(cmd, capture_output=True, text=True, check=True, env=os.environ.copy())
+        if not beets_library.modify_item(track_id, {'lyrics': lyrics}):
+            return {'error': 'Track not found', 'status': 404}
+        # Parse once now, so synced display doesn't have to on first play
+        _timed_index(track_id, lyrics)
         return {'message': 'Lyrics updated successfully'}
     except subprocess.CalledProcessError as e:
         logger.error(f"Error setting lyrics: {e.stderr}")
@@ -82,32 +157,29 @@ def set_track_lyrics(track_id, lyrics, beets_bin):
         logger.error(f"Error setting lyrics: {e}")
         return {'error': f"An unexpected error occurred: {e}"}, 500
 
-def fetch_lyrics_for_track(track_id, beets_bin):
+def fetch_lyrics_for_track(track_id):
     """Fetch lyrics for a track from LRCLib API."""
     try:
-        # Get track info from beets first
-        cmd = [beets_bin, 'list', '--format', '$artist\\t$title\\t$album\\t$length', f'id:{track_id}']
-        process = subprocess.run(cmd, capture_output=True, text=True, check=True, env=os.environ.copy())
-        output = process.stdout.strip()
+        # Get track info from the library snapshot
+        metadata = get_track_metadata(track_id)
 
-        if not output:
+        if metadata is None:
             return {'error': 'Track not found'}, 404
 
-        parts = output.split('\\t')
-        artist = clean_field(parts[0], 'artist') if parts[0] != '$artist' else None
-        title = clean_field(parts[1], 'title') if parts[1] != '$title' else None
-        album = clean_field(parts[2], 'album') if parts[2] != '$album' else None
-        duration = parts[3] if len(parts) > 3 and parts[3] != '$length' else None
+        artist = metadata.get('artist')
+        title = metadata.get('title')
+        album = metadata.get('album')
+        duration = metadata.get('length')
 
         if not artist or not title:
             return {'error': 'Track missing required metadata (artist/title)'}, 400
 
-        # Try LRCLib for lyrics
-        lrclib_data = fetch_lyrics_from_lrclib(artist, title, album, duration)
+        # An explicit fetch always asks LRCLib again, refreshing the cache
+        lrclib_data = fetch_lyrics_from_lrclib(artist, title, album, duration, use_cache=False)
         if lrclib_data and (lrclib_data.get('synced_lyrics') or lrclib_data.get('plain_lyrics')):
             # If we got lyrics, store them in beets
             lyrics_text = lrclib_data.get('synced_lyrics') or lrclib_data.get('plain_lyrics')
-            set_track_lyrics(track_id, lyrics_text, beets_bin)
+            set_track_lyrics(track_id, lyrics_text)
             return {'message': 'Lyrics fetched and saved successfully'}, 200
 
         return {'error': 'No lyrics found'}, 404
@@ -117,4 +189,83 @@ def fetch_lyrics_for_track(track_id, beets_bin):
         return {'error': f"Failed to fetch track info: {e.stderr}"}, 500
     except Exception as e:
         logger.error(f"Unexpected error while fetching lyrics: {e}")
-        return {'error': f"An unexpected error occurred: {e}"}, 500
\ No newline at end of file
+        return {'error': f"An unexpected error occurred: {e}"}, 500
+
+def _lyrics_text(lrclib_data):
+    """Pick the text to store from an LRCLib result, preferring synced lyrics."""
+    if not lrclib_data:
+        return None
+    return lrclib_data.get('synced_lyrics') or lrclib_data.get('plain_lyrics') or None
+
+def _fetch_batch(job, query, use_cache):
+    tracks = beets_library.list_items_missing(query, 'lyrics')
+    total = len(tracks)
+    counts = {'found': 0, 'not_found': 0, 'failed': 0, 'saved': 0}
+    job.emit(f"{total} tracks without lyrics match the query")
+    job.set_progress(0, total, **counts)
+
+    def lookup(track):
+        if job.cancel_requested:
+            return None
+        artist, title, album = (
+            track[field] if track[field] != PLACEHOLDERS[field] else None
+            for field in ('artist', 'title', 'album')
+        )
+        return _lyrics_text(lookup_lyrics(artist, title, album, track.get('length'), use_cache=use_cache))
+
+    pending = []
+
+    def flush():
+        saved = dict(pending)
+        for result in beets_library.modify_items(pending):
+            if result['status'] == 'updated':
+                counts['saved'] += 1
+                _timed_index(result['id'], saved[result['id']]['lyrics'])
+            else:
+                counts['failed'] += 1
+                job.emit(f"Could not save lyrics for track {result['id']}: {result.get('error', result['status'])}", 'stderr')
+        pending.clear()
+
+    done = 0
+    with ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix='beetiful-lyrics') as pool:
+        futures = {pool.submit(lookup, track): track for track in tracks}
+        for future in as_completed(futures):
+            track = futures[future]
+            done += 1
+            try:
+                lyrics = future.result()
+            except Exception as e:
+                lyrics = None
+                counts['failed'] += 1
+                job.emit(f"Lookup failed for {track['artist']} - {track['title']}: {e}", 'stderr')
+            else:
+                if not lyrics and not job.cancel_requested:
+                    counts['not_found'] += 1
+            if job.cancel_requested:
+                continue
+            if lyrics:
+                counts['found'] += 1
+                pending.append((track['id'], {'lyrics': lyrics}))
+                job.emit(f"Found lyrics for {track['artist']} - {track['title']}")
+                if len(pending) >= BATCH_WRITE_SIZE:
+                    flush()
+            if done % 10 == 0 or done == total:
+                job.set_progress(done, total, **counts)
+    # Lyrics already fetched are kept even if the job was cancelled
+    if pending:
+        flush()
+    job.set_progress(done, total, **counts)
+    job.emit(
+        f"Saved lyrics for {counts['saved']} of {total} tracks "
+        f"({counts['not_found']} not found, {counts['failed']} failed)"
+    )
+    return 1 if counts['failed'] else 0
+
+def fetch_lyrics_batch(query='', use_cache=True):
+    """Queue a job that fetches LRCLib lyrics for every matching track without lyrics.
+
+    Lookups run on a bounded thread pool under the global LRCLib rate limit,
+    and results are written back in batched transactions. Returns the Job.
+    """
+    description = f"Fetch lyrics for {query or 'all tracks'}"
+    return jobs.submit('lyrics', description, lambda job: _fetch_batch(job, query, use_cache))
@@ -0,0 +1,267 @@
+"""Request timing, subprocess instrumentation and cache counters
+
+Metrics are kept in memory and served in the Prometheus text format at
+/metrics. They cover request latency per route, time spent serializing JSON,
+every `beet` (and other) subprocess, LRCLib round trips, config.yaml reads
+and writes, and hits and misses of the in-process caches.
+
+Each worker process keeps its own metrics, so with BEETIFUL_WORKERS above 1
+a scrape only sees the worker that answered it.
+
+Per-request profiling is opt-in through BEETIFUL_PROFILE: `header` profiles
+requests sent with an `X-Beetiful-Profile: 1` header, `all` profiles every
+request. Profiles are written as cProfile dumps (readable with pstats or
+snakeviz) to BEETIFUL_PROFILE_DIR. The response names the file, without its
+directory, in its X-Beetiful-Profile header, and the full path is logged.
+"""
+
+import os
+import re
+import time
+import cProfile
+import tempfile
+import threading
+import logging
+from contextlib import contextmanager
+
+from flask import g, request
+from flask.json.provider import DefaultJSONProvider
+
+logger = logging.getLogger(__name__)
+
+PROFILE_MODE = os.getenv('BEETIFUL_PROFILE', 'off').lower()
+PROFILE_DIR = os.getenv('BEETIFUL_PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'beetiful-profiles'))
+PROFILE_HEADER = 'X-Beetiful-Profile'
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds in seconds, from sub-millisecond cache hits to long beets commands
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+_registry = []
+_START_TIME = time.time()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A monotonically increasing count per label combination."""
+
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name, _format_labels(self.labelnames, key), value
+
+
+class Histogram:
+    """Observations counted into cumulative buckets, plus their sum and count."""
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # label values -> [per-bucket counts..., +Inf count], sum
+        self._values = {}
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of a block, including blocks that raise."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield self.name + '_bucket', _format_labels(self.labelnames, key, [('le', _format_value(bound))]), cumulative
+            yield self.name + '_sum', _format_labels(self.labelnames, key), total
+            yield self.name + '_count', _format_labels(self.labelnames, key), cumulative
+
+
+REQUEST_DURATION = Histogram(
+    'beetiful_http_request_duration_seconds',
+    'Time spent handling HTTP requests, until the response is returned (streamed bodies excluded).',
+    ('method', 'route', 'status')
+)
+JSON_DURATION = Histogram(
+    'beetiful_json_serialize_duration_seconds',
+    'Time spent serializing JSON response bodies.',
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+)
+SUBPROCESS_DURATION = Histogram(
+    'beetiful_subprocess_duration_seconds',
+    'Wall time of subprocesses such as beet commands, from start to exit.',
+    ('command',)
+)
+LRCLIB_DURATION = Histogram(
+    'beetiful_lrclib_request_duration_seconds',
+    'LRCLib HTTP round trips, including retries and rate limiting waits.',
+    ('status',)
+)
+CONFIG_DURATION = Histogram(
+    'beetiful_config_duration_seconds',
+    'Time spent reading (including cache hits) and writing config.yaml.',
+    ('operation',)
+)
+CACHE_REQUESTS = Counter(
+    'beetiful_cache_requests_total',
+    'Lookups in the in-process caches, by cache and hit or miss.',
+    ('cache', 'result')
+)
+
+
+def record_cache(cache, hit):
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+def command_name(args):
+    """Label for a subprocess: `beet <subcommand>` for beets, else the program name."""
+    if isinstance(args, str):
+        args = args.split()
+    if not args:
+        return 'unknown'
+    program = os.path.basename(str(args[0]))
+    if program == 'beet' and len(args) > 1:
+        return f"beet {args[1]}"
+    return program
+
+
+def time_command(args):
+    """Context manager timing one subprocess run."""
+    return SUBPROCESS_DURATION.time(command=command_name(args))
+
+
+def render():
+    """Every metric in the Prometheus text exposition format."""
+    lines = [
+        '# HELP beetiful_process_start_time_seconds Start time of the process since the Unix epoch.',
+        '# TYPE beetiful_process_start_time_seconds gauge',
+        f'beetiful_process_start_time_seconds {_START_TIME}'
+    ]
+    for metric in _registry:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+        for name, labels, value in metric.samples():
+            lines.append(f'{name}{labels} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider, timing how long response bodies take to serialize."""
+
+    def dumps(self, obj, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            JSON_DURATION.observe(time.perf_counter() - started)
+
+
+_PROFILE_NAME_RE = re.compile(r'[^A-Za-z0-9_.-]+')
+
+
+def _wants_profile():
+    if PROFILE_MODE == 'all':
+        return True
+    if PROFILE_MODE == 'header':
+        return request.headers.get(PROFILE_HEADER, '').lower() in ('1', 'true', 'yes', 'on')
+    return False
+
+
+def _save_profile(profiler, route):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    name = _PROFILE_NAME_RE.sub('_', f"{request.method}-{route}").strip('_')
+    path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{name}.prof")
+    profiler.dump_stats(path)
+    return path
+
+
+def init_app(app):
+    """Time every request of a Flask app, and profile it when asked to."""
+    app.json = TimedJSONProvider(app)
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_started = time.perf_counter()
+        if _wants_profile():
+            g.metrics_profiler = cProfile.Profile()
+            g.metrics_profiler.enable()
+
+    @app.after_request
+    def _observe(response):
+        started = g.pop('metrics_started', None)
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        profiler = g.pop('metrics_profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            try:
+                path = _save_profile(profiler, route)
+                logger.info(f"Saved request profile to {path}")
+                # Clients only get the file name, not the server's filesystem layout
+                response.headers[PROFILE_HEADER] = os.path.basename(path)
+            except OSError as e:
+                logger.error(f"Could not save request profile: {e}")
+        if started is not None:
+            REQUEST_DURATION.observe(
+                time.perf_counter() - started,
+                method=request.method, route=route, status=response.status_code
+            )
+        return response
+
+    return app
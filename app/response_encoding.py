@@ -0,0 +1,176 @@
+"""Response compression and compact encodings for large payloads
+
+Responses above COMPRESS_MIN_SIZE are compressed with brotli (when the
+`brotli` package is installed) or gzip, whichever the client accepts.
+
+Item lists can also be sent in a columnar layout: one array per field rather
+than one object per item, with artist, album, genre and album artist replaced
+by indexes into a list of their distinct values. Clients opt in with
+`?format=columnar` or an Accept header of COLUMNAR_MIMETYPE, and may ask for
+MessagePack instead of JSON (with or without the columnar layout) through
+Accept when the `msgpack` package is installed. Encoded bodies of whole-library responses are
+cached per library revision, so repeat downloads are served without being
+serialized or compressed again.
+"""
+
+import os
+import gzip
+import threading
+import logging
+from collections import OrderedDict
+
+from flask import Response, current_app, request
+
+import metrics
+
+try:
+    import brotli
+except ImportError:  # Optional; gzip is always available
+    brotli = None
+
+try:
+    import msgpack
+except ImportError:  # Optional; clients asking for MessagePack get JSON
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+# Smallest body, in bytes, worth compressing
+COMPRESS_MIN_SIZE = int(os.getenv('BEETIFUL_COMPRESS_MIN_SIZE', 1024))
+GZIP_LEVEL = int(os.getenv('BEETIFUL_GZIP_LEVEL', 6))
+BROTLI_QUALITY = int(os.getenv('BEETIFUL_BROTLI_QUALITY', 5))
+# Encoded whole-library bodies kept, one per layout/serialization/compression variant
+PAYLOAD_CACHE_SIZE = 8
+
+COLUMNAR_MIMETYPE = 'application/vnd.beetiful.columnar+json'
+MSGPACK_MIMETYPE = 'application/msgpack'
+MSGPACK_MIMETYPES = (MSGPACK_MIMETYPE, 'application/x-msgpack', 'application/vnd.msgpack')
+
+COMPRESSIBLE_MIMETYPES = {
+    'application/json', COLUMNAR_MIMETYPE, MSGPACK_MIMETYPE,
+    'text/html', 'text/plain', 'text/css', 'text/javascript', 'application/javascript'
+}
+
+# Columns sent as indexes into a list of their distinct values
+DICTIONARY_FIELDS = ('artist', 'album', 'genre', 'albumartist')
+
+_payload_lock = threading.Lock()
+_payloads = OrderedDict()
+
+
+def to_columnar(items):
+    """Convert a list of item dicts to the columnar layout."""
+    fields = list(items[0]) if items else []
+    columns = {}
+    dictionaries = {}
+    for field in fields:
+        values = [item.get(field) for item in items]
+        if field in DICTIONARY_FIELDS:
+            index = {}
+            columns[field] = [index.setdefault(value, len(index)) for value in values]
+            dictionaries[field] = list(index)
+        else:
+            columns[field] = values
+    return {'count': len(items), 'fields': fields, 'columns': columns, 'dictionaries': dictionaries}
+
+
+def negotiate():
+    """Return (columnar, use_msgpack) for the current request."""
+    accept = request.accept_mimetypes
+    json_quality = accept['application/json']
+    columnar = request.args.get('format') == 'columnar' or accept[COLUMNAR_MIMETYPE] > json_quality
+    use_msgpack = msgpack is not None and max(accept[mimetype] for mimetype in MSGPACK_MIMETYPES) > json_quality
+    return columnar, use_msgpack
+
+
+def choose_encoding():
+    """The content coding to compress with for the current request, or None."""
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br'] and accepted['br'] >= accepted['gzip']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def _encode(payload, columnar, use_msgpack):
+    if columnar and isinstance(payload.get('items'), list):
+        payload = {**payload, 'items': to_columnar(payload['items']), 'encoding': 'columnar'}
+    else:
+        columnar = False
+    if use_msgpack:
+        return msgpack.packb(payload, use_bin_type=True), MSGPACK_MIMETYPE
+    body = current_app.json.dumps(payload).encode('utf-8')
+    return body, COLUMNAR_MIMETYPE if columnar else 'application/json'
+
+
+def respond(payload, cache_key=None):
+    """Build a response for a dict payload in the encoding the client negotiated.
+
+    A payload with an 'items' list may be sent columnar. With a cache_key,
+    which must change whenever the payload does, the encoded and compressed
+    body is reused for later requests asking for the same variant.
+    """
+    columnar, use_msgpack = negotiate()
+    encoding = choose_encoding()
+    key = (cache_key, columnar, use_msgpack, encoding) if cache_key is not None else None
+
+    cached = None
+    if key is not None:
+        with _payload_lock:
+            cached = _payloads.get(key)
+            if cached is not None:
+                _payloads.move_to_end(key)
+        metrics.record_cache('encoded_response', cached is not None)
+    if cached is not None:
+        body, mimetype, content_encoding = cached
+    else:
+        body, mimetype = _encode(payload, columnar, use_msgpack)
+        content_encoding = None
+        if encoding is not None and len(body) >= COMPRESS_MIN_SIZE:
+            body = compress(body, encoding)
+            content_encoding = encoding
+        if key is not None:
+            with _payload_lock:
+                _payloads[key] = (body, mimetype, content_encoding)
+                _payloads.move_to_end(key)
+                while len(_payloads) > PAYLOAD_CACHE_SIZE:
+                    _payloads.popitem(last=False)
+
+    response = Response(body, mimetype=mimetype)
+    if content_encoding is not None:
+        response.headers['Content-Encoding'] = content_encoding
+    response.vary.update(('Accept', 'Accept-Encoding'))
+    return response
+
+
+def init_app(app):
+    """Compress other large responses of a Flask app as they go out."""
+
+    @app.after_request
+    def _compress(response):
+        if (
+            response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.status_code < 200 or response.status_code in (204, 206, 304)
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+        ):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = choose_encoding()
+        if encoding is None:
+            return response
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return response
+        response.set_data(compress(data, encoding))
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    return app
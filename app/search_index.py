@@ -0,0 +1,187 @@
+"""Full-text search index over the library snapshot
+
+An inverted index from normalized tokens of title, artist, album, genre and
+path to the items containing them. Query tokens match exactly, by prefix (for
+type-ahead) and optionally by trigram similarity for typos. The index follows
+the library snapshot incrementally through library_cache.get_changes(), so
+edits and removals only touch the affected items.
+"""
+
+import re
+import heapq
+import bisect
+import unicodedata
+import logging
+
+import library_cache
+
+logger = logging.getLogger(__name__)
+
+# Relative weight of a token match in each indexed field
+FIELD_WEIGHTS = {
+    'title': 4.0,
+    'artist': 3.0,
+    'album': 2.0,
+    'genre': 1.0,
+    'path': 0.5
+}
+
+# Most index tokens a single prefix may expand to
+MAX_PREFIX_EXPANSION = 5000
+# Minimum trigram (Jaccard) similarity for a fuzzy token match
+FUZZY_THRESHOLD = 0.4
+# Shortest query token considered for fuzzy matching
+FUZZY_MIN_LENGTH = 3
+
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def normalize(text):
+    """Lowercase text and strip accents so "Beyoncé" matches "beyonce"."""
+    text = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in text if not unicodedata.combining(c)).lower()
+
+
+def tokenize(text):
+    """Split text into normalized word tokens."""
+    if not text:
+        return []
+    return _TOKEN_RE.findall(normalize(str(text)))
+
+
+def trigrams(token):
+    """Return the padded character trigrams of a token."""
+    padded = f'  {token} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex(library_cache.SnapshotView):
+    """Inverted token index with prefix and trigram lookup."""
+
+    name = 'search index'
+
+    def __init__(self):
+        super().__init__()
+        self._postings = {}
+        self._item_tokens = {}
+        self._trigrams = {}
+        self._sorted_tokens = []
+        self._sorted_dirty = False
+
+    def clear(self):
+        self._postings = {}
+        self._item_tokens = {}
+        self._trigrams = {}
+        self._sorted_tokens = []
+        self._sorted_dirty = False
+
+    def add_item(self, item):
+        weights = {}
+        for field, field_weight in FIELD_WEIGHTS.items():
+            for token in set(tokenize(item.get(field))):
+                weights[token] = weights.get(token, 0.0) + field_weight
+
+        item_id = item['id']
+        for token, weight in weights.items():
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = {}
+                for gram in trigrams(token):
+                    self._trigrams.setdefault(gram, set()).add(token)
+                self._sorted_dirty = True
+            postings[item_id] = weight
+        self._item_tokens[item_id] = set(weights)
+
+    def remove_item(self, item_id):
+        for token in self._item_tokens.pop(item_id, ()):
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            postings.pop(item_id, None)
+            if not postings:
+                del self._postings[token]
+                for gram in trigrams(token):
+                    tokens = self._trigrams.get(gram)
+                    if tokens is not None:
+                        tokens.discard(token)
+                        if not tokens:
+                            del self._trigrams[gram]
+                self._sorted_dirty = True
+
+    def _token_matches(self, query_token, fuzzy):
+        """Map index tokens matching a query token to a match quality factor."""
+        matches = {}
+        if query_token in self._postings:
+            matches[query_token] = 1.0
+
+        if self._sorted_dirty:
+            self._sorted_tokens = sorted(self._postings)
+            self._sorted_dirty = False
+        start = bisect.bisect_left(self._sorted_tokens, query_token)
+        end = min(start + MAX_PREFIX_EXPANSION, len(self._sorted_tokens))
+        for token in self._sorted_tokens[start:end]:
+            if not token.startswith(query_token):
+                break
+            if token != query_token:
+                # Prefer completions that add fewer characters
+                matches[token] = 0.5 + 0.4 * len(query_token) / len(token)
+
+        if not matches and fuzzy and len(query_token) >= FUZZY_MIN_LENGTH:
+            query_grams = trigrams(query_token)
+            shared = {}
+            for gram in query_grams:
+                for token in self._trigrams.get(gram, ()):
+                    shared[token] = shared.get(token, 0) + 1
+            for token, count in shared.items():
+                similarity = count / (len(query_grams) + len(trigrams(token)) - count)
+                if similarity >= FUZZY_THRESHOLD:
+                    matches[token] = 0.5 * similarity
+        return matches
+
+    def search(self, query, limit=20, fuzzy=True):
+        """Return (total, [(score, item_id), ...]) for items matching every query token."""
+        query_tokens = list(dict.fromkeys(tokenize(query)))
+        if not query_tokens:
+            return 0, []
+
+        with self._lock:
+            scores = None
+            for query_token in query_tokens:
+                token_scores = {}
+                for token, factor in self._token_matches(query_token, fuzzy).items():
+                    for item_id, weight in self._postings[token].items():
+                        score = weight * factor
+                        if score > token_scores.get(item_id, 0.0):
+                            token_scores[item_id] = score
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {
+                        item_id: score + token_scores[item_id]
+                        for item_id, score in scores.items() if item_id in token_scores
+                    }
+                if not scores:
+                    return 0, []
+
+        ranked = heapq.nlargest(limit, scores.items(), key=lambda entry: (entry[1], -entry[0]))
+        return len(scores), [(score, item_id) for item_id, score in ranked]
+
+
+_index = SearchIndex()
+
+
+def search_library(query, limit=20, fuzzy=True):
+    """Search the library, returning matching item dicts ranked by score."""
+    snapshot = _index.sync()
+    total, ranked = _index.search(query, limit=limit, fuzzy=fuzzy)
+    items = []
+    for score, item_id in ranked:
+        item = snapshot.by_id.get(item_id)
+        if item is not None:
+            items.append({**item, 'score': round(score, 3)})
+    return {'items': items, 'total': total, 'revision': snapshot.revision}
+
+
+def warm_up():
+    """Build the search index now instead of on the first request."""
+    _index.sync()
@@ -0,0 +1,416 @@
+"""Optional watch mode that keeps the beets library in sync with the music folder
+
+With BEETIFUL_WATCH enabled, changes under LIBRARY_PATH are picked up with
+inotify, or by polling directory mtimes where inotify is unavailable or the
+watch limit is too low. Events are debounced and batched, then handed to a
+background job that runs `beet update` on just the affected directories and
+`beet import` on new audio files, instead of rescanning the whole library.
+
+New files in a directory that has no library items yet are imported as an
+album; new files added next to existing items are imported as singletons.
+Imports use --nocopy since the files already live in the library folder.
+The polling fallback sees added, removed and renamed files, but not files
+rewritten in place, because that does not change their directory's mtime.
+"""
+
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+import logging
+
+import jobs
+import library_cache
+import dir_scanner
+from beets_utils import get_beets_bin, MAX_QUERY_TERMS
+from dir_scanner import AUDIO_EXTENSIONS
+from config_manager import beets_config_dir
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; every process would watch
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+WATCH_ENABLED = os.getenv('BEETIFUL_WATCH', 'false').lower() in ('1', 'true', 'yes', 'on')
+WATCH_ROOT = os.path.normpath(os.getenv('LIBRARY_PATH', '/music'))
+# Seconds without new events before a batch is processed
+DEBOUNCE = float(os.getenv('BEETIFUL_WATCH_DEBOUNCE', 10))
+# Longest a batch is held back while events keep arriving
+MAX_DELAY = float(os.getenv('BEETIFUL_WATCH_MAX_DELAY', 120))
+POLL_INTERVAL = float(os.getenv('BEETIFUL_WATCH_POLL_INTERVAL', 60))
+# Above this many directories a batch runs one full `beet update` instead
+MAX_TARGETED_DIRS = 200
+
+BEETS_BIN = get_beets_bin()
+
+CREATED = 'created'
+CHANGED = 'changed'
+DELETED = 'deleted'
+# Event queue overflowed; anything may have changed
+RESCAN = 'rescan'
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW)
+_EVENT_HEADER = struct.Struct('iIII')
+
+_status = {'enabled': WATCH_ENABLED, 'mode': None, 'root': WATCH_ROOT, 'pending': 0,
+           'last_batch_at': None, 'last_job_id': None}
+
+
+def _is_audio(path):
+    return os.path.splitext(path)[1].lower() in AUDIO_EXTENSIONS
+
+
+def _walk_dirs(root):
+    """Yield root and every directory below it, without following symlinks."""
+    stack = [root]
+    while stack:
+        path = stack.pop()
+        yield path
+        try:
+            with os.scandir(path) as entries:
+                stack.extend(entry.path for entry in entries if entry.is_dir(follow_symlinks=False))
+        except OSError:
+            continue
+
+
+class InotifyWatcher:
+    """Recursive inotify watch through libc, without third-party packages."""
+
+    mode = 'inotify'
+
+    def __init__(self, root):
+        libc_name = ctypes.util.find_library('c')
+        if libc_name is None:
+            raise OSError(errno.ENOSYS, 'libc not found')
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is not supported')
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._paths = {}
+        try:
+            self.add_tree(root)
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    def _add_watch(self, path):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error == errno.ENOSPC:
+                raise OSError(error, 'inotify watch limit reached (fs.inotify.max_user_watches)')
+            # Directory vanished or is unreadable; nothing to watch
+            return
+        self._paths[wd] = path
+
+    def add_tree(self, root):
+        for path in _walk_dirs(root):
+            self._add_watch(path)
+
+    def read(self, timeout):
+        """Wait up to `timeout` seconds and return [(kind, path, is_dir), ...]."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                events.append((RESCAN, None, True))
+                continue
+            if mask & IN_IGNORED:
+                self._paths.pop(wd, None)
+                continue
+            directory = self._paths.get(wd)
+            if directory is None or mask & IN_DELETE_SELF:
+                continue
+            path = os.path.join(directory, name)
+            is_dir = bool(mask & IN_ISDIR)
+            if mask & (IN_DELETE | IN_MOVED_FROM):
+                events.append((DELETED, path, is_dir))
+            elif is_dir and mask & (IN_CREATE | IN_MOVED_TO):
+                # Files may land in a new directory before it is watched
+                self.add_tree(path)
+                events.append((CREATED, path, True))
+            elif not is_dir and mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                events.append((CHANGED, path, False))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Fallback that compares directory mtimes and listings every POLL_INTERVAL seconds."""
+
+    mode = 'polling'
+
+    def __init__(self, root):
+        self.root = root
+        # directory -> (mtime_ns, {file name: (mtime_ns, size)}, [subdirectories])
+        self._dirs = {}
+        self._poll(report=False)
+        self._next_poll = time.monotonic() + POLL_INTERVAL
+
+    @staticmethod
+    def _list(path):
+        files = {}
+        subdirs = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif _is_audio(entry.name):
+                        st = entry.stat()
+                        files[entry.name] = (st.st_mtime_ns, st.st_size)
+                except OSError:
+                    continue
+        return files, subdirs
+
+    def _poll(self, report=True):
+        events = []
+        seen = {}
+        stack = [self.root]
+        while stack:
+            path = stack.pop()
+            try:
+                mtime_ns = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+            previous = self._dirs.get(path)
+            if previous is not None and previous[0] == mtime_ns:
+                seen[path] = previous
+                stack.extend(previous[2])
+                continue
+            try:
+                files, subdirs = self._list(path)
+            except OSError:
+                continue
+            seen[path] = (mtime_ns, files, subdirs)
+            stack.extend(subdirs)
+            if not report:
+                continue
+            if previous is None:
+                events.append((CREATED, path, True))
+                continue
+            old_files = previous[1]
+            for name, signature in files.items():
+                if old_files.get(name) != signature:
+                    events.append((CHANGED, os.path.join(path, name), False))
+            for name in old_files.keys() - files.keys():
+                events.append((DELETED, os.path.join(path, name), False))
+        if report:
+            for path in self._dirs.keys() - seen.keys():
+                events.append((DELETED, path, True))
+        self._dirs = seen
+        return events
+
+    def read(self, timeout):
+        wait = self._next_poll - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return []
+        time.sleep(max(wait, 0))
+        self._next_poll = time.monotonic() + POLL_INTERVAL
+        return self._poll()
+
+    def close(self):
+        pass
+
+
+def _or_query(terms):
+    """Join beets query terms with ',' so any of them matches."""
+    query = []
+    for term in terms:
+        query += [',', term] if query else [term]
+    return query
+
+
+def plan_commands(events, known_paths):
+    """Turn a batch of events into the `beet` commands that bring the library up to date.
+
+    `known_paths` is the set of item paths currently in the library.
+    """
+    if any(kind == RESCAN for kind, _, _ in events):
+        return [[BEETS_BIN, 'update']]
+
+    known_dirs = {os.path.dirname(path) for path in known_paths}
+    update_dirs = set()
+    new_albums = set()
+    new_files = set()
+    for kind, path, is_dir in events:
+        if is_dir:
+            if kind == DELETED:
+                update_dirs.add(path)
+            elif kind == CREATED:
+                # Anything inside a new directory is new to the library
+                for directory in _walk_dirs(path):
+                    try:
+                        with os.scandir(directory) as entries:
+                            if any(_is_audio(entry.name) for entry in entries):
+                                new_albums.add(directory)
+                    except OSError:
+                        continue
+            continue
+        if not _is_audio(path):
+            continue
+        if path in known_paths:
+            update_dirs.add(os.path.dirname(path))
+        elif kind != DELETED and os.path.exists(path):
+            new_files.add(path)
+
+    singletons = set()
+    for path in new_files:
+        directory = os.path.dirname(path)
+        if directory in new_albums:
+            continue
+        if directory in known_dirs:
+            singletons.add(path)
+        else:
+            new_albums.add(directory)
+
+    commands = []
+    if len(update_dirs) > MAX_TARGETED_DIRS:
+        commands.append([BEETS_BIN, 'update'])
+    elif update_dirs:
+        update_dirs = sorted(update_dirs)
+        for start in range(0, len(update_dirs), MAX_QUERY_TERMS):
+            chunk = update_dirs[start:start + MAX_QUERY_TERMS]
+            commands.append([BEETS_BIN, 'update'] + _or_query(f'path:{d}' for d in chunk))
+    if new_albums:
+        commands.append([BEETS_BIN, 'import', '-q', '-C'] + sorted(new_albums))
+    if singletons:
+        commands.append([BEETS_BIN, 'import', '-q', '-C', '-s'] + sorted(singletons))
+    return commands
+
+
+def _sync(job, commands):
+    returncode = 0
+    for args in commands:
+        if job.cancel_requested:
+            break
+        job.emit('$ ' + ' '.join(args[1:]))
+        returncode = jobs.run_command(job, args) or returncode
+    library_cache.invalidate()
+    dir_scanner.scan()
+    return returncode
+
+
+def _process(events):
+    known_paths = {item['path'] for item in library_cache.get_snapshot().items}
+    commands = plan_commands(events, known_paths)
+    _status['last_batch_at'] = time.time()
+    if not commands:
+        return None
+    job = jobs.submit('watch', f"Sync {len(events)} changes under {WATCH_ROOT}", lambda job: _sync(job, commands))
+    _status['last_job_id'] = job.id
+    return job
+
+
+def _open_watcher():
+    try:
+        return InotifyWatcher(WATCH_ROOT)
+    except OSError as e:
+        logger.warning(f"inotify unavailable ({e}), polling {WATCH_ROOT} every {POLL_INTERVAL:.0f}s")
+        return PollingWatcher(WATCH_ROOT)
+
+
+def _watch():
+    watcher = _open_watcher()
+    _status['mode'] = watcher.mode
+    logger.info(f"Watching {WATCH_ROOT} for changes ({watcher.mode})")
+    pending = {}
+    first_event = last_event = None
+    while True:
+        try:
+            events = watcher.read(timeout=1.0)
+        except OSError as e:
+            # Usually the watch limit after many new directories
+            logger.warning(f"Watcher failed ({e}), switching to polling")
+            watcher.close()
+            watcher = PollingWatcher(WATCH_ROOT)
+            _status['mode'] = watcher.mode
+            events = [(RESCAN, None, True)]
+        now = time.monotonic()
+        for kind, path, is_dir in events:
+            # Later events for a path supersede earlier ones
+            pending[path] = (kind, path, is_dir)
+            last_event = now
+            first_event = first_event or now
+        _status['pending'] = len(pending)
+        if pending and (now - last_event >= DEBOUNCE or now - first_event >= MAX_DELAY):
+            batch = list(pending.values())
+            pending.clear()
+            first_event = last_event = None
+            _status['pending'] = 0
+            try:
+                _process(batch)
+            except Exception as e:
+                logger.error(f"Error processing {len(batch)} file changes: {e}")
+
+
+def _run():
+    # Only one worker process watches; the others leave it to that one
+    lock_file = None
+    if fcntl is not None:
+        os.makedirs(beets_config_dir, exist_ok=True)
+        lock_file = open(os.path.join(beets_config_dir, 'beetiful_watch.lock'), 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            logger.info("Another process is watching the music folder")
+            lock_file.close()
+            return
+    try:
+        _watch()
+    except Exception as e:
+        logger.error(f"File watcher stopped: {e}")
+    finally:
+        _status['mode'] = None
+        if lock_file is not None:
+            lock_file.close()
+
+
+def watch_status():
+    return dict(_status)
+
+
+def start():
+    """Start watching WATCH_ROOT in a daemon thread if watch mode is enabled."""
+    if not WATCH_ENABLED:
+        return None
+    if not os.path.isdir(WATCH_ROOT):
+        logger.warning(f"Not watching {WATCH_ROOT}: no such directory")
+        return None
+    thread = threading.Thread(target=_run, name='beetiful-watch', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,41 @@
+"""WSGI entry point for production serving
+
+Run with gunicorn, which reads its settings from gunicorn.conf.py:
+
+    gunicorn -c gunicorn.conf.py wsgi:application
+
+The app module defines its routes on a module-level Flask app, so this
+exposes that app directly rather than going through a factory.
+"""
+
+import time
+import logging
+
+import library_cache
+import search_index
+import facets
+from config_manager import get_discovered_plugins
+from app import app as application, start_background_services
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['application', 'warm_up', 'start_background_services']
+
+
+def warm_up():
+    """Load shared state once so that forked workers start with it in memory.
+
+    The beets binary path is resolved when the app module is imported; this
+    adds plugin discovery, the library snapshot and its stats, the search
+    index and the facet aggregates. Failures only cost the workers a cold start.
+    """
+    started = time.monotonic()
+    get_discovered_plugins()
+    try:
+        snapshot = library_cache.get_snapshot()
+        snapshot.stats
+        search_index.warm_up()
+        facets.warm_up()
+        logger.info(f"Warmed up {len(snapshot.items)} library items in {time.monotonic() - started:.1f}s")
+    except Exception as e:
+        logger.warning(f"Could not warm up the library, workers will load it on demand: {e}")
@@ -0,0 +1,120 @@
+"""Generate a synthetic beets library for benchmarking
+
+Creates a self-contained BEETSDIR (config.yaml and library.db) plus a music
+directory laid out as Artist/Album/NN Title.ext, with one file per library
+item. Audio files are sparse files truncated to a plausible size, so even
+the 100k library takes next to no disk space while directory sizes and audio
+counts still look real to the file browser and directory scanner.
+
+Output is deterministic for a given --items and --seed, so benchmark runs
+against the same size are comparable.
+
+    python benchmarks/generate_library.py --items 10000 --dest /tmp/beetiful-bench-10k
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+
+from beets.library import Library, Item
+
+SIZES = {'1k': 1000, '10k': 10000, '100k': 100000}
+TRACKS_PER_ALBUM = 12
+ALBUMS_PER_ARTIST = 4
+GENRES = ['Rock', 'Jazz', 'Electronic', 'Hip-Hop', 'Classical', 'Folk', 'Metal', 'Pop', 'Soul', '']
+FORMATS = [('MP3', '.mp3', 320000), ('MP3', '.mp3', 192000), ('FLAC', '.flac', 900000), ('AAC', '.m4a', 256000)]
+WORDS = (
+    'night light river stone fire glass paper heart electric silver morning '
+    'shadow ocean golden broken summer winter echo city dream wild static '
+    'velvet northern signal hollow ember'
+).split()
+
+
+def _title(rng, words=3):
+    return ' '.join(rng.choice(WORDS).capitalize() for _ in range(rng.randint(1, words)))
+
+
+def synced_lyrics(rng, length):
+    """LRC lyrics spread evenly over `length` seconds."""
+    lines = []
+    count = max(int(length // 6), 1)
+    for i in range(count):
+        position = i * length / count
+        minutes, seconds = divmod(position, 60)
+        lines.append(f"[{int(minutes):02d}:{seconds:05.2f}]{_title(rng, 6)}")
+    return '\n'.join(lines)
+
+
+def parse_size(value):
+    return SIZES.get(value) or int(value)
+
+
+def generate(dest, items, seed=0, lyrics_ratio=0.2, files=True):
+    """Write config.yaml, library.db and the music tree under `dest`."""
+    rng = random.Random(seed)
+    music_dir = os.path.join(dest, 'music')
+    library_path = os.path.join(dest, 'library.db')
+    os.makedirs(music_dir, exist_ok=True)
+    if os.path.exists(library_path):
+        raise SystemExit(f"{library_path} already exists; pick an empty --dest")
+    with open(os.path.join(dest, 'config.yaml'), 'w') as f:
+        f.write(f"directory: {music_dir}\nlibrary: {library_path}\nimport:\n  write: false\n  copy: false\n")
+
+    lib = Library(library_path, music_dir)
+    started = time.monotonic()
+    with lib.transaction():
+        for i in range(items):
+            album_index = i // TRACKS_PER_ALBUM
+            artist_index = album_index // ALBUMS_PER_ARTIST
+            track = i % TRACKS_PER_ALBUM + 1
+            artist = f"Artist {artist_index:05d} {WORDS[artist_index % len(WORDS)].capitalize()}"
+            album = f"Album {album_index:06d} {WORDS[album_index % len(WORDS)].capitalize()}"
+            title = _title(rng)
+            format_name, extension, bitrate = FORMATS[album_index % len(FORMATS)]
+            length = rng.uniform(90, 420)
+            album_dir = os.path.join(music_dir, artist, album)
+            path = os.path.join(album_dir, f"{track:02d} {title}{extension}")
+            item = Item(
+                title=title,
+                artist=artist,
+                albumartist=artist,
+                album=album,
+                genre=GENRES[album_index % len(GENRES)],
+                year=1960 + album_index % 65,
+                track=track,
+                tracktotal=TRACKS_PER_ALBUM,
+                length=length,
+                bitrate=bitrate,
+                format=format_name,
+                samplerate=44100,
+                path=path.encode(),
+            )
+            if rng.random() < lyrics_ratio:
+                item.lyrics = synced_lyrics(rng, length)
+            lib.add(item)
+            if files:
+                os.makedirs(album_dir, exist_ok=True)
+                with open(path, 'wb') as f:
+                    f.truncate(int(length * bitrate / 8))
+    lib._close()
+    return time.monotonic() - started
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--items', default='1k', help='1k, 10k, 100k or an item count (default: 1k)')
+    parser.add_argument('--dest', required=True, help='directory to create the library in')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--lyrics-ratio', type=float, default=0.2, help='share of tracks with synced lyrics')
+    parser.add_argument('--no-files', action='store_true', help='only create the database, not the music tree')
+    args = parser.parse_args(argv)
+
+    items = parse_size(args.items)
+    elapsed = generate(args.dest, items, seed=args.seed, lyrics_ratio=args.lyrics_ratio, files=not args.no_files)
+    print(f"Generated {items} items in {args.dest} ({elapsed:.1f}s)")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
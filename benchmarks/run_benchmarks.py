@@ -0,0 +1,357 @@
+"""Latency, throughput and memory benchmarks for the Beetiful API
+
+Runs the main /api/* endpoints in-process through the Flask test client
+against a synthetic library (see generate_library.py), with LRCLib replaced
+by the local stub in stub_lrclib.py. Each scenario is first timed
+sequentially, then under concurrent load from a thread pool. Results are
+written as JSON, so runs can be compared over time:
+
+    python benchmarks/run_benchmarks.py --items 10k
+    python benchmarks/run_benchmarks.py --items 10k --compare benchmarks/results/<earlier>.json
+
+Libraries are generated on first use and reused from --library. Caches the
+app writes next to the library (lyrics, directory sizes, jobs) go to a fresh
+directory per run, so every run starts from the same cold state.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import resource
+import threading
+import subprocess
+import tracemalloc
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+import generate_library
+import stub_lrclib
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def summarize(latencies, elapsed):
+    """Latency percentiles in milliseconds and throughput in requests per second."""
+    values = sorted(latency * 1000 for latency in latencies)
+    return {
+        'requests': len(values),
+        'mean_ms': round(sum(values) / len(values), 3) if values else None,
+        'min_ms': round(values[0], 3) if values else None,
+        'p50_ms': round(percentile(values, 0.50), 3) if values else None,
+        'p95_ms': round(percentile(values, 0.95), 3) if values else None,
+        'p99_ms': round(percentile(values, 0.99), 3) if values else None,
+        'max_ms': round(values[-1], 3) if values else None,
+        'throughput_rps': round(len(values) / elapsed, 2) if elapsed > 0 else None
+    }
+
+
+def rss_mb():
+    """Current resident set size, from /proc where available."""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return round(pages * os.sysconf('SC_PAGE_SIZE') / 2 ** 20, 1)
+    except (OSError, ValueError):
+        return None
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10), 1)
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def prepare_environment(library_dir, state_dir, lrclib_url, backend):
+    """Point the app's configuration at the benchmark library before it is imported."""
+    os.environ.update({
+        'BEETSDIR': library_dir,
+        'LIBRARY_PATH': os.path.join(library_dir, 'music'),
+        'BEETIFUL_BACKEND': backend,
+        'BEETIFUL_LRCLIB_URL': lrclib_url,
+        'BEETIFUL_LRCLIB_RATE': '0',
+        'BEETIFUL_LYRICS_CACHE': os.path.join(state_dir, 'lyrics_cache.db'),
+        'BEETIFUL_DIR_CACHE': os.path.join(state_dir, 'dirs.db'),
+        'BEETIFUL_JOBS_DB': os.path.join(state_dir, 'jobs.db'),
+        'BEETIFUL_DIR_SCAN_INTERVAL': '0',
+        'BEETIFUL_WATCH': 'false',
+        'LOG_LEVEL': 'WARNING'
+    })
+    sys.path.insert(0, os.path.join(REPO_DIR, 'app'))
+
+
+def load_app(music_dir):
+    import logging
+    import app as app_module
+
+    logging.getLogger().setLevel(logging.WARNING)
+    app_module.app.logger.setLevel(logging.WARNING)
+    # The browser only allows /music and /config; allow the generated tree instead
+    allowed = os.path.realpath(music_dir)
+    app_module.is_path_safe = lambda path: os.path.realpath(path) == allowed or os.path.realpath(path).startswith(allowed + os.sep)
+    return app_module
+
+
+class Scenario:
+    """One benchmarked request; `request(rng)` returns (method, url, json body).
+
+    Responses must be 2xx or 304, or one of `statuses` when given.
+    """
+
+    def __init__(self, name, request, iterations=None, concurrent=True, before=None, statuses=()):
+        self.name = name
+        self.request = request
+        self.iterations = iterations
+        self.concurrent = concurrent
+        self.before = before
+        self.statuses = tuple(statuses)
+
+    def call(self, client, rng):
+        return _call(client, *self.request(rng), statuses=self.statuses)
+
+
+def build_scenarios(app_module, music_dir, lyric_ids):
+    library_cache = app_module.library_cache
+    items = library_cache.get_snapshot().items
+    ids = [item['id'] for item in items]
+    lyric_ids = sorted(lyric_ids) or ids
+    artists = sorted(os.listdir(music_dir))
+    words = generate_library.WORDS
+
+    def get(url):
+        return lambda rng: ('GET', url, None)
+
+    def cold_snapshot():
+        library_cache.invalidate()
+
+    return [
+        Scenario('library_cold', get('/api/library?limit=50'), iterations=5, concurrent=False, before=cold_snapshot),
+        Scenario('library_full', get('/api/library'), iterations=20),
+        Scenario('library_ndjson', get('/api/library?format=ndjson'), iterations=20),
+        Scenario('library_page', lambda rng: ('GET', f"/api/library?offset={rng.randrange(0, max(len(ids) - 100, 1))}&limit=100&sort=title", None)),
+        Scenario('library_filter', lambda rng: ('GET', f"/api/library?q={rng.choice(words)}&limit=100", None)),
+        Scenario('library_changes', lambda rng: ('GET', f"/api/library/changes?since=0&epoch={library_cache.EPOCH}", None)),
+        Scenario('search', lambda rng: ('GET', f"/api/library/search?q={rng.choice(words)}+{rng.choice(words)[:4]}", None)),
+        Scenario('facets', get('/api/facets')),
+        Scenario('facets_prefix', lambda rng: ('GET', f"/api/facets?facet=artists&prefix=Artist+{rng.randrange(10)}&limit=50", None)),
+        Scenario('stats', get('/api/stats')),
+        Scenario('browse_root', get(f"/api/browse?path={music_dir}&limit=200")),
+        Scenario('browse_root_filter', lambda rng: ('GET', f"/api/browse?path={music_dir}&q={rng.choice(words)}", None)),
+        Scenario('browse_artist', lambda rng: ('GET', f"/api/browse?path={os.path.join(music_dir, rng.choice(artists))}", None)),
+        Scenario('lyrics', lambda rng: ('GET', f"/api/library/lyrics/{rng.choice(lyric_ids)}", None)),
+        Scenario('lyrics_line', lambda rng: ('GET', f"/api/library/lyrics/{rng.choice(lyric_ids)}/line?position={rng.randrange(0, 180000)}&context=2", None)),
+        Scenario('plugins', get('/api/plugins')),
+        Scenario('config', get('/api/config')),
+        # Writes lyrics back to the library, so it runs last. The stub LRCLib
+        # has no lyrics for some tracks, which the endpoint answers with 404
+        Scenario('fetch_lyrics', lambda rng: ('POST', f"/api/library/fetch-lyrics/{rng.choice(ids)}", None), iterations=50, statuses=(404,))
+    ]
+
+
+def _call(client, method, url, body, statuses=()):
+    started = time.perf_counter()
+    response = client.open(url, method=method, json=body)
+    # Drain streamed responses so they are timed in full
+    response.get_data()
+    elapsed = time.perf_counter() - started
+    # Error responses are usually much cheaper than the real work, so they would skew timings
+    if not (200 <= response.status_code < 300 or response.status_code in (304,) + statuses):
+        raise RuntimeError(f"{method} {url} returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+    return elapsed
+
+
+def run_sequential(app_module, scenario, iterations, rng, trace_memory):
+    client = app_module.app.test_client()
+    # One untimed request to fill whatever the scenario caches
+    if scenario.before:
+        scenario.before()
+    scenario.call(client, rng)
+    rss_before = rss_mb()
+    if trace_memory:
+        tracemalloc.start()
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        if scenario.before:
+            scenario.before()
+        latencies.append(scenario.call(client, rng))
+    elapsed = time.perf_counter() - started
+    result = summarize(latencies, elapsed)
+    result['rss_mb'] = rss_mb()
+    result['rss_delta_mb'] = round(result['rss_mb'] - rss_before, 1) if result['rss_mb'] is not None and rss_before is not None else None
+    if trace_memory:
+        result['traced_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 2)
+        tracemalloc.stop()
+    return result
+
+
+def run_concurrent(app_module, scenario, requests_total, threads, seed):
+    lock = threading.Lock()
+    latencies = []
+
+    def worker(index, count):
+        client = app_module.app.test_client()
+        rng = random.Random(seed * 1000 + index)
+        local = [scenario.call(client, rng) for _ in range(count)]
+        with lock:
+            latencies.extend(local)
+
+    counts = [requests_total // threads + (1 if i < requests_total % threads else 0) for i in range(threads)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for future in [pool.submit(worker, i, count) for i, count in enumerate(counts)]:
+            future.result()
+    elapsed = time.perf_counter() - started
+    result = summarize(latencies, elapsed)
+    result['threads'] = threads
+    return result
+
+
+def compare(current, baseline_path):
+    """Print p50 latency and concurrent throughput against an earlier results file."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nCompared with {baseline_path} ({baseline['meta'].get('git_revision')}, {baseline['meta'].get('timestamp')})")
+    print(f"{'scenario':<20} {'p50 ms':>10} {'was':>10} {'change':>8}   {'conc rps':>10} {'was':>10} {'change':>8}")
+
+    def change(new, old):
+        return f"{(new - old) / old * 100:+.0f}%" if new is not None and old else '-'
+
+    for name, result in current['results'].items():
+        old = baseline['results'].get(name)
+        if old is None:
+            continue
+        p50, old_p50 = result['sequential']['p50_ms'], old['sequential']['p50_ms']
+        rps = (result.get('concurrent') or {}).get('throughput_rps')
+        old_rps = (old.get('concurrent') or {}).get('throughput_rps')
+        print(
+            f"{name:<20} {p50:>10} {old_p50:>10} {change(p50, old_p50):>8}   "
+            f"{rps if rps is not None else '-':>10} {old_rps if old_rps is not None else '-':>10} {change(rps, old_rps):>8}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--items', default='1k', help='1k, 10k, 100k or an item count (default: 1k)')
+    parser.add_argument('--library', help='library directory, generated if missing (default: <tmp>/beetiful-bench-<items>)')
+    parser.add_argument('--iterations', type=int, default=200, help='sequential requests per scenario')
+    parser.add_argument('--requests', type=int, default=400, help='concurrent requests per scenario')
+    parser.add_argument('--threads', type=int, default=8, help='concurrent client threads')
+    parser.add_argument('--backend', default='auto', choices=['auto', 'subprocess'], help='BEETIFUL_BACKEND to benchmark')
+    parser.add_argument('--lrclib-latency', type=float, default=0.0, help='seconds the stub LRCLib waits per request')
+    parser.add_argument('--only', help='comma-separated scenario names to run')
+    parser.add_argument('--trace-memory', action='store_true', help='record traced allocation peaks (slows every scenario)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='results file (default: benchmarks/results/<timestamp>-<items>.json)')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    args = parser.parse_args(argv)
+
+    items = generate_library.parse_size(args.items)
+    library_dir = os.path.abspath(args.library or os.path.join(tempfile.gettempdir(), f"beetiful-bench-{items}"))
+    if not os.path.exists(os.path.join(library_dir, 'library.db')):
+        print(f"Generating a {items}-item library in {library_dir} ...")
+        # In a separate process, as beets loads its configuration on first use and
+        # must only see the benchmark library's
+        subprocess.run(
+            [sys.executable, os.path.join(BENCH_DIR, 'generate_library.py'),
+             '--items', str(items), '--dest', library_dir, '--seed', str(args.seed)],
+            check=True
+        )
+    music_dir = os.path.join(library_dir, 'music')
+
+    stub = stub_lrclib.start(latency=args.lrclib_latency)
+    state_dir = tempfile.mkdtemp(prefix='beetiful-bench-state-')
+    prepare_environment(library_dir, state_dir, f"http://127.0.0.1:{stub.server_address[1]}", args.backend)
+    try:
+        started = time.perf_counter()
+        app_module = load_app(music_dir)
+        startup = {'import_s': round(time.perf_counter() - started, 3)}
+        started = time.perf_counter()
+        snapshot = app_module.library_cache.get_snapshot()
+        startup['snapshot_s'] = round(time.perf_counter() - started, 3)
+        started = time.perf_counter()
+        app_module.dir_scanner.scan()
+        startup['dir_scan_s'] = round(time.perf_counter() - started, 3)
+        startup['rss_mb'] = rss_mb()
+
+        lyrics = set(app_module.beets_library.query_item_ids('lyrics::.'))
+        scenarios = build_scenarios(app_module, music_dir, lyrics)
+        if args.only:
+            wanted = {name.strip() for name in args.only.split(',')}
+            scenarios = [scenario for scenario in scenarios if scenario.name in wanted]
+
+        results = {}
+        rng = random.Random(args.seed)
+        for scenario in scenarios:
+            iterations = min(scenario.iterations or args.iterations, args.iterations)
+            result = {'sequential': run_sequential(app_module, scenario, iterations, rng, args.trace_memory)}
+            if scenario.concurrent and args.requests > 0:
+                requests_total = min(args.requests, iterations * 2) if scenario.iterations else args.requests
+                result['concurrent'] = run_concurrent(app_module, scenario, requests_total, args.threads, args.seed)
+            results[scenario.name] = result
+            sequential = result['sequential']
+            concurrent = result.get('concurrent')
+            print(
+                f"{scenario.name:<20} p50 {sequential['p50_ms']:>9.3f} ms  p95 {sequential['p95_ms']:>9.3f} ms"
+                + (f"  {concurrent['throughput_rps']:>9.1f} req/s x{args.threads}" if concurrent else '')
+            )
+
+        output = {
+            'meta': {
+                'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                'git_revision': git_revision(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+                'items': len(snapshot.items),
+                'backend': args.backend,
+                'iterations': args.iterations,
+                'requests': args.requests,
+                'threads': args.threads,
+                'lrclib_latency': args.lrclib_latency,
+                'lrclib_requests': stub.requests,
+                'seed': args.seed,
+                'startup': startup,
+                'peak_rss_mb': peak_rss_mb()
+            },
+            'results': results
+        }
+        path = args.output or os.path.join(
+            RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{args.items}.json"
+        )
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(output, f, indent=2)
+        print(f"\nResults written to {path}")
+        if args.compare:
+            compare(output, args.compare)
+    finally:
+        stub.shutdown()
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,87 @@
+"""Local stand-in for the LRCLib API
+
+Answers /api/search with a deterministic synced-lyrics result (or an empty
+list for a share of queries) after an optional fixed delay, so lyrics
+benchmarks measure Beetiful rather than the network. Point the app at it
+with BEETIFUL_LRCLIB_URL.
+
+    python benchmarks/stub_lrclib.py --port 8765 --latency 0.05
+"""
+
+import sys
+import json
+import time
+import zlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/api/search':
+            self._send(404, {'message': 'Not found'})
+            return
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.server.requests += 1
+        artist = params.get('artist_name', '')
+        title = params.get('track_name') or params.get('q', '')
+        # Stable per query, so repeated runs see the same hits and misses
+        if zlib.crc32(f"{artist}\x1f{title}".encode()) % 100 < self.server.miss_percent:
+            self._send(200, [])
+            return
+        lines = '\n'.join(f"[00:{i * 5:02d}.00]{title} line {i}" for i in range(12))
+        self._send(200, [{
+            'artistName': artist,
+            'trackName': title,
+            'albumName': params.get('album_name', ''),
+            'duration': 180,
+            'plainLyrics': '\n'.join(f"{title} line {i}" for i in range(12)),
+            'syncedLyrics': lines
+        }])
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start(port=0, latency=0.0, miss_percent=10):
+    """Serve the stub on a daemon thread; returns the server (see server.server_address)."""
+    server = ThreadingHTTPServer(('127.0.0.1', port), StubHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.miss_percent = miss_percent
+    server.requests = 0
+    threading.Thread(target=server.serve_forever, name='stub-lrclib', daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds to wait before answering')
+    parser.add_argument('--miss-percent', type=int, default=10, help='share of queries with no lyrics')
+    args = parser.parse_args(argv)
+    server = start(args.port, args.latency, args.miss_percent)
+    print(f"Stub LRCLib listening on http://127.0.0.1:{server.server_address[1]}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
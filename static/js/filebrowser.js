@@ -3,6 +3,12 @@
 
 let currentBrowserPath = '/music';
 let browserCallback = null;
+let browserFilter = '';
+let browserLoaded = 0;
+let browserFilterTimer = null;
+
+// Entries requested per page; more are loaded on demand
+const BROWSER_PAGE_SIZE = 200;
 
 /**
  * Opens the file browser modal.
@@ -12,6 +18,7 @@ let browserCallback = null;
 function openFileBrowser(callback, initialPath = '/music') {
     browserCallback = callback;
     currentBrowserPath = initialPath;
+    browserFilter = '';
     const modalHtml = `
         <div class="modal fade" id="fileBrowserModal" tabindex="-1" aria-labelledby="fileBrowserModalLabel" aria-hidden="true">
             <div class="modal-dialog modal-lg">
@@ -38,9 +45,17 @@ function openFileBrowser(callback, initialPath = '/music') {
                                 <i class="fas fa-check"></i> Select
                             </button>
                         </div>
+                        <input type="text" class="form-control form-control-sm bg-dark border-secondary text-light mb-2"
+                               id="fileBrowserFilter" placeholder="Filter by name..." oninput="onBrowserFilterInput(this.value)">
                         <div class="file-list-container overflow-auto" style="max-height: 400px;">
                             <ul id="fileList" class="list-group"></ul>
                         </div>
+                        <div class="d-flex justify-content-between align-items-center mt-2">
+                            <small id="fileBrowserCount" class="text-muted"></small>
+                            <button type="button" class="btn btn-sm btn-outline-secondary d-none" id="fileBrowserMore" onclick="loadMoreEntries()">
+                                Load more
+                            </button>
+                        </div>
                     </div>
                     <div class="modal-footer border-secondary">
                         <button type="button" class="btn btn-secondary" data-bs-dismiss="modal">Close</button>
@@ -60,11 +75,12 @@ function openFileBrowser(callback, initialPath = '/music') {
 /**
  * Renders the file and directory browser.
  * @param {Array} items - The list of files and directories to display.
+ * @param {boolean} [append=false] - Add to the current list instead of replacing it.
  */
-function renderBrowser(items) {
+function renderBrowser(items, append = false) {
     const fileList = document.getElementById('fileList');
-    fileList.innerHTML = '';
-    if (!items || items.length === 0) {
+    if (!append) fileList.innerHTML = '';
+    if (!append && (!items || items.length === 0)) {
         fileList.innerHTML = '<li class="list-group-item bg-dark text-muted">No items found.</li>';
         return;
     }
@@ -77,6 +93,11 @@ function renderBrowser(items) {
             icon = '<i class="fas fa-folder text-warning me-2"></i>';
             onClickAction = `onclick="browseDirectory('${item.path}')"`;
             li.innerHTML = `${icon}<span class="directory-name" ${onClickAction}>${item.name}</span>`;
+            // Totals appear once the background scanner has reached this directory
+            if (item.size != null) {
+                const tracks = item.audio_files ? `${item.audio_files} audio file${item.audio_files === 1 ? '' : 's'} · ` : '';
+                li.innerHTML += `<span class="badge bg-secondary ms-2">${tracks}${formatBytes(item.size)}</span>`;
+            }
         } else {
             icon = '<i class="fas fa-file text-info me-2"></i>';
             li.innerHTML = `${icon}<span>${item.name}</span>`;
@@ -89,9 +110,17 @@ function renderBrowser(items) {
 /**
  * Browses a directory and fetches its contents.
  * @param {string} path - The path of the directory to browse.
+ * @param {number} [offset=0] - Index of the first entry to fetch; non-zero appends to the list.
  */
-function browseDirectory(path) {
-    fetch(`/api/browse?path=${encodeURIComponent(path)}`)
+function browseDirectory(path, offset = 0) {
+    if (path !== currentBrowserPath && offset === 0) {
+        browserFilter = '';
+        const filterInput = document.getElementById('fileBrowserFilter');
+        if (filterInput) filterInput.value = '';
+    }
+    const params = new URLSearchParams({ path, offset, limit: BROWSER_PAGE_SIZE });
+    if (browserFilter) params.set('q', browserFilter);
+    fetch(`/api/browse?${params}`)
     .then(response => {
         if (!response.ok) {
             const contentType = response.headers.get("content-type");
@@ -105,14 +134,37 @@ function browseDirectory(path) {
     })
     .then(data => {
         currentBrowserPath = data.current_path;
-        renderBrowser(data.items);
+        renderBrowser(data.items, offset > 0);
+        browserLoaded = offset + data.items.length;
         document.getElementById('currentPathInput').value = currentBrowserPath;
+        document.getElementById('fileBrowserCount').textContent =
+            data.total ? `Showing ${browserLoaded} of ${data.total}` : '';
+        document.getElementById('fileBrowserMore').classList.toggle('d-none', browserLoaded >= data.total);
     })
     .catch(error => {
         alert('Error Browse directory: ' + error.message);
     });
 }
 
+/**
+ * Loads the next page of the current directory.
+ */
+function loadMoreEntries() {
+    browseDirectory(currentBrowserPath, browserLoaded);
+}
+
+/**
+ * Re-fetches the current directory filtered by name, debounced while typing.
+ * @param {string} value - The filter text.
+ */
+function onBrowserFilterInput(value) {
+    clearTimeout(browserFilterTimer);
+    browserFilterTimer = setTimeout(() => {
+        browserFilter = value.trim();
+        browseDirectory(currentBrowserPath);
+    }, 250);
+}
+
 /**
  * Navigates up to the parent directory.
  */
@@ -4,24 +4,71 @@
 let currentPage = 1;
 const itemsPerPage = 20;
 let libraryData = [];
-let filteredData = [];
+let totalItems = 0;
 let sortOrder = { column: null, direction: 'asc' };
+let filterTimer = null;
+let libraryRequestId = 0;
+let libraryRevision = null;
+let libraryEpoch = null;
 
 document.addEventListener('DOMContentLoaded', () => {
     fetchLibrary();
 });
 
+const COLUMNAR_MIMETYPE = 'application/vnd.beetiful.columnar+json';
+
+// Turn a columnar item table (one array per field, with dictionary-encoded
+// artist/album/genre columns) back into an array of item objects.
+function decodeColumnar(table) {
+    const items = new Array(table.count);
+    for (let i = 0; i < table.count; i++) items[i] = {};
+    table.fields.forEach(field => {
+        const column = table.columns[field];
+        const dictionary = table.dictionaries[field];
+        for (let i = 0; i < table.count; i++) {
+            items[i][field] = dictionary ? dictionary[column[i]] : column[i];
+        }
+    });
+    return items;
+}
+
+function buildLibraryQuery() {
+    const filterInput = document.getElementById('filterInput');
+    const genreFilterElement = document.getElementById('genreFilter');
+    const params = new URLSearchParams({
+        offset: (currentPage - 1) * itemsPerPage,
+        limit: itemsPerPage
+    });
+    const searchTerm = filterInput ? filterInput.value.trim() : '';
+    const genre = genreFilterElement ? genreFilterElement.value : '';
+    if (searchTerm) params.set('q', searchTerm);
+    if (genre) params.set('genre', genre);
+    if (sortOrder.column) {
+        params.set('sort', sortOrder.column);
+        params.set('order', sortOrder.direction);
+    }
+    return params.toString();
+}
+
 function fetchLibrary() {
     showLibrarySpinner();
-    fetch('/api/library')
+    const requestId = ++libraryRequestId;
+    fetch(`/api/library?${buildLibraryQuery()}`, { headers: { Accept: `${COLUMNAR_MIMETYPE}, application/json;q=0.9` } })
         .then(response => {
             if (!response.ok) throw new Error(`HTTP error! Status: ${response.status}`);
             return response.json();
         })
         .then(data => {
+            // Ignore responses that were superseded by a newer request
+            if (requestId !== libraryRequestId) return;
+            if (data.encoding === 'columnar') data.items = decodeColumnar(data.items);
             if (Array.isArray(data.items)) {
                 libraryData = data.items;
-                applyFilters();
+                totalItems = data.total || 0;
+                libraryRevision = data.revision;
+                libraryEpoch = data.epoch;
+                populateGenreFilter(data.genres || []);
+                displayLibrary();
             } else {
                 const libraryResults = document.getElementById('libraryResults');
                 if (libraryResults) libraryResults.innerHTML = '<tr><td colspan="10">No library data found or unexpected format.</td></tr>';
@@ -33,6 +80,33 @@ function fetchLibrary() {
         });
 }
 
+// Patch the current page with changes since the last load instead of reloading it.
+// Falls back to a full page reload when items were added or removed, since that
+// shifts pagination, or when the server can no longer provide a delta.
+function syncLibraryChanges() {
+    if (libraryRevision === null) {
+        fetchLibrary();
+        return;
+    }
+    const params = new URLSearchParams({ since: libraryRevision, epoch: libraryEpoch || '' });
+    fetch(`/api/library/changes?${params.toString()}`)
+        .then(response => {
+            if (!response.ok) throw new Error(`HTTP error! Status: ${response.status}`);
+            return response.json();
+        })
+        .then(data => {
+            if (data.reset || data.added.length || data.removed.length) {
+                fetchLibrary();
+                return;
+            }
+            const modified = new Map(data.modified.map(item => [item.id, item]));
+            libraryData = libraryData.map(item => modified.get(item.id) || item);
+            libraryRevision = data.revision;
+            displayLibrary();
+        })
+        .catch(() => fetchLibrary());
+}
+
 function showLibrarySpinner(message = 'Loading library...') {
     const libraryResults = document.getElementById('libraryResults');
     if (libraryResults) libraryResults.innerHTML = `<tr><td colspan="10" class="text-center"><i class="fas fa-spinner fa-spin"></i> ${message}</td></tr>`;
@@ -42,15 +116,12 @@ function displayLibrary() {
     const libraryResults = document.getElementById('libraryResults');
     if (!libraryResults) return;
     libraryResults.innerHTML = '';
-    const startIndex = (currentPage - 1) * itemsPerPage;
-    const endIndex = startIndex + itemsPerPage;
-    const itemsToDisplay = filteredData.slice(startIndex, endIndex);
-    if (itemsToDisplay.length === 0) {
+    if (libraryData.length === 0) {
         libraryResults.innerHTML = '<tr><td colspan="10">No tracks found matching your criteria.</td></tr>';
         updatePagination(0);
         return;
     }
-    itemsToDisplay.forEach(item => {
+    libraryData.forEach(item => {
         const row = document.createElement('tr');
         row.innerHTML = `
             <td>${item.title || 'N/A'}</td>
@@ -68,53 +139,23 @@ function displayLibrary() {
                 <button class="btn btn-sm btn-light me-1" onclick="openLyricsModal(${JSON.stringify(item).replace(/"/g, '&quot;')})">
                     <i class="fas fa-file-alt"></i> Lyrics
                 </button>
-                <button class="btn btn-sm btn-danger" onclick="confirmAction('remove', '${item.title}', '${item.artist}', '${item.album}')">
+                <button class="btn btn-sm btn-danger" onclick="confirmAction('remove', ${item.id}, '${item.title}', '${item.artist}', '${item.album}')">
                     <i class="fas fa-trash"></i> Remove
                 </button>
             </td>
         `;
         libraryResults.appendChild(row);
     });
-    updatePagination(filteredData.length);
+    updatePagination(totalItems);
 }
 
 function applyFilters() {
-    const filterInput = document.getElementById('filterInput');
-    const searchTerm = filterInput ? filterInput.value.toLowerCase() : '';
-    const genreFilterElement = document.getElementById('genreFilter');
-    const genreFilter = genreFilterElement ? genreFilterElement.value.toLowerCase() : '';
-    filteredData = [...libraryData];
-    if (searchTerm) {
-        filteredData = filteredData.filter(item =>
-            (item.title && item.title.toLowerCase().includes(searchTerm)) ||
-            (item.artist && item.artist.toLowerCase().includes(searchTerm)) ||
-            (item.album && item.album.toLowerCase().includes(searchTerm)) ||
-            (item.genre && item.genre.toLowerCase().includes(searchTerm))
-        );
-    }
-    if (genreFilter) {
-        filteredData = filteredData.filter(item =>
-            item.genre && item.genre.toLowerCase().includes(genreFilter)
-        );
-    }
-    populateGenreFilter();
-    sortData();
-    currentPage = 1;
-    displayLibrary();
-}
-
-function sortData() {
-    if (!sortOrder.column) return;
-    const column = sortOrder.column;
-    const direction = sortOrder.direction === 'asc' ? 1 : -1;
-    filteredData.sort((a, b) => {
-        const valA = a[column] || '';
-        const valB = b[column] || '';
-        if (typeof valA === 'string' && typeof valB === 'string') return valA.localeCompare(valB) * direction;
-        if (typeof valA === 'number' && typeof valB === 'number') return (valA - valB) * direction;
-        return String(valA).localeCompare(String(valB)) * direction;
-    });
-    displayLibrary();
+    // Debounce typing so each keystroke doesn't trigger a request
+    clearTimeout(filterTimer);
+    filterTimer = setTimeout(() => {
+        currentPage = 1;
+        fetchLibrary();
+    }, 250);
 }
 
 function sortLibrary(column) {
@@ -125,7 +166,8 @@ function sortLibrary(column) {
         sortOrder.direction = 'asc';
     }
     updateSortIndicators();
-    sortData();
+    currentPage = 1;
+    fetchLibrary();
 }
 
 function updateSortIndicators() {
@@ -141,25 +183,18 @@ function updateSortIndicators() {
     });
 }
 
-function populateGenreFilter() {
+function populateGenreFilter(genres) {
     const genreFilter = document.getElementById('genreFilter');
     if (!genreFilter) return;
+    const selected = genreFilter.value;
     genreFilter.innerHTML = '<option value="">All Genres</option>';
-    const genres = new Set();
-    filteredData.forEach(item => {
-        if (item.genre) {
-            item.genre.split(/[,/;]/).forEach(g => {
-                const trimmedGenre = g.trim();
-                if (trimmedGenre) genres.add(trimmedGenre);
-            });
-        }
-    });
-    Array.from(genres).sort().forEach(genre => {
+    genres.forEach(genre => {
         const option = document.createElement('option');
         option.value = genre.toLowerCase();
         option.textContent = genre;
         genreFilter.appendChild(option);
     });
+    genreFilter.value = selected;
 }
 
 function updatePagination(totalItems) {
@@ -183,15 +218,15 @@ function updatePagination(totalItems) {
 function prevPage() {
     if (currentPage > 1) {
         currentPage--;
-        displayLibrary();
+        fetchLibrary();
     }
 }
 
 function nextPage() {
-    const totalPages = Math.ceil(filteredData.length / itemsPerPage);
+    const totalPages = Math.ceil(totalItems / itemsPerPage);
     if (currentPage < totalPages) {
         currentPage++;
-        displayLibrary();
+        fetchLibrary();
     }
 }
 
@@ -249,7 +284,7 @@ function saveChanges() {
         alert(data.message || 'Changes saved successfully!');
         const editModal = bootstrap.Modal.getInstance(document.getElementById('editModal'));
         if (editModal) editModal.hide();
-        fetchLibrary();
+        syncLibraryChanges();
     })
     .catch(error => {
         alert(`Error saving changes: ${error.message}`);
@@ -413,7 +448,7 @@ function saveTrackChanges() {
     saveChanges();
 }
 
-function confirmAction(action, title, artist, album) {
+function confirmAction(action, trackId, title, artist, album) {
     const modalId = 'confirmationModal';
     let modalElement = document.getElementById(modalId);
     if (modalElement) modalElement.remove();
@@ -444,17 +479,17 @@ function confirmAction(action, title, artist, album) {
     `;
     document.body.appendChild(modalElement);
     const confirmButton = document.getElementById('confirmActionButton');
-    confirmButton.onclick = () => { performAction(action, title, artist, album); };
+    confirmButton.onclick = () => { performAction(action, trackId); };
     const confirmationModal = new bootstrap.Modal(modalElement);
     confirmationModal.show();
 }
 
-function performAction(action, title, artist, album) {
-    const endpoint = action === 'delete' ? '/api/library/delete' : '/api/library/remove';
-    fetch(endpoint, {
+function performAction(action, trackId) {
+    // Remove exactly this track by id; files are deleted as with `beet remove -d`
+    fetch('/api/library/bulk-remove', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ title, artist, album })
+        body: JSON.stringify({ ids: [trackId], delete_files: true })
     })
     .then(response => {
         if (!response.ok) return response.json().then(err => { throw new Error(err.error || 'Unknown error'); });
@@ -462,7 +497,7 @@ function performAction(action, title, artist, album) {
     })
     .then(data => {
         alert(data.message || `Track ${action}d successfully.`);
-        fetchLibrary();
+        syncLibraryChanges();
         const modalElement = document.getElementById('confirmationModal');
         if (modalElement) {
             const bootstrapModal = bootstrap.Modal.getInstance(modalElement);
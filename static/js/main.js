@@ -1,6 +1,18 @@
 // Main logic for Beets web UI
 // Handles stats, config, command execution, and UI setup
 
+// Format a number of seconds as e.g. "3d 4h 12m"
+function formatTotalDuration(seconds) {
+    const minutes = Math.floor(seconds / 60);
+    const days = Math.floor(minutes / 1440);
+    const hours = Math.floor((minutes % 1440) / 60);
+    const parts = [];
+    if (days) parts.push(`${days}d`);
+    if (days || hours) parts.push(`${hours}h`);
+    parts.push(`${minutes % 60}m`);
+    return parts.join(' ');
+}
+
 function getStats() {
     showGlobalSpinner('Loading stats...');
     fetch('/api/stats')
@@ -24,11 +36,21 @@ function getStats() {
             if (statusTotalTracks) statusTotalTracks.textContent = tracks;
             if (statusTotalArtists) statusTotalArtists.textContent = artists;
             if (statusTotalAlbums) statusTotalAlbums.textContent = albums;
+            const statusTotalDuration = document.getElementById('statusTotalDuration');
+            const statusTotalSize = document.getElementById('statusTotalSize');
+            const statusFormats = document.getElementById('statusFormats');
+            if (statusTotalDuration) statusTotalDuration.textContent = formatTotalDuration(data.total_duration || 0);
+            if (statusTotalSize) statusTotalSize.textContent = data.total_size || '0 B';
+            if (statusFormats) {
+                const formats = (data.formats || []).map(entry => `${entry.format} (${entry.tracks})`);
+                statusFormats.textContent = formats.length ? formats.join(', ') : 'None';
+            }
         })
         .catch(error => {
             const elements = [
                 'totalTracks', 'totalArtists', 'totalAlbums',
-                'statusTotalTracks', 'statusTotalArtists', 'statusTotalAlbums'
+                'statusTotalTracks', 'statusTotalArtists', 'statusTotalAlbums',
+                'statusTotalDuration', 'statusTotalSize', 'statusFormats'
             ];
             elements.forEach(id => {
                 const element = document.getElementById(id);
@@ -285,10 +307,9 @@ function executeCommand() {
     if (additionalArgs) args.push(additionalArgs);
     const commandResultDiv = document.getElementById('commandResult');
     if (!commandResultDiv) return;
-    commandResultDiv.innerHTML = `<i class="fas fa-spinner fa-spin"></i> Executing ${command}...`;
+    commandResultDiv.innerHTML = `<i class="fas fa-spinner fa-spin"></i> Queuing ${command}...`;
     commandResultDiv.className = 'mt-2 text-info';
-    showGlobalSpinner(`Executing ${command}...`);
-    fetch('/api/execute', {
+    fetch('/api/jobs', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ command: command, args: args.join(' ') })
@@ -297,23 +318,63 @@ function executeCommand() {
         if (!response.ok) return response.json().then(err => { throw new Error(err.error || 'Unknown error'); });
         return response.json();
     })
-    .then(data => {
-        let displayMessage = '';
-        if (data.message) displayMessage += `<i class="fas fa-check-circle"></i> ${data.message}`;
-        if (data.output) displayMessage += `<br><strong>Output:</strong><pre class="mt-2 bg-dark p-2 rounded">${data.output}</pre>`;
-        if (data.error) displayMessage += `<br><span class="text-warning"><i class="fas fa-exclamation-triangle"></i> Warnings/Errors:</span><pre class="mt-2 bg-dark p-2 rounded text-warning">${data.error}</pre>`;
-        commandResultDiv.innerHTML = displayMessage || '<i class="fas fa-check-circle"></i> Command completed';
-        commandResultDiv.className = 'mt-2 text-success';
+    .then(data => followJob(data.job_id, command, commandResultDiv))
+    .catch(error => {
+        commandResultDiv.innerHTML = `<i class="fas fa-times-circle"></i> Error: ${error.message}`;
+        commandResultDiv.className = 'mt-2 text-danger';
+    });
+}
+
+// Follow a background job's output live via Server-Sent Events
+function followJob(jobId, command, resultDiv) {
+    resultDiv.className = 'mt-2 text-info';
+    resultDiv.innerHTML = `
+        <div class="d-flex align-items-center mb-2">
+            <span id="jobStatus"><i class="fas fa-spinner fa-spin"></i> Running ${command}...</span>
+            <button class="btn btn-sm btn-outline-danger ms-3" id="jobCancelButton">
+                <i class="fas fa-stop"></i> Cancel
+            </button>
+        </div>
+        <pre id="jobOutput" class="mt-2 bg-dark p-2 rounded" style="max-height: 400px; overflow-y: auto;"></pre>
+    `;
+    const output = document.getElementById('jobOutput');
+    const status = document.getElementById('jobStatus');
+    const cancelButton = document.getElementById('jobCancelButton');
+    cancelButton.onclick = () => {
+        cancelButton.disabled = true;
+        fetch(`/api/jobs/${jobId}/cancel`, { method: 'POST' });
+    };
+    const source = new EventSource(`/api/jobs/${jobId}/stream`);
+    source.addEventListener('output', event => {
+        const line = JSON.parse(event.data);
+        const span = document.createElement('span');
+        if (line.stream === 'stderr') span.className = 'text-warning';
+        span.textContent = line.text + '\n';
+        output.appendChild(span);
+        output.scrollTop = output.scrollHeight;
+    });
+    source.addEventListener('status', event => {
+        source.close();
+        const job = JSON.parse(event.data);
+        cancelButton.remove();
+        if (job.status === 'succeeded') {
+            status.innerHTML = '<i class="fas fa-check-circle"></i> Command executed successfully';
+            resultDiv.className = 'mt-2 text-success';
+        } else {
+            status.innerHTML = `<i class="fas fa-times-circle"></i> Command ${job.status}`;
+            resultDiv.className = 'mt-2 text-warning';
+        }
         if (['import', 'modify', 'remove', 'update'].includes(command)) {
             if (typeof fetchLibrary === 'function') fetchLibrary();
             getStats();
         }
-    })
-    .catch(error => {
-        commandResultDiv.innerHTML = `<i class="fas fa-times-circle"></i> Error: ${error.message}`;
-        commandResultDiv.className = 'mt-2 text-danger';
-    })
-    .finally(() => hideGlobalSpinner());
+    });
+    source.onerror = () => {
+        // EventSource reconnects on its own (resuming via Last-Event-ID) unless closed
+        if (source.readyState === EventSource.CLOSED) {
+            status.innerHTML = '<i class="fas fa-times-circle"></i> Lost connection to job';
+        }
+    };
 }
 
 // Fetch and display lyrics for a track
@@ -79,6 +79,24 @@ function renderPluginCard(plugin, isEnabled) {
     `;
 }
 
+// Rediscover installed plugins, e.g. after installing a package
+function refreshPlugins() {
+    showPluginsSpinner('Rescanning installed plugins...');
+    fetch('/api/plugins/refresh', { method: 'POST' })
+        .then(response => {
+            if (!response.ok) return response.json().then(err => { throw new Error(err.error || `HTTP error! Status: ${response.status}`); });
+            return response.json();
+        })
+        .then(data => {
+            pluginsData = data;
+            renderPlugins(data);
+        })
+        .catch(error => {
+            const pluginsList = document.getElementById('pluginsList');
+            if (pluginsList) pluginsList.innerHTML = '<div class="alert alert-danger">Error refreshing plugins: ' + error.message + '</div>';
+        });
+}
+
 // Install a plugin (built-in plugins show an alert)
 function installPlugin(pluginName) {
     alert(`The ${pluginName} plugin is built into beets 2.3.1. Just click "Enable" to activate it!`);